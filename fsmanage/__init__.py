@@ -88,26 +88,18 @@ future
  * other implementations of functions/abstract classes
  * for lots of arguments taking instances, default is None to create (a specific type of) one with default args
 
- * progress reporting (and events for start/stop operations - maybe also events for progress from any operation?)
- * cancelling/pausing operations
  * transparent archives - open as dirs
- * retry behaviour for operations
  * metadata caching (how to expire?)
  * links (Link(OperableItem), Link(Operation), Link(Action))
  * can intercept and handle confirmations in ActionManager
- * operation manager exposes running operations and current progress
  * operation manager: max number of get_metadata runners
  * history
     * something to handle HistoryActionResult.FAILED - option to reject all work if this happens?
-    * can set max number of running events
-        * events can contribute more than 1
-        * move support for event groups and allow_running to History
-        * can say events conflict with each other somehow?
-    * has optional branching behaviour - .redo([branch=most recent])
+    * running events can contribute more than 1 towards max_running
+    * move support for event groups and allow_running to History
     * more flexible expiry methods
         * pass sequence of HistoryExpiration which each determine when to expire an event
     * put in separate package
-    * can initialise .events/.position on creation
     * make results available (HistoryActionResult)
  * qt metadata viewer/editor (action: 'properties' or something)
  * qt History viewer/editor (events need icon and text)
@@ -116,7 +108,19 @@ future
 
 from .item import *
 from .history import *
+from .sequence import *
 from .operation import *
 from .opexec import *
+from .schedule import *
+from .progress import *
+from .retry import *
+from .device import *
+from .throttle import *
+from .journal import *
+from .undostore import *
 from .action import *
 from .actionexec import *
+from .snapshot import *
+from .search import *
+from .dupes import *
+from .filesystem import *
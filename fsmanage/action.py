@@ -1,5 +1,7 @@
 import abc
 
+from . import util
+
 
 class ActionTarget (metaclass=abc.ABCMeta):
     """A target for an :class:`Action`.
@@ -12,7 +14,7 @@ met.
 """
 
     @abc.abstractmethod
-    def context_matches (context, op_manager):
+    def context_matches (self, context, op_manager):
         """Determine if this actions conditions are met.
 
 :arg context: information needed to match against conditions - depends on the
@@ -42,7 +44,7 @@ an action on.  It matches if all items match ``item_filter``.
     def __init__ (self, item_filter=None):
         pass
 
-    def context_matches (self, items):
+    def context_matches (self, items, op_manager):
         """:inherit:"""
         pass
 
@@ -57,7 +59,7 @@ The context matches if exactly one item is selected and it matches
 
 """
 
-    def context_matches (self, items):
+    def context_matches (self, items, op_manager):
         """:inherit:"""
         pass
 
@@ -80,7 +82,7 @@ required properties should be reflected in further usages of the state.
         #: ``properties`` argument.
         self.properties = None
 
-    def context_matches (self, state):
+    def context_matches (self, state, op_manager):
         """:inherit:"""
         pass
 
@@ -100,7 +102,7 @@ used across all actions.
     def __init__ (self, match_history=None):
         pass
 
-    def context_matches (self, history):
+    def context_matches (self, history, op_manager):
         """:inherit:"""
         pass
 
@@ -126,7 +128,7 @@ items.
         #: ``item_filter`` argument.
         self.item_filter = None
 
-    def context_matches (self, history):
+    def context_matches (self, history, op_manager):
         """:inherit:"""
         # gets cwd from history (what to do with None?)
         # use item filter matching
@@ -147,7 +149,7 @@ results, they just have effects - usually interacting with the ``manager``.
 
     def __init__ (self, manager):
         #: ``manager`` argument.
-        self.manager = None
+        self.manager = manager
 
     @property
     @abc.abstractmethod
@@ -179,8 +181,7 @@ These are the targets used to determine if this action can be run.
 """
         pass
 
-    @staticmethod
-    def context_matches_target (op_manager, *target_contexts):
+    def context_matches_target (self, op_manager, *target_contexts):
         """Determine if this action can be run.
 
 :arg op_manager: :class:`OperationManager <fsmanage.opexec.OperationManager>`
@@ -194,7 +195,11 @@ These are the targets used to determine if this action can be run.
 An action can be run if all contexts match their corresponding targets.
 
 """
-        pass
+        future_type = op_manager.executor.future_type
+        return util.chain(future_type, util.gather(future_type, [
+            target.context_matches(context, op_manager)
+            for target, context in zip(self.target, target_contexts)
+        ]), all)
 
     @abc.abstractmethod
     def execute (self, op_manager, *target_contexts):
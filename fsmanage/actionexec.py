@@ -1,5 +1,6 @@
 from .item import ROOT
-from .history import HistoryEvent, History
+from .history import HistoryEventResult, HistoryEvent, History
+from . import util
 
 
 class ActionManager:
@@ -14,10 +15,46 @@ To make actions available for executing, call :meth:`add_actions`.
 
     def __init__ (self, op_manager):
         #: ``op_manager`` argument.
-        self.operation_manager = None
+        self.operation_manager = op_manager
         #: :class:`set` of :class:`Action <fsmanage.action.Action>` subclasses
         #: supported; call :meth:`add_actions` to add more.
-        self.supported_actions = None
+        self.supported_actions = set()
+        # supported ActionTarget subclass -> get_context
+        self._contexts = {}
+        # Action subclass -> instance
+        self._actions = {}
+        # Action subclass -> supported ActionTarget subclass handling each of
+        # its targets
+        self._targets = {}
+        # supported ActionTarget subclass -> set of Action subclasses with a
+        # target it handles, so context changes only re-check those actions
+        self._dependents = {}
+        # Action subclass -> on_context_update callbacks
+        self._callbacks = {}
+
+    def _target_type (self, target):
+        # get the supported ActionTarget subclass handling a target instance,
+        # or None
+        for cls in type(target).__mro__:
+            if cls in self._contexts:
+                return cls
+        return None
+
+    def _index (self, action):
+        # add an action to _targets and _dependents
+        types = [self._target_type(target)
+                 for target in self._actions[action].target]
+        self._targets[action] = types
+        for target_type in types:
+            self._dependents.setdefault(target_type, set()).add(action)
+
+    def _unindex (self, action):
+        for target_type in self._targets.pop(action):
+            dependents = self._dependents.get(target_type)
+            if dependents is not None:
+                dependents.discard(action)
+                if not dependents:
+                    del self._dependents[target_type]
 
     def support_target (self, target, get_context):
         """Add support for a type of :class:`ActionTarget
@@ -34,8 +71,17 @@ previously registered.
 Whenever you call this function, you should also set up calls to
 :meth:`context_changed` for the target's context.
 
+Targets are handled by the closest supported class they inherit from, so
+supporting a subclass of a supported target takes over handling its instances.
+
 """
-        pass
+        new = target not in self._contexts
+        self._contexts[target] = get_context
+        if new:
+            # may take over targets of added actions
+            for action in self._actions:
+                self._unindex(action)
+                self._index(action)
 
     def context_changed (self, target):
         """Notify this action manager that the context for a target type has
@@ -46,11 +92,44 @@ changed.
 
 :raises TypeError: if ``target`` is not a supported target type.
 
-This should be called for every change, if possible.
+This should be called for every change, if possible.  Only actions with a
+target handled by ``target`` are checked again (see :meth:`on_context_update`),
+so this takes time proportional to the number of such actions with callbacks
+registered.  Each context those actions need is only retrieved once.
 
 """
-        # lets us know the context for the target changed
-        pass
+        if target not in self._contexts:
+            raise TypeError('unsupported target type:', target)
+        contexts = {}
+        for action in tuple(self._dependents.get(target, ())):
+            if self._callbacks.get(action):
+                self._update(action, contexts)
+
+    def _get_contexts (self, action, contexts=None):
+        # contexts is a dict of target type -> context already retrieved, which
+        # gets any others added
+        if contexts is None:
+            contexts = {}
+        for target_type in self._targets[action]:
+            if target_type not in contexts:
+                contexts[target_type] = self._contexts[target_type]()
+        return [contexts[target_type]
+                for target_type in self._targets[action]]
+
+    def _update (self, action, contexts):
+        # call on_context_update callbacks for an action, sharing retrieved
+        # contexts as for _get_contexts
+        instance = self._actions[action]
+        fns = tuple(self._callbacks[action])
+
+        def done (future):
+            matches = future.exception() is None and bool(future.result())
+            for fn in fns:
+                fn(action, matches)
+
+        instance.context_matches_target(
+            self.operation_manager, *self._get_contexts(action, contexts)
+        ).add_done_callback(done)
 
     def on_context_update (self, fn, *actions):
         """Register a callback function for changes to the context of any of an
@@ -68,13 +147,19 @@ action's targets.
     callbacks for.
 
 If ``fn`` is registered twice as the handler for the same action type, it will
-still only be called once for each context change.
+still only be called once for each context change.  If checking the context
+fails, ``matches`` is :obj:`False`.
 
 :raises TypeError: if any action in ``actions`` is not a supported action type.
 
 """
-        # triggered by .context_changed calls
-        pass
+        for action in actions:
+            if action not in self.supported_actions:
+                raise TypeError('unsupported action type:', action)
+        for action in actions:
+            fns = self._callbacks.setdefault(action, [])
+            if fn not in fns:
+                fns.append(fn)
 
     def add_actions (self, *actions):
         """Make actions available for executing via :meth:`execute`.
@@ -95,20 +180,42 @@ For an action to be supported, it needs support for:
   ``fsmanage`` can be added using the ``action_manager_support_*`` functions in
   this module.
 
+If any action can't be supported, none are added.
+
 """
-        # instantiates actions when storing
-        pass
+        new = {}
+        supported_ops = self.operation_manager.executor.supported_operations
+        for action in actions:
+            if action in self.supported_actions or action in new:
+                continue
+            instance = action(self)
+            for op in instance.operations:
+                if op not in supported_ops:
+                    raise TypeError('unsupported operation type:', op)
+            for target in instance.target:
+                if self._target_type(target) is None:
+                    raise TypeError('unsupported target type:', type(target))
+            new[action] = instance
+        for action, instance in new.items():
+            self._actions[action] = instance
+            self.supported_actions.add(action)
+            self._index(action)
 
     def rm_actions (self, *actions):
         """Remove support for actions.
 
 :arg actions: :class:`Action <fsmanage.action.Action>` subclasses to remove.
 
-If an action type has not been added, removing it has no effect.
+If an action type has not been added, removing it has no effect.  This also
+removes callbacks registered for the actions through :meth:`on_context_update`.
 
 """
-        # removes functions added through on_context_update
-        pass
+        for action in actions:
+            if action in self.supported_actions:
+                self.supported_actions.remove(action)
+                self._unindex(action)
+                del self._actions[action]
+                self._callbacks.pop(action, None)
 
     def execute (self, action):
         """Run an action.
@@ -118,8 +225,19 @@ If an action type has not been added, removing it has no effect.
 :raises ValueError: if ``action`` is not supported.
 
 """
-        # calls action.context_matches_target then .execute if matches
-        pass
+        if action not in self.supported_actions:
+            raise ValueError('unsupported action type:', action)
+        instance = self._actions[action]
+        contexts = self._get_contexts(action)
+
+        def run (matches):
+            if matches:
+                instance.execute(self.operation_manager, *contexts)
+
+        util.chain(
+            self.operation_manager.executor.future_type,
+            instance.context_matches_target(self.operation_manager, *contexts),
+            run)
 
     def attention (self, attn_type, items):
         # attn_type: AttentionItems.CHANGED/MARKED
@@ -166,9 +284,51 @@ class NavigationHistoryEvent (HistoryEvent):
 
     def __init__ (self, path_before=None, path_after=None):
         #: ``path_before`` argument.
-        self.path_before = None
+        self.path_before = path_before
         #: ``path_after`` argument.
-        self.path_after = None
+        self.path_after = path_after
+
+    def execute (self, future_type):
+        """:inherit:
+
+The :class:`HistoryEventResult <fsmanage.history.HistoryEventResult>`'s
+``result`` is :attr:`path_after`.
+
+"""
+        return util.resolved(future_type, HistoryEventResult(
+            HistoryEventResult.SUCCESS, self.path_after))
+
+    def undo (self, future_type):
+        """:inherit:
+
+The :class:`HistoryEventResult <fsmanage.history.HistoryEventResult>`'s
+``result`` is :attr:`path_before`.
+
+"""
+        return util.resolved(future_type, HistoryEventResult(
+            HistoryEventResult.SUCCESS, self.path_before))
+
+    def merge (self, event):
+        """:inherit:
+
+Navigating from ``A`` to ``B`` and then from ``B`` to ``C`` combines into
+navigating from ``A`` to ``C``.
+
+"""
+        if (isinstance(event, NavigationHistoryEvent) and
+                event.path_before == self.path_after):
+            return NavigationHistoryEvent(self.path_before, event.path_after)
+        return None
+
+    @property
+    def has_effect (self):
+        """:inherit:
+
+Navigation has no effect if :attr:`path_before` and :attr:`path_after` are the
+same.
+
+"""
+        return self.path_before != self.path_after
 
 
 class NavigationHistory (History):
@@ -181,6 +341,8 @@ class NavigationHistory (History):
     - a sequence of paths use the items at those paths.
 
 Other arguments are as taken by :class:`History <fsmanage.history.History>`.
+Pass ``coalesce_window`` to combine navigation in quick succession into a
+single event.
 
 """
 
@@ -192,12 +354,23 @@ Other arguments are as taken by :class:`History <fsmanage.history.History>`.
     cwd = None
 
     def __init__ (self, root=(), *args, **kwargs):
+        History.__init__(self, *args, **kwargs)
         #: ``root`` argument.
-        self.root = None
+        self.root = root
+        self.on_change(self._update_cwd)
+
+    def _update_cwd (self, event, result):
+        if result.state == HistoryEventResult.SUCCESS:
+            self.cwd = result.result
 
     def navigate (self, path):
-        """Change the current directory to the given path."""
-        pass
+        """Change the current directory to the given path.
+
+:returns: :attr:`future <fsmanage.history.History.future_type>` as returned by
+    :meth:`add <fsmanage.history.History.add>`.
+
+"""
+        return self.add(NavigationHistoryEvent(self.cwd, path))
 
 
 def action_manager_support_navigation (manager, history):
@@ -0,0 +1,174 @@
+import threading
+import collections
+
+from . import util
+
+
+class DeviceScheduler:
+    """Limit how many executor calls use each device at once, sharing devices
+fairly.
+
+Calls are submitted with the devices they use (see
+:meth:`OperationExecutor.operation_devices
+<fsmanage.opexec.OperationExecutor.operation_devices>`) and an owner, such as
+the :class:`OperationControl <fsmanage.opexec.OperationControl>` of the
+operations making the call.  A call starts once every device it uses has a
+free slot.  While calls wait, owners take turns: each time a slot is freed, the
+owner which least recently started a call goes first, so one large group of
+operations doesn't hold up a small one queued behind it.  Each owner's calls
+start in the order they were submitted, except that calls waiting for busy
+devices don't hold up calls which use other devices.
+
+Devices with no limit aren't tracked, so calls using only those start
+immediately.
+
+"""
+
+    def __init__ (self):
+        # device -> [number of calls using it, limit]
+        self._running = {}
+        # owner -> {devices key: deque of (serial, devices, start, result)}, in
+        # submission order; grouping calls by the devices they use means
+        # finding a call to start doesn't involve looking at every call
+        self._waiting = {}
+        # owner -> [serial of the last call it started, number of calls it
+        # has running], while it has calls waiting or running
+        self._owners = {}
+        self._serial = 0
+        self._dispatching = False
+        self._dispatch_again = False
+        self._lock = threading.Lock()
+
+    @property
+    def running (self):
+        """:class:`dict` giving the number of calls using each limited device
+that is in use."""
+        with self._lock:
+            return {device: n for device, (n, limit)
+                    in self._running.items()}
+
+    @property
+    def waiting (self):
+        """Number of calls waiting to start."""
+        with self._lock:
+            return sum(len(queue) for queues in self._waiting.values()
+                       for queue in queues.values())
+
+    def submit (self, future_type, devices, owner, start):
+        """Start a call once its devices are available.
+
+:arg future_type: type of future to return (see
+    :attr:`OperationExecutor.future_type
+    <fsmanage.opexec.OperationExecutor.future_type>`).
+:arg devices: :class:`dict` mapping each device the call uses to the maximum
+    number of calls which may use it at once, or :obj:`None` for no limit.
+    While a device is in use, the limit given by the first call to use it
+    applies.
+:arg owner: hashable object the call is queued for.
+:arg start: function taking no arguments which starts the call and returns a
+    future which completes when it finishes.
+
+:returns: future with the outcome of the future returned by ``start``.
+
+"""
+        devices = {device: limit for device, limit in devices.items()
+                   if limit is not None}
+        result = future_type()
+        if not devices:
+            self._start(owner, devices, start, result)
+            return result
+        with self._lock:
+            self._serial += 1
+            queues = self._waiting.setdefault(owner, {})
+            queues.setdefault(frozenset(devices.items()),
+                              collections.deque()).append(
+                (self._serial, devices, start, result))
+            self._owners.setdefault(owner, [0, 0])
+        self._dispatch()
+        return result
+
+    def _start (self, owner, devices, start, result):
+        try:
+            future = start()
+        except Exception as e:
+            future = util.failed(type(result), e)
+        future.add_done_callback(
+            lambda future: self._finished(owner, devices, future, result))
+
+    def _finished (self, owner, devices, future, result):
+        if devices:
+            with self._lock:
+                for device in devices:
+                    n = self._running[device][0] - 1
+                    if n:
+                        self._running[device][0] = n
+                    else:
+                        del self._running[device]
+                state = self._owners[owner]
+                state[1] -= 1
+                if not state[1] and owner not in self._waiting:
+                    del self._owners[owner]
+        util.relay(future, result)
+        if devices:
+            self._dispatch()
+
+    def _available (self, devices):
+        # call with lock held
+        for device, limit in devices.items():
+            n, limit = self._running.get(device, (0, limit))
+            if n >= limit:
+                return False
+        return True
+
+    def _next (self):
+        # call with lock held; find and claim the next call to start, or
+        # return None
+        best = None
+        for owner, queues in self._waiting.items():
+            if (best is not None and
+                    self._owners[owner][0] >= self._owners[best[0]][0]):
+                continue
+            # the earliest call this owner can start
+            first = None
+            for key, queue in queues.items():
+                if ((first is None or queue[0][0] < queues[first][0][0]) and
+                        self._available(queue[0][1])):
+                    first = key
+            if first is not None:
+                best = (owner, first)
+        if best is None:
+            return None
+
+        owner, key = best
+        queues = self._waiting[owner]
+        serial, devices, start, result = queues[key].popleft()
+        if not queues[key]:
+            del queues[key]
+            if not queues:
+                del self._waiting[owner]
+        self._serial += 1
+        state = self._owners[owner]
+        state[0] = self._serial
+        state[1] += 1
+        for device, limit in devices.items():
+            self._running.setdefault(device, [0, limit])[0] += 1
+        return (owner, devices, start, result)
+
+    def _dispatch (self):
+        # only one thread starts calls at a time; this also stops the stack
+        # from growing when calls complete as soon as they start
+        with self._lock:
+            if self._dispatching:
+                self._dispatch_again = True
+                return
+            self._dispatching = True
+        while True:
+            with self._lock:
+                call = self._next()
+                if call is None:
+                    if self._dispatch_again:
+                        self._dispatch_again = False
+                        continue
+                    self._dispatching = False
+                    return
+            self._start(*call)
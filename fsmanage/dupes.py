@@ -0,0 +1,322 @@
+import os
+import threading
+import hashlib
+import concurrent.futures
+
+from .item import Dir, File
+from .operation import Delete
+
+
+def open_path (root, path):
+    """Open a file in the local filesystem for reading.
+
+:arg root: real path to the directory that item paths are relative to.
+:arg path: :attr:`Item.path <fsmanage.item.Item.path>` of the file.
+
+:returns: file object opened in binary mode.
+
+Suitable for use as the ``open_item`` argument to :class:`DuplicateFinder`,
+using :func:`functools.partial` to fix ``root``.
+
+"""
+    return open(os.path.join(root, *path), 'rb')
+
+
+def _hash_ends (open_item, paths, block_size, algorithm):
+    # stage 2: hash the first and last blocks of each file
+    results = []
+    for path, size in paths:
+        try:
+            with open_item(path) as f:
+                h = hashlib.new(algorithm, f.read(block_size))
+                if size > block_size:
+                    f.seek(max(block_size, size - block_size))
+                    h.update(f.read(block_size))
+        except OSError:
+            results.append(None)
+        else:
+            results.append(h.digest())
+    return results
+
+
+def _hash_all (open_item, paths, block_size, algorithm):
+    # stage 3: hash the whole of each file
+    results = []
+    buf = bytearray(max(block_size, 1 << 20))
+    view = memoryview(buf)
+    for path, size in paths:
+        h = hashlib.new(algorithm)
+        try:
+            with open_item(path) as f:
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    h.update(view[:n])
+        except OSError:
+            results.append(None)
+        else:
+            results.append(h.digest())
+    return results
+
+
+class DuplicateFinder:
+    """Find files with identical contents.
+
+:arg op_manager: :class:`OperationManager <fsmanage.opexec.OperationManager>`
+    used to list directories and query file sizes (the ``size`` metadata
+    property must be supported).
+:arg open_item: function taking an :attr:`Item.path
+    <fsmanage.item.Item.path>` and returning a binary file object for reading
+    the item's contents.  This is called in ``pool``, so for a process pool it
+    must be picklable (see :func:`open_path`).
+:arg pool: :class:`concurrent.futures.Executor` used to read and hash files.
+    If :obj:`None`, a :class:`concurrent.futures.ProcessPoolExecutor` is
+    created when first needed, and shut down by :meth:`close`.
+:arg block_size: size of the blocks read from the start and end of files, in
+    bytes.
+:arg batch_size: maximum number of files hashed by a single task submitted to
+    ``pool``.
+:arg min_size: files smaller than this many bytes are ignored.
+:arg algorithm: name of the :mod:`hashlib` algorithm used to compare contents.
+
+Searching proceeds in stages, where each stage only looks at files which could
+still be duplicates after the previous stage:
+
+- files are grouped by size.
+- files which share a size with another file have their first and last blocks
+  hashed.
+- files which still match another file have their entire contents hashed.
+
+Stages overlap: as soon as a second file with some size is found, both are
+queued for hashing, and so on.
+
+"""
+
+    def __init__ (self, op_manager, open_item, pool=None, block_size=4096,
+                  batch_size=64, min_size=1, algorithm='sha256'):
+        #: ``op_manager`` argument.
+        self.operation_manager = op_manager
+        #: ``open_item`` argument.
+        self.open_item = open_item
+        #: ``block_size`` argument.
+        self.block_size = block_size
+        #: ``batch_size`` argument.
+        self.batch_size = batch_size
+        #: ``min_size`` argument.
+        self.min_size = min_size
+        #: ``algorithm`` argument.
+        self.algorithm = algorithm
+        self._pool = pool
+        self._own_pool = pool is None
+
+    @property
+    def pool (self):
+        """:class:`concurrent.futures.Executor` used to hash files."""
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor()
+        return self._pool
+
+    def close (self):
+        """Release resources created by this instance (the default
+``pool``)."""
+        if self._own_pool and self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def find (self, items):
+        """Search for duplicates.
+
+:arg items: sequence of :class:`Item <fsmanage.item.Item>` instances to
+    search; :class:`Dir <fsmanage.item.Dir>` instances are searched
+    recursively, :class:`File <fsmanage.item.File>` instances are compared,
+    and anything else is ignored.
+
+:returns: :attr:`future <fsmanage.opexec.OperationExecutor.future_type>` whose
+    result is a :class:`list` of groups of duplicates, largest files first.
+    Each group is a :class:`tuple` of at least two :class:`File
+    <fsmanage.item.File>` instances, ordered by path.  Files that cannot be
+    queried or read are left out.
+
+"""
+        future = self.operation_manager.executor.future_type()
+        _Search(self, future).start(items)
+        return future
+
+
+class _Search:
+    # state for a single DuplicateFinder.find call
+
+    def __init__ (self, finder, future):
+        self.finder = finder
+        self.future = future
+        self.lock = threading.Lock()
+        # number of queries or hashing tasks running
+        self.pending = 0
+        # size -> [item]
+        self.by_size = {}
+        # (size, hash of ends) -> [item]
+        self.by_ends = {}
+        # (size, hash of all) -> [item]
+        self.by_all = {}
+        # queued work for the pool: [(item, size)]
+        self.ends_queue = []
+        self.all_queue = []
+
+    def start (self, items):
+        self.begin()
+        for item in items:
+            self.visit(item)
+        self.end()
+
+    def begin (self):
+        with self.lock:
+            self.pending += 1
+
+    def end (self):
+        flush = []
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                # nothing else will add to the queues, so send off what's left
+                flush = self.take_batches(True)
+                finished = not flush
+            else:
+                finished = False
+        for batch in flush:
+            self.submit(*batch)
+        if finished:
+            self.future.set_result(self.results())
+
+    def visit (self, item):
+        op_manager = self.finder.operation_manager
+        if isinstance(item, Dir):
+            self.begin()
+            op_manager.get_metadata(item, 'items').add_done_callback(
+                self.listed)
+        elif isinstance(item, File):
+            self.begin()
+            op_manager.get_metadata(item, 'size').add_done_callback(
+                lambda future: self.sized(item, future))
+
+    def listed (self, future):
+        try:
+            if future.exception() is None:
+                for item in future.result().get('items', ()):
+                    self.visit(item)
+        finally:
+            self.end()
+
+    def sized (self, item, future):
+        try:
+            if future.exception() is not None:
+                return
+            size = future.result().get('size')
+            if size is None or size < self.finder.min_size:
+                return
+            with self.lock:
+                group = self.by_size.setdefault(size, [])
+                group.append(item)
+                if size > 0:
+                    self.enqueue(self.ends_queue, group, size)
+                batches = self.take_batches()
+            for batch in batches:
+                self.submit(*batch)
+        finally:
+            self.end()
+
+    def enqueue (self, queue, group, size):
+        # queue work for the last item added to group, and for the first item
+        # if it was waiting for a match
+        if len(group) == 2:
+            queue.append((group[0], size))
+        if len(group) >= 2:
+            queue.append((group[-1], size))
+
+    def take_batches (self, all=False):
+        batch_size = self.finder.batch_size
+        batches = []
+        for fn, queue in ((_hash_ends, self.ends_queue),
+                          (_hash_all, self.all_queue)):
+            while len(queue) >= batch_size or (all and queue):
+                batches.append((fn, queue[:batch_size]))
+                del queue[:batch_size]
+        return batches
+
+    def submit (self, fn, batch):
+        finder = self.finder
+        self.begin()
+        try:
+            task = finder.pool.submit(
+                fn, finder.open_item,
+                [(item.path, size) for item, size in batch],
+                finder.block_size, finder.algorithm)
+        except Exception:
+            self.end()
+            raise
+        task.add_done_callback(
+            lambda task: self.hashed(fn is _hash_all, batch, task))
+
+    def hashed (self, full, batch, task):
+        try:
+            if task.exception() is not None:
+                return
+            conclusive_size = 2 * self.finder.block_size
+            with self.lock:
+                for (item, size), digest in zip(batch, task.result()):
+                    if digest is None:
+                        continue
+                    if full:
+                        self.by_all.setdefault((size, digest), []).append(item)
+                    else:
+                        group = self.by_ends.setdefault((size, digest), [])
+                        group.append(item)
+                        # if the ends cover the whole file, we already know
+                        if size > conclusive_size:
+                            self.enqueue(self.all_queue, group, size)
+                batches = self.take_batches()
+            for batch in batches:
+                self.submit(*batch)
+        finally:
+            self.end()
+
+    def results (self):
+        conclusive_size = 2 * self.finder.block_size
+        groups = [(0, items) for size, items in self.by_size.items()
+                  if size == 0]
+        groups.extend((size, items)
+                      for (size, digest), items in self.by_ends.items()
+                      if size <= conclusive_size)
+        groups.extend((size, items)
+                      for (size, digest), items in self.by_all.items())
+        groups.sort(key=lambda group: -group[0])
+        return [tuple(sorted(items, key=lambda item: item.path))
+                for size, items in groups if len(items) >= 2]
+
+
+def delete_duplicates (op_manager, groups, keep=None, confirm=None):
+    """Delete all but one file from each group of duplicates.
+
+:arg op_manager: :class:`OperationManager <fsmanage.opexec.OperationManager>`
+    to execute operations with.
+:arg groups: sequence of groups of duplicates, as returned by
+    :meth:`DuplicateFinder.find`.
+:arg keep: function taking a group and returning the item in it to keep.  By
+    default, the first item is kept.
+:arg confirm: as taken by :meth:`OperationManager.execute
+    <fsmanage.opexec.OperationManager.execute>`.
+
+:returns: result of :meth:`OperationManager.execute
+    <fsmanage.opexec.OperationManager.execute>`.
+
+All :class:`Delete <fsmanage.operation.Delete>` operations are executed as a
+single group, so they are undone together.
+
+"""
+    if keep is None:
+        keep = lambda group: group[0]
+    ops = []
+    for group in groups:
+        kept = keep(group)
+        ops.extend(Delete(item) for item in group if item != kept)
+    return op_manager.execute(ops, confirm)
@@ -0,0 +1,1254 @@
+import os
+import io
+import stat
+import json
+import errno
+import uuid
+import weakref
+import threading
+import concurrent.futures
+
+from .item import Dir, OperableItem, OperableDir, File, AttentionItems
+from .operation import (OperationException, CancelledException,
+                        BatchOperationException, Copy, Move, Delete,
+                        TRANSIENT_ERRNOS)
+from .opexec import OperationExecutor
+from . import util
+
+# errors from copy_file_range/sendfile meaning that it can't be used for the
+# files in question, so we should try something else
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                    errno.ENOTSUP, errno.EBADF, errno.EPERM, errno.ETXTBSY,
+                    errno.EOVERFLOW}
+# errors that stop an operation part-way through
+_ERRORS = (OSError, CancelledException)
+# types of filesystems which store data on other machines
+_NETWORK_FS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', '9p', 'afs',
+               'ceph', 'glusterfs', 'fuse.glusterfs', 'fuse.sshfs',
+               'fuse.s3fs'}
+
+
+def _copy_data (src, dest, size, chunk_size, buffer_size, progress=None):
+    # copy from file descriptor src to dest, from the start of both, until the
+    # end of src; size is a hint for the expected amount of data; progress is
+    # called with the number of bytes copied after each chunk
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while True:
+                n = os.copy_file_range(src, dest, chunk_size, copied, copied)
+                if n == 0:
+                    break
+                copied += n
+                if progress is not None:
+                    progress(n)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+        # some filesystems report EOF early, so only trust this if we got
+        # as much as we expected
+        if copied >= size and copied > 0:
+            return copied
+
+    os.lseek(dest, copied, os.SEEK_SET)
+    if hasattr(os, 'sendfile'):
+        try:
+            while True:
+                n = os.sendfile(dest, src, copied, chunk_size)
+                if n == 0:
+                    break
+                copied += n
+                if progress is not None:
+                    progress(n)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            os.lseek(dest, copied, os.SEEK_SET)
+        else:
+            return copied
+
+    os.lseek(src, copied, os.SEEK_SET)
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with io.FileIO(src, 'r', closefd=False) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            written = 0
+            while written < n:
+                written += os.write(dest, view[written:n])
+            copied += n
+            if progress is not None:
+                progress(n)
+    return copied
+
+
+def _copy_xattrs (src, dest, follow_symlinks=True):
+    # src and dest are paths or file descriptors
+    if not hasattr(os, 'listxattr'):
+        return
+    try:
+        names = os.listxattr(src, follow_symlinks=follow_symlinks)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+            return
+        raise
+    for name in names:
+        try:
+            value = os.getxattr(src, name, follow_symlinks=follow_symlinks)
+            os.setxattr(dest, name, value, follow_symlinks=follow_symlinks)
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.ENODATA,
+                               errno.EINVAL):
+                raise
+
+
+def _copy_metadata (st, src, dest, follow_symlinks=True):
+    # copy ownership, permissions, extended attributes and times, in that
+    # order, since changing ownership can reset permissions, and anything
+    # else can change times; src and dest are paths or file descriptors
+    kwargs = {} if follow_symlinks else {'follow_symlinks': False}
+    try:
+        os.chown(dest, st.st_uid, st.st_gid, **kwargs)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            raise
+    if follow_symlinks or os.chmod in os.supports_follow_symlinks:
+        try:
+            os.chmod(dest, stat.S_IMODE(st.st_mode), **kwargs)
+        except NotImplementedError:
+            pass
+    _copy_xattrs(src, dest, follow_symlinks)
+    if follow_symlinks or os.utime in os.supports_follow_symlinks:
+        os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns), **kwargs)
+
+
+def _restore_metadata (path, entry):
+    # restore ownership, permissions and times from a manifest entry (see
+    # FilesystemOperationExecutor._preserve), in the same order as
+    # _copy_metadata
+    rel, kind, mode, atime, mtime, uid, gid, data = entry
+    follow_symlinks = kind != 'l'
+    kwargs = {} if follow_symlinks else {'follow_symlinks': False}
+    try:
+        os.chown(path, uid, gid, **kwargs)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            raise
+    if follow_symlinks:
+        os.chmod(path, stat.S_IMODE(mode))
+    if follow_symlinks or os.utime in os.supports_follow_symlinks:
+        os.utime(path, ns=(atime, mtime), **kwargs)
+
+
+def _mount_type (dev):
+    # type of the filesystem mounted from a device, or None if unknown; only
+    # works on Linux
+    dev_id = '{}:{}'.format(os.major(dev), os.minor(dev))
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                fields = line.split()
+                if fields[2] == dev_id:
+                    return fields[fields.index('-') + 1]
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _rotational (dev):
+    # whether a block device is a spinning disk, or None if unknown; only works
+    # on Linux
+    sys_path = os.path.realpath('/sys/dev/block/{}:{}'.format(
+        os.major(dev), os.minor(dev)))
+    # partitions have their disk's queue in the parent directory
+    for path in (sys_path, os.path.dirname(sys_path)):
+        try:
+            with open(os.path.join(path, 'queue', 'rotational')) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            pass
+    return None
+
+
+def _slow_device (dev):
+    # whether a device is slowed down by concurrent access
+    return _mount_type(dev) in _NETWORK_FS or bool(_rotational(dev))
+
+
+class _Node:
+    # directory being removed by _TreeRemover
+
+    __slots__ = ('name', 'parent', 'fd', 'pending')
+
+    def __init__ (self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.fd = None
+        # number of work items left before the directory is empty
+        self.pending = 0
+
+
+class _TreeRemover:
+    # removes a directory tree using a number of threads; each thread takes
+    # work from a shared stack - taking the most recently found directories
+    # first keeps the number of open directories low, since a directory stays
+    # open until everything in it has been removed
+
+    # maximum number of files unlinked in one work item
+    batch_size = 256
+
+    def __init__ (self, path, threads, report=None):
+        self.path = path
+        self.threads = threads
+        # called with the number of items removed after each batch
+        self.report = report
+        self.stack = [('dir', _Node(path, None))]
+        self.cond = threading.Condition()
+        # nodes with open file descriptors
+        self.open = set()
+        self.done = False
+        self.error = None
+
+    def run (self, pool):
+        tasks = [pool.submit(self.work) for i in range(self.threads - 1)]
+        # also work in this thread, so we finish even if the pool is busy
+        self.work()
+        # tasks that haven't started have nothing left to do, and waiting for
+        # them could deadlock if this is running in the pool
+        for task in tasks:
+            task.cancel()
+        concurrent.futures.wait(tasks)
+        if self.error is not None:
+            for node in self.open:
+                os.close(node.fd)
+            self.open.clear()
+            raise self.error
+
+    def work (self):
+        while True:
+            with self.cond:
+                while not self.stack and not self.done:
+                    self.cond.wait()
+                if self.done:
+                    return
+                kind, node, *args = self.stack.pop()
+            try:
+                if kind == 'dir':
+                    self.scan(node)
+                else:
+                    self.unlink(node, *args)
+            except BaseException as e:
+                # anything else (such as from report) must also stop the other
+                # threads, or they'd wait forever
+                with self.cond:
+                    if self.error is None:
+                        self.error = e
+                    self.done = True
+                    self.cond.notify_all()
+                return
+
+    def scan (self, node):
+        if node.parent is None:
+            node.fd = os.open(node.name, os.O_RDONLY | os.O_DIRECTORY)
+        else:
+            node.fd = os.open(node.name,
+                              os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW,
+                              dir_fd=node.parent.fd)
+        with self.cond:
+            self.open.add(node)
+        work = []
+        names = []
+        with os.scandir(node.fd) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    work.append(('dir', _Node(entry.name, node)))
+                else:
+                    names.append(entry.name)
+        for i in range(0, len(names), self.batch_size):
+            work.append(('unlink', node, names[i:i + self.batch_size]))
+        node.pending = len(work)
+        if work:
+            with self.cond:
+                self.stack.extend(work)
+                self.cond.notify_all()
+        else:
+            self.finish(node)
+
+    def unlink (self, node, names):
+        for name in names:
+            os.unlink(name, dir_fd=node.fd)
+        if self.report is not None:
+            self.report(len(names))
+        self.child_done(node)
+
+    def child_done (self, node):
+        with self.cond:
+            node.pending -= 1
+            empty = node.pending == 0
+        if empty:
+            self.finish(node)
+
+    def finish (self, node):
+        with self.cond:
+            self.open.discard(node)
+        os.close(node.fd)
+        node.fd = None
+        if node.parent is None:
+            os.rmdir(node.name)
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+        else:
+            os.rmdir(node.name, dir_fd=node.parent.fd)
+            self.child_done(node.parent)
+
+
+class FilesystemOperationException (OperationException):
+    """Raised when an operation fails because of an error from the operating
+system.
+
+:arg op: as taken by :class:`OperationException
+    <fsmanage.operation.OperationException>`.
+:arg error: :class:`OSError` which caused the failure.
+:arg reverted: as taken by :class:`OperationException
+    <fsmanage.operation.OperationException>`.
+
+"""
+
+    def __init__ (self, op, error, reverted=True):
+        OperationException.__init__(self, op, reverted)
+        #: ``error`` argument.
+        self.error = error
+        #: Whether :attr:`error`'s ``errno`` is in :data:`TRANSIENT_ERRNOS
+        #: <fsmanage.operation.TRANSIENT_ERRNOS>`.
+        self.transient = error.errno in TRANSIENT_ERRNOS
+
+    def detail (self):
+        """:inherit:
+
+Defined for this class as the string form of :attr:`error`.
+
+"""
+        return str(self.error)
+
+
+class FilesystemOperationExecutor (OperationExecutor):
+    """Operation executor for the local filesystem.
+
+:arg root: real path that item paths are relative to.
+:arg chunk_size: maximum number of bytes to copy in a single system call.
+:arg buffer_size: size of the buffer used to copy data when the operating
+    system can't copy it directly, in bytes.
+:arg workers: maximum number of threads used to work on files in parallel
+    within a single executor call; calls using a spinning disk or network
+    filesystem (see :meth:`device_limit`) use a single thread.
+:arg trash: whether :class:`Delete <fsmanage.operation.Delete>` operations move
+    items to the trash rather than removing them.
+:arg slow_device_limit: maximum number of executor calls which should use a
+    spinning disk or network filesystem at once (see :meth:`device_limit`), or
+    :obj:`None` for no limit.
+:arg undo_store: :class:`UndoStore <fsmanage.undostore.UndoStore>` to keep
+    deleted items in, so that :class:`Delete <fsmanage.operation.Delete>`
+    operations can be undone when ``trash`` is :obj:`False`.
+:arg trash_dir: real path of an existing directory to use as the trash for
+    items on the same filesystem, in place of one at the top of the
+    filesystem; or :obj:`None`.
+
+Operations are executed in the calling thread, so futures returned by this
+executor have always completed; use an :class:`OperationManager
+<fsmanage.opexec.OperationManager>` which calls it from other threads to
+execute operations in the background.
+
+Supported operations:
+
+- :class:`Copy <fsmanage.operation.Copy>`: data is copied by the kernel where
+  possible, using :func:`os.copy_file_range` (which may also share data between
+  the copies, on filesystems that support it), then :func:`os.sendfile`, then
+  reading into a reusable buffer.  Ownership (where permitted), permissions,
+  extended attributes and times are copied along with the data.  Symbolic
+  links are copied as links.  Can be undone.
+- :class:`Move <fsmanage.operation.Move>`: within a filesystem, this is a
+  single rename, however much is being moved.  Across filesystems, files are
+  copied (as for :class:`Copy <fsmanage.operation.Copy>`) and then removed, one
+  at a time, by ``workers`` threads, with a limited number of files queued at
+  once.  If this fails part-way through, the moved files and the remaining
+  files are left where they are, and undoing moves back whatever was moved.
+  Undoing works in the same way, renaming where possible.  The check that the
+  destination doesn't exist is not atomic with the move.
+- :class:`Delete <fsmanage.operation.Delete>`: if ``trash`` is :obj:`True`, the
+  item is renamed into ``trash_dir`` if it's on the same filesystem, or else a
+  trash directory (see :attr:`trash_name`) at the top of the filesystem
+  containing it, or if that can't be created, in the directory containing
+  it.  This takes the same time however much is being
+  deleted, and can be undone by renaming it back.  Items stay in the trash
+  until :meth:`purge_trash` is called.  Otherwise, the item is removed, and
+  can be resumed after failing.  This can't be undone unless ``undo_store`` is
+  given, in which case the item's data, ownership, permissions and times (but
+  not extended attributes) are stored before it's removed, and undoing
+  recreates it.  Items containing anything other than directories, regular
+  files and symbolic links, and items whose data the store evicts, can't be
+  restored (see :meth:`undo_available
+  <fsmanage.opexec.OperationExecutor.undo_available>`).  Data is kept until
+  undone or evicted, or until :meth:`release_undo_data` is called with the
+  operation, which a :class:`History <fsmanage.history.History>` does once it
+  drops the event.
+
+Directory trees are removed by ``workers`` threads, each unlinking items
+relative to an open directory rather than by path.
+
+Progress is reported (see :meth:`report_progress
+<fsmanage.opexec.OperationExecutor.report_progress>`) for each chunk of data
+copied and each item copied, moved or removed; totals grow as directories are
+read.  Operations may be paused or cancelled (see :meth:`checkpoint
+<fsmanage.opexec.OperationExecutor.checkpoint>`) at the same points, except
+after renames, which can't be interrupted.  A cancelled copy is removed, and a
+cancelled move leaves moved items where they are, to be moved back by undoing.
+
+All operations support :meth:`execute_batch
+<fsmanage.opexec.OperationExecutor.execute_batch>`.  Batches of
+:class:`Copy <fsmanage.operation.Copy>` operations are executed by ``workers``
+threads at once when allowed to run in parallel; other batches are executed one
+operation at a time.
+
+Failures caused by ``EAGAIN``, ``EBUSY``, ``EINTR`` and ``ETIMEDOUT`` errors
+are marked :attr:`transient <fsmanage.operation.OperationException.transient>`.
+Metadata queries fail with these errors rather than omitting properties, so
+that a :class:`RetryPolicy <fsmanage.retry.RetryPolicy>` can try them again.
+
+Requires Python 3.7 or later.
+
+Supported metadata properties:
+
+- ``items``: :class:`OperableDir <fsmanage.item.OperableDir>` instances for
+  directories, :class:`File <fsmanage.item.File>` instances for regular files
+  and :class:`OperableItem <fsmanage.item.OperableItem>` instances for anything
+  else.
+- ``mtime``: modification time, in nanoseconds.
+- ``size``: for regular files only.
+
+"""
+
+    #: :attr:`OperationExecutor.future_type
+    #: <fsmanage.opexec.OperationExecutor.future_type>`.
+    future_type = concurrent.futures.Future
+
+    #: Name of trash directories; this has the real user ID appended.
+    trash_name = '.fsmanage-trash-'
+
+    def __init__ (self, root=os.sep, chunk_size=8 * 1024 * 1024,
+                  buffer_size=1024 * 1024, workers=4, trash=False,
+                  slow_device_limit=1, undo_store=None, trash_dir=None):
+        OperationExecutor.__init__(self)
+        #: ``root`` argument.
+        self.root = root
+        #: ``chunk_size`` argument.
+        self.chunk_size = chunk_size
+        #: ``buffer_size`` argument.
+        self.buffer_size = buffer_size
+        #: ``workers`` argument.
+        self.workers = workers
+        #: ``trash`` argument.
+        self.trash = trash
+        #: ``slow_device_limit`` argument.
+        self.slow_device_limit = slow_device_limit
+        #: ``undo_store`` argument.
+        self.undo_store = undo_store
+        #: ``trash_dir`` argument.
+        self.trash_dir = trash_dir
+        self._pool = None
+        self._purge_pool = None
+        self._pool_lock = threading.Lock()
+        # device -> trash directory path
+        self._trash_dirs = {}
+        # Delete operation -> path of the item in the trash
+        self._trashed = {}
+        self._trash_lock = threading.Lock()
+        # device -> whether it's slowed down by concurrent access
+        self._slow_devices = {}
+        # Delete operation -> undo store key of the removed item's manifest, or
+        # None while storing it
+        self._preserved = {}
+        # Delete operations whose removed items can't be restored
+        self._lost = weakref.WeakSet()
+        self._preserve_lock = threading.Lock()
+        self.support_operation(Copy, self._copy, self._undo_copy)
+        self.support_operation(Move, self._move, self._undo_move)
+        if trash:
+            self.support_operation(Delete, self._trash, self._untrash)
+        else:
+            self.support_operation(
+                Delete, self._delete,
+                None if undo_store is None else self._restore_deleted, True)
+        if undo_store is not None:
+            undo_store.on_evict(self._evicted)
+        self.support_batch(Copy, self._copy_batch, self._undo_copy_batch)
+        self.support_batch(Move, self._move_batch, self._undo_move_batch)
+        self.support_batch(Delete, self._delete_batch,
+                           self._untrash_batch if trash else None)
+
+    @property
+    def pool (self):
+        """:class:`concurrent.futures.ThreadPoolExecutor` used to work on
+files in parallel."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    self.workers)
+            return self._pool
+
+    def _exception (self, op, error, reverted=True):
+        # exception to fail op with, after stopping because of error
+        if isinstance(error, CancelledException):
+            error.reverted = reverted
+            return error
+        return FilesystemOperationException(op, error, reverted)
+
+    def _progress (self, op, **counts):
+        # report progress, and stop here if cancelled
+        self.report_progress(op, **counts)
+        self.checkpoint(op)
+
+    def real_path (self, path):
+        """Get the real path corresponding to an :attr:`Item.path
+<fsmanage.item.Item.path>`."""
+        return os.path.join(self.root, *path)
+
+    def operation_devices (self, ops):
+        """:inherit:
+
+Devices are identified by ``st_dev``, taken from the directories containing the
+paths operations access (or the nearest existing directories above them).
+
+"""
+        parents = {tuple(path[:-1])
+                   for op in ops for path, access in op.touched_paths()}
+        devices = set()
+        for parent in parents:
+            real_path = self.real_path(parent)
+            while True:
+                try:
+                    devices.add(os.stat(real_path).st_dev)
+                    break
+                except OSError:
+                    up = os.path.dirname(real_path)
+                    if up == real_path:
+                        break
+                    real_path = up
+        return devices
+
+    def device_limit (self, device):
+        """:inherit:
+
+Spinning disks and network filesystems (such as NFS and SMB) are limited to
+:attr:`slow_device_limit`, since they spend more time seeking or waiting than
+transferring data when accessed concurrently.  Other devices, such as
+solid-state disks, have no limit.  Devices can only be told apart on Linux;
+elsewhere, nothing is limited.
+
+"""
+        return self.slow_device_limit if self._slow(device) else None
+
+    def _slow (self, device):
+        slow = self._slow_devices.get(device)
+        if slow is None:
+            slow = self._slow_devices[device] = _slow_device(device)
+        return slow
+
+    def _threads (self, devices):
+        # number of threads to work on files on devices with, within a call
+        return 1 if any(self._slow(dev) for dev in devices) else self.workers
+
+    def get_metadata (self, item, *properties):
+        """:inherit:"""
+        result = {}
+        path = self.real_path(item.path)
+        try:
+            st = os.lstat(path)
+            for prop in properties:
+                if prop == 'items' and stat.S_ISDIR(st.st_mode):
+                    result['items'] = self._list(item.path, path)
+                elif prop == 'mtime':
+                    result['mtime'] = st.st_mtime_ns
+                elif prop == 'size' and stat.S_ISREG(st.st_mode):
+                    result['size'] = st.st_size
+        except OSError as e:
+            if e.errno in TRANSIENT_ERRNOS:
+                return util.failed(self.future_type, e)
+        return util.resolved(self.future_type, result)
+
+    def _list (self, path, real_path):
+        items = []
+        with os.scandir(real_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    item_type = OperableDir
+                elif entry.is_file(follow_symlinks=False):
+                    item_type = File
+                else:
+                    item_type = OperableItem
+                items.append(item_type(path + (entry.name,)))
+        return items
+
+    def _copy_item (self, src, dest, created, op=None):
+        # created is a list that gets dest appended once it exists; progress
+        # is reported for op, if given
+        st = os.lstat(src)
+        is_reg = stat.S_ISREG(st.st_mode)
+        if op is not None:
+            self._progress(op, bytes_total=st.st_size if is_reg else 0,
+                           items_total=1)
+        if stat.S_ISDIR(st.st_mode):
+            os.mkdir(dest, 0o700)
+            created.append(dest)
+            with os.scandir(src) as entries:
+                for entry in entries:
+                    self._copy_item(entry.path,
+                                    os.path.join(dest, entry.name), [], op)
+            _copy_metadata(st, src, dest)
+
+        elif stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dest)
+            created.append(dest)
+            _copy_metadata(st, src, dest, False)
+
+        elif is_reg:
+            src_fd = os.open(src, os.O_RDONLY)
+            try:
+                dest_fd = os.open(
+                    dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                created.append(dest)
+                try:
+                    _copy_data(
+                        src_fd, dest_fd, st.st_size, self.chunk_size,
+                        self.buffer_size, None if op is None else
+                        lambda n: self._progress(op, bytes_done=n))
+                    _copy_metadata(st, src_fd, dest_fd)
+                finally:
+                    os.close(dest_fd)
+            finally:
+                os.close(src_fd)
+
+        else:
+            raise OSError(errno.EOPNOTSUPP,
+                          'cannot copy special file: {}'.format(src))
+
+        if op is not None:
+            self.report_progress(op, items_done=1)
+
+    def _remove (self, real_path, op=None):
+        # progress is reported for op, if given
+        st = os.lstat(real_path)
+        if stat.S_ISDIR(st.st_mode):
+            report = None if op is None else (
+                lambda n: self._progress(op, items_done=n, items_total=n))
+            _TreeRemover(real_path, self._threads({st.st_dev}),
+                         report).run(self.pool)
+        else:
+            os.unlink(real_path)
+            if op is not None:
+                self.report_progress(op, items_done=1, items_total=1)
+
+    def _parallel (self, fn, args, threads):
+        # call fn with each of args, using up to this many threads including
+        # this one, so that this may be called from within the pool
+        args = iter(args)
+        lock = threading.Lock()
+
+        def work ():
+            while True:
+                with lock:
+                    arg = next(args, None)
+                if arg is None:
+                    return
+                fn(arg)
+
+        tasks = [self.pool.submit(work) for i in range(threads - 1)]
+        work()
+        for task in tasks:
+            task.cancel()
+        concurrent.futures.wait(tasks)
+        for task in tasks:
+            if not task.cancelled():
+                task.result()
+
+    def _batch (self, handler, ops, parallel=False):
+        # call a single-operation handler for each op and combine the results
+        # into those of a batch
+        results = [None] * len(ops)
+
+        def run (i):
+            try:
+                self.checkpoint(ops[i])
+            except CancelledException as e:
+                e.reverted = True
+                results[i] = util.failed(self.future_type, e)
+            else:
+                results[i] = handler(ops[i])
+
+        threads = 1
+        if parallel and len(ops) > 1:
+            threads = self._threads(self.operation_devices(ops))
+        if threads > 1:
+            self._parallel(run, range(len(ops)), threads)
+        else:
+            for i in range(len(ops)):
+                run(i)
+
+        attn = AttentionItems()
+        errors = []
+        succeeded = []
+        for op, future in zip(ops, results):
+            exc = future.exception()
+            if exc is None:
+                attn = attn.extended(future.result())
+                succeeded.append(op)
+            else:
+                errors.append(exc)
+        if errors:
+            return util.failed(self.future_type, BatchOperationException(
+                errors, succeeded, attn))
+        return util.resolved(self.future_type, attn)
+
+    def _copy_batch (self, ops, confirm, parallel):
+        return self._batch(lambda op: self._copy(op, confirm), ops, parallel)
+
+    def _undo_copy_batch (self, ops, parallel):
+        return self._batch(self._undo_copy, ops[::-1], parallel)
+
+    def _move_batch (self, ops, confirm, parallel):
+        # within a filesystem, each move is a single rename, so there's
+        # nothing to gain from threads
+        return self._batch(lambda op: self._move(op, confirm), ops)
+
+    def _undo_move_batch (self, ops, parallel):
+        return self._batch(self._undo_move, ops[::-1])
+
+    def _delete_batch (self, ops, confirm, parallel):
+        handler = self._trash if self.trash else self._delete
+        return self._batch(lambda op: handler(op, confirm), ops)
+
+    def _untrash_batch (self, ops, parallel):
+        return self._batch(self._untrash, ops[::-1])
+
+    def _copy (self, op, confirm):
+        dest = self.real_path(op.dest)
+        created = []
+        try:
+            if os.path.lexists(dest):
+                raise FileExistsError(
+                    errno.EEXIST, 'destination exists: {}'.format(dest))
+            self._copy_item(self.real_path(op.item.path), dest, created, op)
+        except _ERRORS as e:
+            reverted = True
+            if created:
+                try:
+                    self._remove(dest)
+                except OSError:
+                    reverted = False
+            return util.failed(self.future_type,
+                               self._exception(op, e, reverted))
+        return util.resolved(self.future_type, AttentionItems(
+            (op.dest_item,), Dir(op.dest[:-1])))
+
+    def _undo_copy (self, op):
+        try:
+            self._remove(self.real_path(op.dest), op)
+        except _ERRORS as e:
+            return util.failed(self.future_type,
+                               self._exception(op, e, False))
+        return util.resolved(self.future_type,
+                             AttentionItems((), Dir(op.dest[:-1])))
+
+    def _move_file (self, src, dest, op=None):
+        # move a non-directory across filesystems
+        created = []
+        try:
+            self._copy_item(src, dest, created, op)
+        except _ERRORS:
+            if created:
+                os.unlink(dest)
+            raise
+        os.unlink(src)
+
+    def _stream_move (self, src, dest, op=None):
+        # move a tree file by file, renaming when on the same filesystem as
+        # dest and copying otherwise; if dest exists, src is merged into it,
+        # and files already at dest are taken to have been moved already.
+        # Memory use is bounded by the depth of the tree and the number of
+        # files being copied at once: each directory is finished as soon as
+        # everything in it has been moved
+        src_st = os.lstat(src)
+        dest_dev = os.stat(os.path.dirname(dest)).st_dev
+        threads = self._threads({src_st.st_dev, dest_dev})
+        slots = threading.BoundedSemaphore(2 * threads)
+        cond = threading.Condition()
+        # running is the number of files being moved by workers
+        state = {'running': 0, 'errors': []}
+
+        def finished (record):
+            # record is [src, dest, stat result, number of things in it still
+            # being moved, parent record], or None for the top of the tree
+            while record is not None:
+                with cond:
+                    record[3] -= 1
+                    if record[3] or state['errors']:
+                        return
+                src, dest, st, remaining, parent = record
+                _copy_metadata(st, src, dest)
+                os.rmdir(src)
+                record = parent
+
+        def move_file (src, dest, parent):
+            try:
+                self._move_file(src, dest, op)
+                finished(parent)
+            except Exception as e:
+                with cond:
+                    state['errors'].append(e)
+            finally:
+                slots.release()
+                with cond:
+                    state['running'] -= 1
+                    cond.notify_all()
+
+        def walk (src, dest, st, parent):
+            if state['errors']:
+                return
+            if op is not None:
+                self.checkpoint(op)
+            if os.path.lexists(dest):
+                if stat.S_ISDIR(st.st_mode):
+                    walk_dir(src, dest, st, parent)
+                else:
+                    os.unlink(src)
+            elif st.st_dev == dest_dev:
+                os.rename(src, dest)
+                if op is not None:
+                    self.report_progress(op, items_done=1, items_total=1)
+            elif stat.S_ISDIR(st.st_mode):
+                os.mkdir(dest, 0o700)
+                walk_dir(src, dest, st, parent)
+            else:
+                slots.acquire()
+                with cond:
+                    state['running'] += 1
+                    if parent is not None:
+                        parent[3] += 1
+                if threads > 1:
+                    self.pool.submit(move_file, src, dest, parent)
+                else:
+                    move_file(src, dest, parent)
+
+        def walk_dir (src, dest, st, parent):
+            # counts as being moved until it's been read
+            record = [src, dest, st, 1, parent]
+            if parent is not None:
+                with cond:
+                    parent[3] += 1
+            with os.scandir(src) as entries:
+                for entry in entries:
+                    walk(entry.path, os.path.join(dest, entry.name),
+                         entry.stat(follow_symlinks=False), record)
+            finished(record)
+
+        try:
+            walk(src, dest, src_st, None)
+        finally:
+            with cond:
+                while state['running']:
+                    cond.wait()
+        if state['errors']:
+            raise state['errors'][0]
+
+    def _move_item (self, src, dest, merge, op=None):
+        # returns whether the move was done with a single rename; progress is
+        # reported for op, if given
+        if os.path.lexists(dest):
+            if not merge:
+                raise FileExistsError(
+                    errno.EEXIST, 'destination exists: {}'.format(dest))
+        else:
+            try:
+                os.rename(src, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+            else:
+                if op is not None:
+                    self.report_progress(op, items_done=1, items_total=1)
+                return True
+        self._stream_move(src, dest, op)
+        return False
+
+    def _move (self, op, confirm):
+        src = self.real_path(op.item.path)
+        dest = self.real_path(op.dest)
+        if os.path.lexists(dest):
+            return util.failed(self.future_type, FilesystemOperationException(
+                op, FileExistsError(
+                    errno.EEXIST, 'destination exists: {}'.format(dest))))
+        try:
+            self._move_item(src, dest, False, op)
+        except _ERRORS as e:
+            # if nothing exists at dest, nothing has been moved
+            return util.failed(self.future_type, self._exception(
+                op, e, not os.path.lexists(dest)))
+        return util.resolved(self.future_type, AttentionItems(
+            (op.dest_item,), Dir(op.dest[:-1])))
+
+    def _undo_move (self, op):
+        src = self.real_path(op.item.path)
+        dest = self.real_path(op.dest)
+        try:
+            if os.path.lexists(dest):
+                self._move_item(dest, src, True, op)
+        except _ERRORS as e:
+            return util.failed(self.future_type,
+                               self._exception(op, e, False))
+        return util.resolved(self.future_type, AttentionItems(
+            (op.item,), Dir(op.item.path[:-1])))
+
+    def _evicted (self, op):
+        with self._preserve_lock:
+            if op in self._preserved:
+                del self._preserved[op]
+                self._lost.add(op)
+
+    def _preserve (self, op, real_path):
+        # store the item at real_path in the undo store, returning the key of
+        # its manifest, which lists an entry for each item in the tree:
+        # [path relative to the root, kind ('d', 'f' or 'l' for directories,
+        # regular files and symbolic links), mode, access time, modification
+        # time, user ID, group ID, data key for files or target for links];
+        # returns None if something in the tree isn't supported
+        store = self.undo_store
+        manifest = []
+
+        def walk (path, rel):
+            self.checkpoint(op)
+            st = os.lstat(path)
+            entry = [rel, None, st.st_mode, st.st_atime_ns, st.st_mtime_ns,
+                     st.st_uid, st.st_gid, None]
+            manifest.append(entry)
+            if stat.S_ISDIR(st.st_mode):
+                entry[1] = 'd'
+                with os.scandir(path) as entries:
+                    for child in entries:
+                        if not walk(child.path, rel + [child.name]):
+                            return False
+            elif stat.S_ISLNK(st.st_mode):
+                entry[1] = 'l'
+                entry[7] = os.readlink(path)
+            elif stat.S_ISREG(st.st_mode):
+                entry[1] = 'f'
+                with open(path, 'rb') as f:
+                    entry[7] = store.write(op, f).hex()
+            else:
+                return False
+            return True
+
+        try:
+            if not walk(real_path, []):
+                store.release(op)
+                return None
+            return store.put(op, json.dumps(manifest).encode('ascii'))
+        except BaseException:
+            store.release(op)
+            raise
+
+    def _delete (self, op, confirm):
+        real_path = self.real_path(op.item.path)
+        if self.undo_store is not None:
+            with self._preserve_lock:
+                # when resuming, what's left is only part of the item
+                preserve = op not in self._preserved and op not in self._lost
+                if preserve:
+                    self._preserved[op] = None
+            if preserve:
+                try:
+                    key = self._preserve(op, real_path)
+                except _ERRORS as e:
+                    with self._preserve_lock:
+                        self._preserved.pop(op, None)
+                        self._lost.discard(op)
+                    return util.failed(self.future_type,
+                                       self._exception(op, e))
+                with self._preserve_lock:
+                    # the store may have evicted some of it already
+                    if key is None or op not in self._preserved:
+                        self._preserved.pop(op, None)
+                        self._lost.add(op)
+                        self.undo_store.release(op)
+                    else:
+                        self._preserved[op] = key
+        try:
+            self._remove(real_path, op)
+        except _ERRORS as e:
+            return util.failed(self.future_type,
+                               self._exception(op, e, False))
+        return util.resolved(self.future_type,
+                             AttentionItems((), Dir(op.item.path[:-1])))
+
+    def _restore_deleted (self, op):
+        dest = self.real_path(op.item.path)
+        store = self.undo_store
+        with self._preserve_lock:
+            key = self._preserved.get(op)
+        created = False
+        try:
+            if key is None:
+                raise FileNotFoundError(errno.ENOENT, 'deleted item not '
+                                        'stored: {}'.format(dest))
+            if os.path.lexists(dest):
+                raise FileExistsError(
+                    errno.EEXIST, 'destination exists: {}'.format(dest))
+            try:
+                manifest = json.loads(store.get(key).decode('ascii'))
+                dirs = []
+                for entry in manifest:
+                    rel, kind = entry[:2]
+                    path = os.path.join(dest, *rel)
+                    self._progress(op, items_total=1)
+                    if kind == 'd':
+                        os.mkdir(path, 0o700)
+                        dirs.append((path, entry))
+                    elif kind == 'l':
+                        os.symlink(entry[7], path)
+                    else:
+                        fd = os.open(
+                            path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                        created = True
+                        with open(fd, 'wb') as f:
+                            for chunk in store.read(bytes.fromhex(entry[7])):
+                                f.write(chunk)
+                                self._progress(op, bytes_done=len(chunk),
+                                               bytes_total=len(chunk))
+                    created = True
+                    if kind != 'd':
+                        _restore_metadata(path, entry)
+                    self.report_progress(op, items_done=1)
+                # after their contents, which change their times
+                for path, entry in reversed(dirs):
+                    _restore_metadata(path, entry)
+            except KeyError:
+                raise FileNotFoundError(errno.ENOENT, 'deleted item no longer '
+                                        'stored: {}'.format(dest))
+        except _ERRORS as e:
+            reverted = True
+            if created:
+                try:
+                    self._remove(dest)
+                except OSError:
+                    reverted = False
+            return util.failed(self.future_type,
+                               self._exception(op, e, reverted))
+        with self._preserve_lock:
+            del self._preserved[op]
+        store.release(op)
+        return util.resolved(self.future_type, AttentionItems(
+            (op.item,), Dir(op.item.path[:-1])))
+
+    def undo_available (self, op):
+        """:inherit:
+
+:class:`Delete <fsmanage.operation.Delete>` operations can't be undone when
+using ``undo_store`` if the deleted item couldn't be stored or has been
+evicted, and when using the trash once the item has been purged (see
+:meth:`purge_trash`).
+
+"""
+        if not isinstance(op, Delete):
+            return True
+        if self.trash:
+            with self._trash_lock:
+                return op in self._trashed
+        with self._preserve_lock:
+            return self._preserved.get(op) is not None
+
+    def release_undo_data (self, op):
+        """:inherit:
+
+For :class:`Delete <fsmanage.operation.Delete>` operations which stored the
+item in ``undo_store``, this releases the stored data.
+
+"""
+        if self.undo_store is None or self.trash or not isinstance(op, Delete):
+            return
+        with self._preserve_lock:
+            if self._preserved.get(op) is None:
+                # not stored, or still being stored
+                return
+            del self._preserved[op]
+            self._lost.add(op)
+        self.undo_store.release(op)
+
+    def undo_size (self, op):
+        """:inherit:
+
+For :class:`Delete <fsmanage.operation.Delete>` operations which stored the
+item in ``undo_store``, this is the space it takes up there (see
+:meth:`UndoStore.size_of <fsmanage.undostore.UndoStore.size_of>`).
+
+"""
+        if (self.undo_store is not None and not self.trash and
+                isinstance(op, Delete)):
+            return self.undo_store.size_of(op)
+        return OperationExecutor.undo_size(self, op)
+
+    def _trash_dir (self, real_path, dev):
+        # find or create the trash directory for an item
+        with self._trash_lock:
+            trash_dir = self._trash_dirs.get(dev)
+        if trash_dir is not None:
+            return trash_dir
+        if self.trash_dir is not None:
+            try:
+                same_device = os.stat(self.trash_dir).st_dev == dev
+            except OSError:
+                same_device = False
+            if same_device:
+                with self._trash_lock:
+                    self._trash_dirs[dev] = self.trash_dir
+                return self.trash_dir
+        name = self.trash_name + str(os.getuid())
+        parent = os.path.dirname(os.path.abspath(real_path))
+        mount = parent
+        while True:
+            up = os.path.dirname(mount)
+            if up == mount or os.lstat(up).st_dev != dev:
+                break
+            mount = up
+        for base in (mount, parent):
+            trash_dir = os.path.join(base, name)
+            try:
+                os.mkdir(trash_dir, 0o700)
+            except FileExistsError:
+                pass
+            except OSError:
+                continue
+            if base == mount:
+                with self._trash_lock:
+                    self._trash_dirs[dev] = trash_dir
+            return trash_dir
+        raise PermissionError(errno.EACCES, 'cannot create trash directory '
+                              'for: {}'.format(real_path))
+
+    def _trash (self, op, confirm):
+        src = self.real_path(op.item.path)
+        try:
+            dest = os.path.join(self._trash_dir(src, os.lstat(src).st_dev),
+                                uuid.uuid4().hex)
+            os.rename(src, dest)
+        except OSError as e:
+            return util.failed(self.future_type,
+                               FilesystemOperationException(op, e))
+        with self._trash_lock:
+            self._trashed[op] = dest
+        self.report_progress(op, items_done=1, items_total=1)
+        return util.resolved(self.future_type,
+                             AttentionItems((), Dir(op.item.path[:-1])))
+
+    def _untrash (self, op):
+        dest = self.real_path(op.item.path)
+        with self._trash_lock:
+            src = self._trashed.pop(op, None)
+        try:
+            if src is None:
+                raise FileNotFoundError(
+                    errno.ENOENT, 'not in the trash: {}'.format(dest))
+            if os.path.lexists(dest):
+                raise FileExistsError(
+                    errno.EEXIST, 'destination exists: {}'.format(dest))
+            os.rename(src, dest)
+        except OSError as e:
+            if src is not None:
+                with self._trash_lock:
+                    self._trashed[op] = src
+            return util.failed(self.future_type,
+                               FilesystemOperationException(op, e))
+        self.report_progress(op, items_done=1, items_total=1)
+        return util.resolved(self.future_type, AttentionItems(
+            (op.item,), Dir(op.item.path[:-1])))
+
+    def undo_data (self, op):
+        """:inherit:
+
+For :class:`Delete <fsmanage.operation.Delete>` operations which moved an item
+to the trash, this is the item's path in the trash.  For those which stored the
+item in ``undo_store``, this is the key of the stored data, which is restored
+if the store still has it.
+
+"""
+        if self.trash:
+            with self._trash_lock:
+                path = self._trashed.get(op)
+            return None if path is None else os.fsencode(path)
+        with self._preserve_lock:
+            return self._preserved.get(op)
+
+    def restore_undo_data (self, op, data):
+        """:inherit:"""
+        if not isinstance(op, Delete):
+            return
+        if self.trash:
+            with self._trash_lock:
+                self._trashed[op] = os.fsdecode(data)
+        elif self.undo_store is not None:
+            store = self.undo_store
+            available = store.acquire(op, data)
+            if available:
+                try:
+                    manifest = json.loads(store.get(data).decode('ascii'))
+                except (KeyError, ValueError):
+                    available = False
+                else:
+                    available = all(
+                        store.acquire(op, bytes.fromhex(entry[7]))
+                        for entry in manifest if entry[1] == 'f')
+            with self._preserve_lock:
+                if available:
+                    self._preserved[op] = data
+                else:
+                    store.release(op)
+                    self._lost.add(op)
+
+    def purge_trash (self, ops=None):
+        """Permanently remove items moved to the trash by :class:`Delete
+<fsmanage.operation.Delete>` operations.
+
+:arg ops: sequence of :class:`Delete <fsmanage.operation.Delete>` operations
+    executed by this executor to purge the items of; defaults to all of them.
+
+:returns: :attr:`future <future_type>` which completes when the items have been
+    removed, whose result is :obj:`None` and whose exception is the first
+    :class:`OSError` encountered.
+
+Removal happens in a background thread.  Operations whose items are purged can
+no longer be undone.
+
+"""
+        with self._trash_lock:
+            if ops is None:
+                ops = list(self._trashed)
+            paths = [self._trashed.pop(op) for op in ops
+                     if op in self._trashed]
+        with self._pool_lock:
+            if self._purge_pool is None:
+                self._purge_pool = concurrent.futures.ThreadPoolExecutor(1)
+            purge_pool = self._purge_pool
+
+        def purge ():
+            error = None
+            for path in paths:
+                try:
+                    self._remove(path)
+                except OSError as e:
+                    error = error or e
+            if error is not None:
+                raise error
+
+        future = self.future_type()
+        util.relay(purge_pool.submit(purge), future)
+        return future
@@ -1,4 +1,10 @@
 import time
+import heapq
+import itertools
+import threading
+
+from .sequence import PersistentSequence
+from . import util
 
 
 class HistoryEventResult:
@@ -21,9 +27,9 @@ class HistoryEventResult:
 
     def __init__ (self, state, result):
         #: ``state`` argument
-        self.state = None
+        self.state = state
         #: ``result`` argument
-        self.result = None
+        self.result = result
 
 
 class HistoryEvent:
@@ -35,6 +41,14 @@ Knows how to make (and possibly revert) the change.
 
     #: Whether the change associated with this event can be undone.
     can_undo = True
+    #: Cost of keeping this event in a :class:`History`, counted towards
+    #: :attr:`History.max_cost`; subclasses may estimate memory or disk space
+    #: used, for example.  The history reads this whenever it executes or
+    #: reverts the event.
+    cost = 1
+    #: Whether executing this event changes anything.  A :class:`History`
+    #: drops events which :meth:`merge` into one without an effect.
+    has_effect = True
 
     def __init__ (self):
         pass
@@ -50,7 +64,8 @@ Knows how to make (and possibly revert) the change.
 This implementation does nothing.
 
 """
-        pass
+        return util.resolved(future_type, HistoryEventResult(
+            HistoryEventResult.SUCCESS, None))
 
     def undo (self, future_type):
         """Undo the change associated with this event, if possible.
@@ -64,10 +79,78 @@ This implementation does nothing.
 
 This implementation does nothing.
 
+"""
+        return util.resolved(future_type, HistoryEventResult(
+            HistoryEventResult.SUCCESS, None))
+
+    def conflicts (self, other):
+        """Return whether executing this event at the same time as another
+could give a different outcome from executing them one after the other.
+
+:arg other: :class:`HistoryEvent` to check against.
+
+This should give the same answer when the events are swapped.  It's used to
+decide which events a :class:`History` may execute at the same time (see
+``max_running``).  This implementation returns :obj:`True`.
+
+"""
+        return True
+
+    def merge (self, event):
+        """Combine this event with one executed straight after it.
+
+:arg event: :class:`HistoryEvent` executed after this one.
+
+:returns: a new :class:`HistoryEvent` which has the same effect as executing
+    both events (and undoing both, when undone), and which counts as having
+    been executed; or :obj:`None` if they can't be combined.  If the events
+    cancel out, the new event's :attr:`has_effect` should be :obj:`False`.
+
+This is used by :class:`History` to coalesce events (see ``coalesce_window``).
+This implementation returns :obj:`None`.
+
+"""
+        return None
+
+    def discard (self):
+        """Called when a :class:`History` is done with this event.
+
+This happens when the history drops a stored event (through expiry, or by
+adding an event that replaces the :attr:`future <History.future>`), or when it
+doesn't store an executed event (because it failed, or the history is
+:attr:`permanent <History.permanent>`), but not when the event is merged into
+another one.  It can't be undone or redone afterwards, so resources kept for
+that may be released.  This implementation does nothing.
+
 """
         pass
 
 
+class _Branch:
+    # events removed from the future of a branching History by adding an
+    # event, along with the branches diverging from them
+
+    def __init__ (self, events, times, costs, forks, time):
+        self.events = events
+        self.times = times
+        self.costs = costs
+        # index in events -> branches diverging there, in the order they
+        # were abandoned
+        self.forks = forks
+        # time the branch was abandoned
+        self.time = time
+        nested = [branch for branches in forks.values()
+                  for branch in branches]
+        # number of events, including nested branches
+        self.size = len(events) + sum(branch.size for branch in nested)
+        # total cost, including nested branches
+        self.cost = costs.sum() + sum(branch.cost for branch in nested)
+        # while in History._forks: index it diverges at, and serial number of
+        # its entry in History._abandoned
+        self.fork = None
+        self.serial = None
+
+
 class History:
     """Manage a history of events.
 
@@ -83,23 +166,68 @@ class History:
 :arg revert_on_failure: whether to try to revert execution of an event when it
     fails.
 :arg max_events: if given, this restricts the maximum number of saved events
-    (accessed through :attr:`past`, :meth:`undo`, etc.) to this many.
-:arg expire_future_first: if ``max_events`` is specified, this determines which
-    events to remove first - if ``True``, those in :attr:`future` (used via
-    :meth:`redo`) are removed before those in :attr:`past`.
+    (accessed through :attr:`past`, :meth:`undo`, etc., and including those in
+    other :attr:`branches`) to this many.
+:arg expire_future_first: if ``max_events`` or ``max_cost`` is specified, this
+    determines which events to remove first - if ``True``, those in
+    :attr:`future` (used via :meth:`redo`) are removed before those in
+    :attr:`past`.
 :arg max_event_age: if given, remove events which were last executed (or
-    reverted) this long ago (according to ``current_time``).  This means that
-    this may cause expiry of :attr:`future` events.  Removal occurs when a
-    change is made (:meth:`add`, :meth:`undo`, etc.), or through
-    :meth:`expire_events`.
+    reverted) at least this long ago (according to ``current_time``).  This
+    means that this may cause expiry of :attr:`future` events.  Removal occurs
+    when a change is made (:meth:`add`, :meth:`undo`, etc.), through
+    :meth:`expire_events`, or in the background if ``call_later`` is given.
+:arg max_cost: if given, this restricts the total :attr:`HistoryEvent.cost` of
+    saved events to this much, removing events in the same order as for
+    ``max_events``.
 :arg current_time: a function that takes no arguments and returns the current
     time as a number.  Only relative times matter, and the magnitude only
     matters as regards ``max_event_age``.
+:arg events: sequence of :class:`HistoryEvent` instances to start with, as for
+    :attr:`events`, for example to restore a saved history.  They are treated
+    as if last executed or reverted now.
+:arg position: initial :attr:`position`; defaults to the end of ``events``.
+:arg call_later: function taking a delay and a function, which calls the
+    function after the delay, such as :func:`util.call_later
+    <fsmanage.util.call_later>`.  If given, events are removed as soon as
+    they're older than ``max_event_age``, with the function called whenever the
+    next event to expire changes.  Delays are in the same units as
+    ``current_time``.
+:arg branching: if :obj:`True`, :meth:`add` keeps :attr:`future` events as a
+    branch which can be returned to using :meth:`redo`, rather than removing
+    them.
+:arg max_running: maximum number of events :meth:`add` may execute at once, or
+    :obj:`None` for no limit.
+:arg coalesce_window: if given, an event passed to :meth:`add` is combined with
+    the last event in :attr:`past` if that was executed at most this long ago
+    (according to ``current_time``), and they can be combined.  The combined
+    event replaces the last event, as if just executed, so that a run of events
+    added in quick succession may become a single event; if the combined event
+    has no :attr:`effect <HistoryEvent.has_effect>`, both are dropped instead.
+    Events are not combined if there are events in :attr:`future` or other
+    :attr:`branches`.
+:arg coalesce: function taking two events, as for ``coalesce_window``, and
+    returning the combined event, or :obj:`None` if they can't be combined.
+    The default calls :meth:`HistoryEvent.merge` on the earlier event.
+
+Unless ``permanent`` is :obj:`True`, each change waits for earlier changes,
+with one exception: an event passed to :meth:`add` may start while up to
+``max_running - 1`` other added events are executing, if it doesn't
+:meth:`conflict <HistoryEvent.conflicts>` with them, or with any added event
+waiting to start before it.  Events are added to :attr:`events` in the order
+they finish executing.  :meth:`undo` and :meth:`redo` always wait for
+everything requested before them to finish, and everything requested after
+them waits for them.
+
+When branching, other branches are removed before any events in the current
+branch to satisfy ``max_events`` and ``max_cost``, in the order they were left,
+and a branch expires by ``max_event_age`` based on the time it was left.  A
+branch is also removed along with the events leading to it.  Leaving a branch
+only moves the events after the point it diverges from the current branch; the
+events before that are shared.
 
 """
 
-    # execute waits for executing to finish if non-permanent
-
     #: The type of events that this history can track (:class:`HistoryEvent`
     #: subclass).
     event_type = HistoryEvent
@@ -112,33 +240,234 @@ class History:
     def __init__ (self, future_type, permanent=False, require_reversible=False,
                   revert_on_failure=True, max_events=None,
                   expire_future_first=False, max_event_age=None,
-                  current_time=time.monotonic):
+                  current_time=time.monotonic, events=(), position=None,
+                  max_cost=None, call_later=None, branching=False,
+                  max_running=1, coalesce_window=None, coalesce=None):
         #: ``future_type`` argument.
-        self.future_type = None
+        self.future_type = future_type
         #: ``permanent`` argument.
-        self.permanent = None
+        self.permanent = permanent
         #: ``require_reversible`` argument.
-        self.require_reversible = None
+        self.require_reversible = require_reversible
         #: ``revert_on_failure`` argument.
-        self.revert_on_failure = None
+        self.revert_on_failure = revert_on_failure
         #: ``max_events`` argument.
-        self.max_events = None
+        self.max_events = max_events
         #: ``expire_future_first`` argument.
-        self.expire_future_first = None
+        self.expire_future_first = expire_future_first
         #: ``max_event_age`` argument.
-        self.max_event_age = None
+        self.max_event_age = max_event_age
+        #: ``max_cost`` argument.
+        self.max_cost = max_cost
         #: ``current_time`` argument.
-        self.current_time = None
+        self.current_time = current_time
+        #: ``call_later`` argument.
+        self.call_later = call_later
+        #: ``branching`` argument.
+        self.branching = branching
+        #: ``max_running`` argument.
+        self.max_running = max_running
+        #: ``coalesce_window`` argument.
+        self.coalesce_window = coalesce_window
+        #: ``coalesce`` argument.
+        self.coalesce = coalesce
+        self._events = PersistentSequence(events)
+        if position is not None:
+            if not 0 <= position <= len(self._events):
+                raise ValueError('position out of range:', position)
+            self.position = position
+        else:
+            self.position = len(self._events)
+        # time each event in _events was last executed or reverted
+        now = current_time()
+        self._times = PersistentSequence([now] * len(self._events))
+        # cost of each event in _events when last executed or reverted
+        self._costs = PersistentSequence(event.cost for event in self._events)
+        self._cost = self._costs.sum()
+        # index in _events -> other branches diverging there, in the order
+        # they were abandoned
+        self._forks = {}
+        # heap of (time abandoned, serial, branch) for branches in _forks,
+        # used to remove the oldest first; entries are only valid if the
+        # branch has the same serial
+        self._abandoned = []
+        self._serials = itertools.count()
+        # total size and cost of branches in _forks
+        self._branch_size = 0
+        self._branch_cost = 0
+        self._callbacks = []
+        self._lock = threading.RLock()
+        # changes waiting to start, in the order requested, as
+        # (event, start, future), where event is None for undo and redo
+        self._waiting = []
+        # such tuples for running changes
+        self._running = []
+        # time of the earliest pending call to _expire_due, if any
+        self._expiry_due = None
+        with self._lock:
+            self._schedule_expiry()
 
     @property
     def events (self):
-        """Sequence of :class:`HistoryEvent` instances stored in this history.
+        """:class:`PersistentSequence <fsmanage.sequence.PersistentSequence>`
+of :class:`HistoryEvent` instances stored in this history.
 
-In execution order.  See also :attr:`position`.
+In execution order.  See also :attr:`position`.  When branching, this is the
+current branch; see also :attr:`branches`.
+
+This and the other sequences of events (:attr:`past`, :attr:`future` and
+:attr:`branches`) share their structure with the history's own list of events,
+so reading them takes logarithmic time and copies nothing, and they don't
+change when the history does.
 
 """
-        # immutable
-        pass
+        with self._lock:
+            return self._events
+
+    @property
+    def state (self):
+        """Tuple of :attr:`events` and :attr:`position`, read together."""
+        with self._lock:
+            return (self.events, self.position)
+
+    @property
+    def cost (self):
+        """Total :attr:`HistoryEvent.cost` of saved events, including those in
+other :attr:`branches`, as of when each was last executed or reverted."""
+        with self._lock:
+            return self._cost + self._branch_cost
+
+    @property
+    def branches (self):
+        """Tuple of the sequences of :class:`HistoryEvent` instances that
+:meth:`redo` can choose between.
+
+The first is :attr:`future`, if it has any events, followed by the other
+branches diverging at :attr:`position`, most recently left first.  There are
+only other branches when branching.
+
+"""
+        with self._lock:
+            return (
+                ((self.future,) if self.position < len(self._events) else ()) +
+                tuple(branch.events for branch in
+                      reversed(self._forks.get(self.position, ()))))
+
+    def _add_branch (self, i, branch):
+        # call with lock held
+        self._forks.setdefault(i, []).append(branch)
+        branch.fork = i
+        branch.serial = next(self._serials)
+        heapq.heappush(self._abandoned, (branch.time, branch.serial, branch))
+        self._branch_size += branch.size
+        self._branch_cost += branch.cost
+
+    def _untrack_branch (self, branch):
+        # call with lock held, after removing branch from _forks
+        branch.fork = branch.serial = None
+        self._branch_size -= branch.size
+        self._branch_cost -= branch.cost
+
+    def _drop_branch (self, branch):
+        # discard the events of a branch that can't be reached any more,
+        # including its nested branches; call with lock held, after
+        # untracking it
+        for event in branch.events:
+            event.discard()
+        for branches in branch.forks.values():
+            for nested in branches:
+                self._drop_branch(nested)
+
+    def _take_branch (self, branch):
+        # remove a branch from _forks; call with lock held
+        branches = self._forks[branch.fork]
+        branches.remove(branch)
+        if not branches:
+            del self._forks[branch.fork]
+        self._untrack_branch(branch)
+
+    def _oldest_branch (self):
+        # call with lock held; returns None if there are no branches
+        while self._abandoned:
+            time, serial, branch = self._abandoned[0]
+            if branch.serial == serial:
+                return branch
+            heapq.heappop(self._abandoned)
+        return None
+
+    def _abandon (self):
+        # move future events to a new branch, along with the branches
+        # diverging from them; call with lock held
+        i = self.position
+        forks = {}
+        for j in [j for j in self._forks if j > i]:
+            forks[j - i] = branches = self._forks.pop(j)
+            for branch in branches:
+                self._untrack_branch(branch)
+        branch = _Branch(self._events[i:], self._times[i:], self._costs[i:],
+                         forks, self.current_time())
+        self._truncate(i, False)
+        self._add_branch(i, branch)
+
+    def _switch (self, branch):
+        # replace future events with a branch diverging at position; call with
+        # lock held
+        if self.position < len(self._events):
+            self._abandon()
+        self._take_branch(branch)
+        i = self.position
+        self._events = self._events.extended(branch.events)
+        self._times = self._times.extended(branch.times)
+        self._costs = self._costs.extended(branch.costs)
+        self._cost += branch.costs.sum()
+        for j, branches in branch.forks.items():
+            for nested in branches:
+                self._add_branch(i + j, nested)
+
+    def _set_cost (self, i, event):
+        # call with lock held
+        cost = event.cost
+        self._cost += cost - self._costs[i]
+        self._costs = self._costs.replaced(i, cost)
+
+    def _truncate (self, start, drop=True):
+        # remove _events[start:]; call with lock held; if drop is False, the
+        # events are being kept elsewhere, and aren't discarded
+        # branches diverging after start can't be reached
+        for i in [i for i in self._forks if i > start]:
+            for branch in self._forks.pop(i):
+                self._untrack_branch(branch)
+                self._drop_branch(branch)
+        if drop:
+            for event in self._events[start:]:
+                event.discard()
+        self._cost -= self._costs[start:].sum()
+        self._events = self._events[:start]
+        self._times = self._times[:start]
+        self._costs = self._costs[:start]
+
+    def _remove_first (self, n):
+        # remove _events[:n]; call with lock held
+        if n == 0:
+            return
+        forks = {}
+        for i, branches in self._forks.items():
+            if i < n:
+                # can't be reached
+                for branch in branches:
+                    self._untrack_branch(branch)
+                    self._drop_branch(branch)
+            else:
+                forks[i - n] = branches
+                for branch in branches:
+                    branch.fork = i - n
+        self._forks = forks
+        for event in self._events[:n]:
+            event.discard()
+        self._cost -= self._costs[:n].sum()
+        self._events = self._events[n:]
+        self._times = self._times[n:]
+        self._costs = self._costs[n:]
 
     @property
     def past (self):
@@ -147,8 +476,8 @@ In execution order.  See also :attr:`position`.
 ``history.past`` is equivalent to ``history.events[:history.position]``.
 
 """
-        # immutable
-        pass
+        with self._lock:
+            return self._events[:self.position]
 
     @property
     def future (self):
@@ -158,8 +487,77 @@ In execution order.  See also :attr:`position`.
 ``history.future`` is equivalent to ``history.events[history.position:]``.
 
 """
-        # immutable
-        pass
+        with self._lock:
+            return self._events[self.position:]
+
+    def _queue (self, start, event=None):
+        # run start() once it may start (see the class docstring), where event
+        # is the event being added, if any; start returns a future
+        change = (event, start, self.future_type())
+        if self.permanent:
+            self._start(change, False)
+            return change[2]
+        with self._lock:
+            self._waiting.append(change)
+            ready = self._ready()
+        for ready_change in ready:
+            self._start(ready_change)
+        return change[2]
+
+    def _may_run (self, event, others):
+        # whether event may run alongside others
+        return not any(other is None or other.conflicts(event)
+                       for other in others)
+
+    def _ready (self):
+        # move changes which may start from _waiting to _running, and return
+        # them; call with lock held
+        ready = []
+        running = [event for event, start, future in self._running]
+        # added events waiting to start, which later events can't overtake if
+        # they conflict
+        blocked = []
+        for change in self._waiting:
+            event = change[0]
+            if event is None:
+                if not running and not blocked:
+                    ready.append(change)
+                    self._running.append(change)
+                break
+            if ((self.max_running is None or
+                    len(running) < self.max_running) and
+                    self._may_run(event, running) and
+                    self._may_run(event, blocked)):
+                ready.append(change)
+                self._running.append(change)
+                running.append(event)
+            else:
+                blocked.append(event)
+        for change in ready:
+            self._waiting.remove(change)
+        return ready
+
+    def _start (self, change, queued=True):
+        event, start, future = change
+
+        def done (future):
+            if not queued:
+                return
+            with self._lock:
+                self._running.remove(change)
+                ready = self._ready()
+            for ready_change in ready:
+                self._start(ready_change)
+
+        future.add_done_callback(done)
+        try:
+            util.relay(start(), future)
+        except Exception as e:
+            future.set_exception(e)
+
+    def _changed (self, event, result):
+        for fn in self._callbacks:
+            fn(event, result)
 
     def add (self, event):
         """Add an event to the history.
@@ -175,10 +573,81 @@ In execution order.  See also :attr:`position`.
     :obj:`True` and ``event`` does not support :meth:`undo
     <HistoryEvent.undo>`.
 
-If executing the event fails, it is not added to :attr:`events`.
+If executing the event fails, it is not added to :attr:`events`.  If it fails
+without reverting its changes, and :attr:`revert_on_failure` is :obj:`True`,
+its :meth:`undo <HistoryEvent.undo>` method is called to try to revert them.
 
 """
-        pass
+        if not isinstance(event, self.event_type):
+            raise TypeError('expected event of type {}; got:'.format(
+                self.event_type.__name__), event)
+        if (not self.permanent and self.require_reversible and
+                not event.can_undo):
+            raise TypeError('event cannot be undone:', event)
+        return self._queue(lambda: util.chain(
+            self.future_type, event.execute(self.future_type),
+            lambda result: self._executed(event, result)), event)
+
+    def _executed (self, event, result, revert=True):
+        if (revert and result.state == HistoryEventResult.FAILED and
+                self.revert_on_failure and event.can_undo):
+            return util.chain(
+                self.future_type, event.undo(self.future_type),
+                lambda undo_result: self._reverted(event, result, undo_result))
+
+        with self._lock:
+            merged = None
+            if (result.state == HistoryEventResult.SUCCESS and
+                    not self.permanent):
+                merged = self._merge(event)
+            if merged is not None and not merged.has_effect:
+                # the events cancel out
+                self.position -= 1
+                self._truncate(self.position, False)
+            elif merged is not None:
+                i = self.position - 1
+                self._events = self._events.replaced(i, merged)
+                self._times = self._times.replaced(i, self.current_time())
+                self._set_cost(i, merged)
+            elif (result.state == HistoryEventResult.SUCCESS and
+                    not self.permanent):
+                if self.branching and self.position < len(self._events):
+                    self._abandon()
+                else:
+                    self._truncate(self.position)
+                self._events = self._events.appended(event)
+                self._times = self._times.appended(self.current_time())
+                self._costs = self._costs.appended(0)
+                self._set_cost(self.position, event)
+                self.position += 1
+            stored = (result.state == HistoryEventResult.SUCCESS and
+                      not self.permanent)
+            self._expire()
+        self._changed(event, result)
+        if not stored:
+            event.discard()
+        return result
+
+    def _merge (self, event):
+        # combine event with the last event in the past, if possible; call
+        # with lock held
+        i = self.position - 1
+        if (self.coalesce_window is None or i < 0 or
+                i + 1 < len(self._events) or self.position in self._forks or
+                self._times[i] < self.current_time() - self.coalesce_window):
+            return None
+        if self.coalesce is None:
+            return self._events[i].merge(event)
+        return self.coalesce(self._events[i], event)
+
+    def _reverted (self, event, result, undo_result):
+        # event failed, and we tried to revert it
+        if undo_result.state == HistoryEventResult.SUCCESS:
+            state = HistoryEventResult.REVERTED
+        else:
+            state = HistoryEventResult.FAILED
+        return self._executed(
+            event, HistoryEventResult(state, result.result), False)
 
     def can_undo (self):
         """Return whether there is something that can be undone.
@@ -189,7 +658,9 @@ used when you do not intend to undo anything (eg. to indicate whether undo is
 possible in a user interface).
 
 """
-        pass
+        with self._lock:
+            return (not self.permanent and self.position > 0 and
+                    self._events[self.position - 1].can_undo)
 
     def undo (self):
         """Try to undo the most recently executed event.
@@ -202,8 +673,38 @@ This is the last event in :attr:`past`.
 :raises TypeError: if this is not possible - if there are no events to undo, or
     if the most recently executed event cannot be undone.
 
+If undoing fails without reverting its changes
+(:attr:`HistoryEventResult.FAILED`), the event and everything in :attr:`future`
+are removed from the history.
+
 """
-        pass
+        if not self.can_undo():
+            raise TypeError('nothing to undo')
+
+        def start ():
+            with self._lock:
+                if not self.can_undo():
+                    raise TypeError('nothing to undo')
+                event = self._events[self.position - 1]
+            return util.chain(
+                self.future_type, event.undo(self.future_type),
+                lambda result: self._undone(event, result))
+
+        return self._queue(start)
+
+    def _undone (self, event, result):
+        with self._lock:
+            i = self.position - 1
+            if result.state == HistoryEventResult.SUCCESS:
+                self.position = i
+                self._times = self._times.replaced(i, self.current_time())
+                self._set_cost(i, event)
+            elif result.state == HistoryEventResult.FAILED:
+                self._truncate(i)
+                self.position = i
+            self._expire()
+        self._changed(event, result)
+        return result
 
     def can_redo (self):
         """Return whether there is something that can be redone.
@@ -211,20 +712,74 @@ This is the last event in :attr:`past`.
 See :meth:`can_undo` for usage notes.
 
 """
-        pass
+        with self._lock:
+            return not self.permanent and (self.position < len(self._events) or
+                                           self.position in self._forks)
 
-    def redo (self):
+    def redo (self, branch=0):
         """Try to redo the most recently reverted event.
 
-This is the first event in :attr:`future`.
+:arg branch: index in :attr:`branches` of the branch to follow.  The event
+    redone is the first event in the branch, and the branch becomes
+    :attr:`future`, with the previous :attr:`future` becoming another branch.
+    The default is :attr:`future`, or the most recently left branch if that has
+    no events.
 
 :returns: :attr:`future <History.future_type>` whose result is a
     :class:`HistoryEventResult` from redoing the event.
 
 :raises TypeError: if there are no events to redo.
+:raises IndexError: if there is no such branch.
+
+If redoing fails, the event and everything after it in :attr:`future` are
+removed from the history (after trying to revert any changes, as for
+:meth:`add`).
 
 """
-        pass
+        if not self.can_redo():
+            raise TypeError('nothing to redo')
+        if not 0 <= branch < len(self.branches):
+            raise IndexError('no such branch:', branch)
+
+        def start ():
+            with self._lock:
+                if not self.can_redo():
+                    raise TypeError('nothing to redo')
+                has_future = self.position < len(self._events)
+                if branch > 0 or not has_future:
+                    others = self._forks.get(self.position, ())
+                    i = branch - has_future
+                    if i >= len(others):
+                        raise IndexError('no such branch:', branch)
+                    self._switch(others[-1 - i])
+                event = self._events[self.position]
+            return util.chain(
+                self.future_type, event.execute(self.future_type),
+                lambda result: self._redone(event, result))
+
+        return self._queue(start)
+
+    def _redone (self, event, result, revert=True):
+        if (revert and result.state == HistoryEventResult.FAILED and
+                self.revert_on_failure and event.can_undo):
+            return util.chain(
+                self.future_type, event.undo(self.future_type),
+                lambda undo_result: self._redone(event, HistoryEventResult(
+                    HistoryEventResult.REVERTED
+                    if undo_result.state == HistoryEventResult.SUCCESS
+                    else HistoryEventResult.FAILED, result.result), False))
+
+        with self._lock:
+            i = self.position
+            if result.state == HistoryEventResult.SUCCESS:
+                self.position = i + 1
+                self._times = self._times.replaced(i, self.current_time())
+                self._set_cost(i, event)
+            else:
+                self._truncate(i)
+            self._expire()
+        self._changed(event, result)
+        return result
 
     def on_change (self, *fns):
         """Register functions for calling when an event change occurs.
@@ -237,14 +792,166 @@ This is the first event in :attr:`future`.
         - ``result`` is the :class:`HistoryEventResult` from the call.
 
 """
-        pass
+        self._callbacks.extend(fns)
+
+    def on_changes (self, *fns, dispatch=None):
+        """Register functions for calling with batches of event changes.
+
+:arg fns: any number of functions to register as callbacks.  Each is called
+    with a :class:`list` of ``(event, result)`` pairs, as passed to callbacks
+    registered with :meth:`on_change`.
+:arg dispatch: as taken by :class:`ChangeBatcher`.
+
+Each function is wrapped in a :class:`ChangeBatcher` and registered with
+:meth:`on_change`.
+
+"""
+        self.on_change(*(ChangeBatcher(fn, dispatch) for fn in fns))
 
     def expire_events (self):
         """Check the age of known events and expire old ones.
 
-See also :attr:`max_event_age`.
+See also :attr:`max_event_age`.  Events over :attr:`max_events` or
+:attr:`max_cost` are also removed.
 
 Note that expiry is also performed whenever an event change happens.
 
 """
-        pass
+        with self._lock:
+            self._expire()
+
+    @property
+    def next_expiry (self):
+        """Time (according to :attr:`current_time`) at which the next event
+will be old enough to expire, or :obj:`None` if :attr:`max_event_age` is
+:obj:`None` or there are no events."""
+        with self._lock:
+            return self._next_expiry()
+
+    def _next_expiry (self):
+        # call with lock held; past events were last executed in order, and
+        # future events were last reverted in reverse order, so the oldest are
+        # always at the ends, and the ends act as an index of deadlines
+        if self.max_event_age is None:
+            return None
+        oldest = [self._times[0]] if self.position else []
+        if self.position < len(self._events):
+            oldest.append(self._times[-1])
+        branch = self._oldest_branch()
+        if branch is not None:
+            oldest.append(branch.time)
+        return min(oldest) + self.max_event_age if oldest else None
+
+    def _schedule_expiry (self):
+        # call with lock held
+        if self.call_later is None:
+            return
+        due = self._next_expiry()
+        # a pending call expires anything due later, and schedules again
+        if due is None or (self._expiry_due is not None and
+                           self._expiry_due <= due):
+            return
+        self._expiry_due = due
+        self.call_later(max(0, due - self.current_time()),
+                        lambda: self._expire_due(due))
+
+    def _expire_due (self, due):
+        with self._lock:
+            if self._expiry_due == due:
+                self._expiry_due = None
+            self._expire()
+
+    def _expire (self):
+        # only looks at events that expire, the ends of the list, and the
+        # oldest branches
+        if self.max_event_age is not None:
+            cutoff = self.current_time() - self.max_event_age
+            n = 0
+            while n < self.position and self._times[n] <= cutoff:
+                n += 1
+            self._remove_first(n)
+            self.position -= n
+            n = len(self._events)
+            while n > self.position and self._times[n - 1] <= cutoff:
+                n -= 1
+            self._truncate(n)
+            branch = self._oldest_branch()
+            while branch is not None and branch.time <= cutoff:
+                self._take_branch(branch)
+                self._drop_branch(branch)
+                branch = self._oldest_branch()
+
+        # other branches go first
+        while ((self.max_events is not None and
+                len(self._events) + self._branch_size > self.max_events) or
+               (self.max_cost is not None and
+                self._cost + self._branch_cost > self.max_cost)):
+            branch = self._oldest_branch()
+            if branch is None:
+                break
+            self._take_branch(branch)
+            self._drop_branch(branch)
+
+        # remove from the ends in bulk rather than one at a time
+        past = 0
+        future = len(self._events)
+        n = len(self._events)
+        cost = self._cost
+        while n and ((self.max_events is not None and n > self.max_events) or
+                     (self.max_cost is not None and cost > self.max_cost)):
+            if (past == self.position or
+                    (self.expire_future_first and future > self.position)):
+                future -= 1
+                cost -= self._costs[future]
+            else:
+                cost -= self._costs[past]
+                past += 1
+            n -= 1
+        self._truncate(future)
+        self._remove_first(past)
+        self.position -= past
+        self._schedule_expiry()
+
+
+class ChangeBatcher:
+    """Callback for :meth:`History.on_change` which passes changes on in
+batches.
+
+:arg fn: function to call with a :class:`list` of ``(event, result)`` pairs.
+:arg dispatch: function taking a function and arranging for it to be called
+    later with no arguments, such as ``loop.call_soon_threadsafe`` for an
+    :mod:`asyncio` event loop, ``GLib.idle_add``, or the ``submit`` method of a
+    :class:`concurrent.futures.ThreadPoolExecutor`.  If :obj:`None`, ``fn`` is
+    called straight away, with each change in its own batch.
+
+Changes made before ``fn`` is called are added to the same batch, so that
+``fn`` runs once for a burst of changes.
+
+"""
+
+    def __init__ (self, fn, dispatch=None):
+        #: ``fn`` argument.
+        self.fn = fn
+        #: ``dispatch`` argument.
+        self.dispatch = dispatch
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __call__ (self, event, result):
+        with self._lock:
+            self._pending.append((event, result))
+            if len(self._pending) > 1:
+                # a call is already pending
+                return
+        if self.dispatch is None:
+            self.flush()
+        else:
+            self.dispatch(self.flush)
+
+    def flush (self):
+        """Call ``fn`` with any pending changes now."""
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+        if batch:
+            self.fn(batch)
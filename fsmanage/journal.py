@@ -0,0 +1,612 @@
+import os
+import struct
+import zlib
+import threading
+
+from .item import Item, Dir, OperableItem, OperableDir, File
+from .operation import Copy, Move, Delete
+from .sequence import PersistentSequence
+
+_MAGIC = b'fsmanage-journal\x01'
+# payload length, CRC-32 of the type and payload, record type
+_HEADER = struct.Struct('<IIB')
+_UINT = struct.Struct('<I')
+_RANGE = struct.Struct('<II')
+
+# record types: append an event; replace the data for the event at an index;
+# keep only events in a range; set the position; a group of records to apply
+# together
+_APPEND = 0
+_UPDATE = 1
+_TRUNCATE = 2
+_POSITION = 3
+_GROUP = 4
+
+
+def _record (record_type, payload):
+    return _HEADER.pack(
+        len(payload), zlib.crc32(bytes((record_type,)) + payload),
+        record_type) + payload
+
+
+def _parse (contents, offset, end):
+    # yield (record type, payload, offset after the record) for valid records
+    # between offset and end
+    while offset + _HEADER.size <= end:
+        length, crc, record_type = _HEADER.unpack_from(contents, offset)
+        start = offset + _HEADER.size
+        if start + length > end:
+            return
+        payload = contents[start:start + length]
+        if zlib.crc32(bytes((record_type,)) + payload) != crc:
+            return
+        offset = start + length
+        yield (record_type, payload, offset)
+
+
+def _check (n, record_type, payload):
+    # check that a record can be applied when there are n events; returns
+    # the number of events afterwards, or raises ValueError
+    try:
+        if record_type == _APPEND:
+            return n + 1
+        elif record_type == _UPDATE:
+            i, = _UINT.unpack_from(payload)
+            if i >= n:
+                raise ValueError('index out of range')
+            return n
+        elif record_type == _TRUNCATE:
+            start, end = _RANGE.unpack(payload)
+            return len(range(n)[start:end])
+        elif record_type == _POSITION:
+            _UINT.unpack(payload)
+            return n
+        elif record_type == _GROUP:
+            records = list(_parse(payload, 0, len(payload)))
+            if not records or records[-1][2] != len(payload):
+                raise ValueError('invalid group')
+            for inner_type, inner_payload, offset in records:
+                if inner_type == _GROUP:
+                    raise ValueError('nested group')
+                n = _check(n, inner_type, inner_payload)
+            return n
+    except struct.error:
+        raise ValueError('invalid record')
+    raise ValueError('unknown record type:', record_type)
+
+
+def _apply (state, record_type, payload):
+    # apply a record which passed _check to state, [event data, position]
+    if record_type == _APPEND:
+        state[0].append(payload)
+    elif record_type == _UPDATE:
+        i, = _UINT.unpack_from(payload)
+        state[0][i] = payload[_UINT.size:]
+    elif record_type == _TRUNCATE:
+        start, end = _RANGE.unpack(payload)
+        state[0] = state[0][start:end]
+    elif record_type == _POSITION:
+        state[1], = _UINT.unpack(payload)
+    else:
+        for inner_type, inner_payload, offset in _parse(payload, 0,
+                                                        len(payload)):
+            _apply(state, inner_type, inner_payload)
+
+
+def _write_all (fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _fsync_dir (path):
+    # make a rename within a directory durable; not possible everywhere
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class HistoryJournal:
+    """Append-only file recording the state of a :class:`History
+<fsmanage.history.History>`, so that it can be restored after the program
+exits or crashes.
+
+:arg path: path to the journal file; it's created if it doesn't exist.
+:arg codec: object with ``encode(event)`` and ``decode(data)`` methods,
+    converting :class:`HistoryEvent <fsmanage.history.HistoryEvent>` instances
+    to and from :class:`bytes`, such as :class:`OperationJournalCodec`.
+:arg sync_interval: maximum time in seconds between writing a change and
+    forcing it to disk.  Changes are written to the file immediately, so they
+    survive the program crashing, but are only guaranteed to survive the system
+    crashing once forced to disk; doing this for several changes at once is
+    much faster.  If ``0``, each change is forced to disk as it's written; if
+    :obj:`None`, this only happens on :meth:`sync`, :meth:`compact` and
+    :meth:`close`.
+:arg compact_ratio: the journal is compacted (see :meth:`compact`) once it
+    contains more than this many records for each event in the history...
+:arg compact_min_records: ...and at least this many records in total.
+
+Usage::
+
+    journal = HistoryJournal(path, OperationJournalCodec(manager))
+    events, position = journal.load()
+    manager.history = OperationHistory(future_type, events=events,
+                                       position=position)
+    journal.attach(manager.history)
+
+Each change is recorded as a compact binary record: new events, events whose
+data changed (such as undo data after redo), events removed from either end of
+the history, and changes in position.  Records are checksummed, and a
+partially written record at the end of the file (from a crash) is discarded,
+so the history is restored as it was after some change.  Recording a change
+takes time proportional to the size of the change rather than of the history.
+Compaction rewrites the file with just the current events, so loading takes
+time proportional to the size of the history rather than its age.
+
+"""
+
+    def __init__ (self, path, codec, sync_interval=1, compact_ratio=4,
+                  compact_min_records=256):
+        #: ``path`` argument.
+        self.path = path
+        #: ``codec`` argument.
+        self.codec = codec
+        #: ``sync_interval`` argument.
+        self.sync_interval = sync_interval
+        #: ``compact_ratio`` argument.
+        self.compact_ratio = compact_ratio
+        #: ``compact_min_records`` argument.
+        self.compact_min_records = compact_min_records
+        #: The attached :class:`History <fsmanage.history.History>`, if any.
+        self.history = None
+        #: Exception raised while recording the last change to
+        #: :attr:`history`, or :obj:`None`.  Changes are still made when they
+        #: can't be recorded.
+        self.error = None
+        # events as last recorded, their encoded data and the position
+        self._events = PersistentSequence()
+        self._data = PersistentSequence()
+        self._position = 0
+        # id of each event in _events -> serial number, counting from the
+        # first event ever recorded; _base is the serial number of _events[0]
+        self._serials = {}
+        self._base = 0
+        # number of records in the file
+        self._records = 0
+        self._fd = None
+        self._unsynced = False
+        self._timer = None
+        self._lock = threading.RLock()
+
+    def load (self):
+        """Read the journal, and open it for recording changes.
+
+:returns: ``(events, position)``, where ``events`` is a :class:`list` of
+    :class:`HistoryEvent <fsmanage.history.HistoryEvent>` instances decoded by
+    :attr:`codec`, and ``position`` is as for :attr:`History.position
+    <fsmanage.history.History.position>`; pass these to the :class:`History
+    <fsmanage.history.History>` to restore.
+
+:raises ValueError: if the file isn't a journal.
+
+"""
+        with self._lock:
+            data, position, records, size = self._read()
+            self._events = PersistentSequence(self.codec.decode(d)
+                                              for d in data)
+            self._data = PersistentSequence(data)
+            self._serials = {id(event): i
+                             for i, event in enumerate(self._events)}
+            self._base = 0
+            self._position = position
+            self._records = records
+            if size is None:
+                self._rewrite()
+            else:
+                self._open(size)
+                self._maybe_compact()
+            return (list(self._events), position)
+
+    def _read (self):
+        # returns (data, position, number of records, valid size), where
+        # valid size is None if there is no file
+        try:
+            with open(self.path, 'rb') as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return ([], 0, 0, None)
+        if not contents.startswith(_MAGIC):
+            if _MAGIC.startswith(contents):
+                # crashed while creating the file
+                return ([], 0, 0, None)
+            raise ValueError('not a journal:', self.path)
+
+        state = [[], 0]
+        records = 0
+        offset = len(_MAGIC)
+        for record_type, payload, end in _parse(contents, offset,
+                                                len(contents)):
+            try:
+                _check(len(state[0]), record_type, payload)
+            except ValueError:
+                break
+            _apply(state, record_type, payload)
+            records += 1
+            offset = end
+        data, position = state
+        return (data, min(position, len(data)), records, offset)
+
+    def _open (self, size):
+        # open the existing file for appending, discarding anything after size
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY)
+        os.ftruncate(self._fd, size)
+        os.lseek(self._fd, size, os.SEEK_SET)
+
+    def _rewrite (self):
+        # replace the file with one containing just the current state
+        tmp_path = self.path + '.tmp'
+        records = [_record(_APPEND, d) for d in self._data]
+        records.append(_record(_POSITION, _UINT.pack(self._position)))
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            _write_all(fd, _MAGIC + b''.join(records))
+            os.fsync(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        os.replace(tmp_path, self.path)
+        _fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = fd
+        self._records = len(records)
+        self._unsynced = False
+
+    def _write (self, *records):
+        # records are written as a single group, so that they're either all
+        # loaded or none are; if writing fails, the file is left as it was
+        if len(records) == 1:
+            record = records[0]
+        else:
+            record = _record(_GROUP, b''.join(records))
+        offset = os.lseek(self._fd, 0, os.SEEK_CUR)
+        try:
+            _write_all(self._fd, record)
+        except BaseException:
+            # later records can't follow a partial one
+            try:
+                os.ftruncate(self._fd, offset)
+                os.lseek(self._fd, offset, os.SEEK_SET)
+            except OSError:
+                self._rewrite()
+            raise
+        self._records += 1
+
+    def _written (self):
+        # call after writing records
+        if self.sync_interval == 0:
+            os.fsync(self._fd)
+        else:
+            self._unsynced = True
+            if self.sync_interval is not None and self._timer is None:
+                self._timer = threading.Timer(self.sync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _maybe_compact (self):
+        if self._records > max(self.compact_min_records,
+                               self.compact_ratio * len(self._data)):
+            self._rewrite()
+
+    def attach (self, history):
+        """Start recording changes to a history.
+
+:arg history: :class:`History <fsmanage.history.History>` to record; its
+    current state is recorded immediately.
+
+Call :meth:`load` first.  Changes are recorded whenever
+:meth:`History.on_change <fsmanage.history.History.on_change>` callbacks are
+called; for other changes
+(such as from :meth:`History.expire_events
+<fsmanage.history.History.expire_events>`), call :meth:`update`.
+
+"""
+        with self._lock:
+            self.history = history
+            history.on_change(self._changed)
+            self.update()
+
+    def _changed (self, event, result):
+        try:
+            self.update(event)
+        except Exception as e:
+            self.error = e
+        else:
+            self.error = None
+
+    def update (self, event=None):
+        """Record the current state of :attr:`history`.
+
+:arg event: :class:`HistoryEvent <fsmanage.history.HistoryEvent>` which may
+    have changed since it was recorded; it's encoded again if it's still in the
+    history.
+
+"""
+        with self._lock:
+            if self._fd is None:
+                raise TypeError('journal is not open')
+            events, position = self.history.state
+            old = self._events
+            data = self._data
+            base = self._base
+            records = []
+
+            # events only leave the history from either end, and are only
+            # added to the end, so the events still recorded are between the
+            # first event and the last one that was already recorded
+            start = self._index(events[0]) if events else None
+            kept = 0
+            if start is None:
+                start = len(old)
+            else:
+                for i in range(len(events) - 1, -1, -1):
+                    if self._index(events[i]) == start + i:
+                        kept = i + 1
+                        break
+            end = start + kept
+            changed = None if event is None else self._index(event)
+            if (start, end) != (0, len(old)):
+                records.append(_record(_TRUNCATE, _RANGE.pack(start, end)))
+                data = data[start:end]
+                base += start
+
+            # nothing changes until the records are written, so that a failure
+            # to encode or write leaves the recorded state as it is in the file
+            if changed is not None:
+                i = changed - start
+                if 0 <= i < kept:
+                    new_data = self.codec.encode(event)
+                    if new_data != data[i]:
+                        data = data.replaced(i, new_data)
+                        records.append(_record(
+                            _UPDATE, _UINT.pack(i) + new_data))
+            for new_event in events[kept:]:
+                new_data = self.codec.encode(new_event)
+                data = data.appended(new_data)
+                records.append(_record(_APPEND, new_data))
+            if position != self._position:
+                records.append(_record(_POSITION, _UINT.pack(position)))
+            if not records:
+                return
+            self._write(*records)
+
+            for old_event in old[:start]:
+                del self._serials[id(old_event)]
+            for old_event in old[end:]:
+                del self._serials[id(old_event)]
+            for i in range(kept, len(events)):
+                self._serials[id(events[i])] = base + i
+            self._events = events
+            self._data = data
+            self._base = base
+            self._position = position
+            self._written()
+            self._maybe_compact()
+
+    def _index (self, event):
+        # index of an event in _events, or None
+        serial = self._serials.get(id(event))
+        if serial is None:
+            return None
+        i = serial - self._base
+        return i if self._events[i] is event else None
+
+    def compact (self):
+        """Rewrite the journal to contain only the current state.
+
+This happens automatically according to :attr:`compact_ratio` and
+:attr:`compact_min_records`.
+
+"""
+        with self._lock:
+            if self._fd is None:
+                raise TypeError('journal is not open')
+            self._rewrite()
+
+    def sync (self):
+        """Force recorded changes to disk."""
+        with self._lock:
+            self._timer = None
+            if self._fd is not None and self._unsynced:
+                os.fsync(self._fd)
+                self._unsynced = False
+
+    def close (self):
+        """Force recorded changes to disk and stop recording.
+
+Later changes to :attr:`history` are ignored.
+
+"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self.sync()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def _uint (n):
+    # unsigned LEB128
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _bytes (b):
+    return _uint(len(b)) + b
+
+
+def _str (s):
+    return _bytes(s.encode('utf-8', 'surrogateescape'))
+
+
+class _Reader:
+    # reads values written by the functions above
+
+    def __init__ (self, data):
+        self.data = data
+        self.offset = 0
+
+    def uint (self):
+        n = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            n |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return n
+
+    def bytes (self):
+        length = self.uint()
+        start = self.offset
+        self.offset += length
+        if self.offset > len(self.data):
+            raise ValueError('truncated data')
+        return self.data[start:self.offset]
+
+    def str (self):
+        return self.bytes().decode('utf-8', 'surrogateescape')
+
+
+class OperationJournalCodec:
+    """Convert :class:`OperationHistoryEvent
+<fsmanage.opexec.OperationHistoryEvent>` instances to and from :class:`bytes`,
+for :class:`HistoryJournal`.
+
+:arg manager: :class:`OperationManager <fsmanage.opexec.OperationManager>` to
+    create decoded events with (see :meth:`OperationManager.create_event
+    <fsmanage.opexec.OperationManager.create_event>`); its executor provides
+    undo data (see :meth:`OperationExecutor.undo_data
+    <fsmanage.opexec.OperationExecutor.undo_data>`).
+:arg confirm: confirmation function for decoded events, as taken by
+    :meth:`OperationManager.execute
+    <fsmanage.opexec.OperationManager.execute>`.
+:arg types: :class:`Operation <fsmanage.operation.Operation>` and :class:`Item
+    <fsmanage.item.Item>` subclasses which may appear in events, in addition to
+    those defined by this package.  Types are identified by name.
+
+Operations are stored as their type, their ``item`` attribute and, if they have
+one, their ``dest`` attribute, so they must be constructed from these.
+
+"""
+
+    def __init__ (self, manager, confirm=None, types=()):
+        #: ``manager`` argument.
+        self.manager = manager
+        #: ``confirm`` argument.
+        self.confirm = confirm
+        #: :class:`dict` mapping names to types, including ``types``.
+        self.types = {t.__name__: t for t in (
+            Item, Dir, OperableItem, OperableDir, File, Copy, Move, Delete)}
+        self.types.update((t.__name__, t) for t in types)
+
+    def _type_name (self, t):
+        if self.types.get(t.__name__) is not t:
+            raise TypeError('unknown type:', t)
+        return _str(t.__name__)
+
+    def encode (self, event):
+        """Convert an event to :class:`bytes`.
+
+:raises TypeError: if the event contains unknown types.
+
+"""
+        executor = self.manager.executor
+        ops = event.operations
+        index = {id(op): i for i, op in enumerate(ops)}
+        flags = event.allow_parallel | event.undo_yields_attention << 1
+        parts = [_uint(flags), _uint(len(ops))]
+        for op in ops:
+            parts.append(self._type_name(type(op)))
+            parts.append(self._type_name(type(op.item)))
+            parts.append(_uint(len(op.item.path)))
+            parts.extend(_str(name) for name in op.item.path)
+            dest = getattr(op, 'dest', None)
+            if dest is None:
+                parts.append(_uint(0))
+            else:
+                parts.append(_uint(len(dest) + 1))
+                parts.extend(_str(name) for name in dest)
+            undo_data = executor.undo_data(op)
+            if undo_data is None:
+                parts.append(_uint(0))
+            else:
+                parts.append(_uint(1) + _bytes(undo_data))
+        done = event.done
+        parts.append(_uint(len(done)))
+        for group in done:
+            parts.append(_uint(len(group)))
+            parts.extend(_uint(index[id(op)]) for op in group)
+        return b''.join(parts)
+
+    def _type (self, reader):
+        name = reader.str()
+        try:
+            return self.types[name]
+        except KeyError:
+            raise ValueError('unknown type:', name)
+
+    def decode (self, data):
+        """Create an event from :class:`bytes` returned by :meth:`encode`.
+
+:raises ValueError: if the data is invalid.
+
+"""
+        reader = _Reader(data)
+        try:
+            flags = reader.uint()
+            ops = []
+            undo_data = []
+            for i in range(reader.uint()):
+                op_type = self._type(reader)
+                item_type = self._type(reader)
+                item = item_type(tuple(reader.str()
+                                       for j in range(reader.uint())))
+                dest_length = reader.uint()
+                if dest_length:
+                    op = op_type(item, tuple(reader.str()
+                                             for j in range(dest_length - 1)))
+                else:
+                    op = op_type(item)
+                ops.append(op)
+                undo_data.append(reader.bytes() if reader.uint() else None)
+            done = [tuple(ops[reader.uint()] for j in range(reader.uint()))
+                    for i in range(reader.uint())]
+        except IndexError:
+            raise ValueError('truncated data')
+
+        event = self.manager.create_event(ops, self.confirm, bool(flags & 1))
+        event.undo_yields_attention = bool(flags & 2)
+        event.done = done
+        executor = self.manager.executor
+        for op, op_data in zip(ops, undo_data):
+            if op_data is not None:
+                executor.restore_undo_data(op, op_data)
+        return event
@@ -1,4 +1,11 @@
 import abc
+import errno
+
+#: :class:`frozenset` of ``errno`` values of :class:`OSError` instances which
+#: indicate a failure that's likely to be temporary (``EAGAIN``, ``EBUSY``,
+#: ``EINTR`` and ``ETIMEDOUT``).
+TRANSIENT_ERRNOS = frozenset((errno.EAGAIN, errno.EBUSY, errno.EINTR,
+                              errno.ETIMEDOUT))
 
 
 class Operation (metaclass=abc.ABCMeta):
@@ -35,12 +42,40 @@ filesystem implementation should be implemented in methods of the operation.
     def __init__ (self):
         pass
 
+    #: Access type for :meth:`touched_paths`: the operation reads the item at
+    #: the path, and anything in it.
+    READ = 'read'
+    #: Access type for :meth:`touched_paths`: the operation creates an item at
+    #: the path.
+    CREATE = 'create'
+    #: Access type for :meth:`touched_paths`: the operation removes the item at
+    #: the path, and anything in it.
+    REMOVE = 'remove'
+    #: Access type for :meth:`touched_paths`: the operation changes the item at
+    #: the path, or anything in it, in some other way.
+    MODIFY = 'modify'
+
     @property
     @abc.abstractmethod
     def name (self):
         """Lower-case name for the operation."""
         pass
 
+    def touched_paths (self):
+        """Return the paths that executing this operation accesses.
+
+:returns: sequence of ``(path, access)`` tuples, where ``path`` is an
+    :attr:`Item.path <fsmanage.item.Item.path>` and ``access`` is one of
+    :attr:`READ`, :attr:`CREATE`, :attr:`REMOVE` and :attr:`MODIFY`.  Each
+    access covers everything within ``path`` as well.
+
+This is used to decide which operations may run at the same time (see
+:class:`Schedule <fsmanage.schedule.Schedule>`).  This implementation claims to
+modify the root, so that the operation conflicts with every other operation.
+
+"""
+        return (((), self.MODIFY),)
+
 
 class OperationException (Exception):
     """Raised when execution of an operation fails.
@@ -53,11 +88,20 @@ class OperationException (Exception):
 
 """
 
+    #: Whether the failure is likely to be temporary, so that trying again
+    #: later might succeed (for example, because a resource was busy).
+    transient = False
+
     def __init__ (self, op, reverted=True):
         self._operation = op
         #: ``reverted`` argument.
         self.reverted = reverted
 
+    @property
+    def operation (self):
+        """``op`` argument."""
+        return self._operation
+
     def summary (self):
         """Short description string of the error that occurred, as sentences.
 
@@ -76,6 +120,80 @@ error.  May be :obj:`None` (as is the case for this class).
         return None
 
 
+class CancelledException (OperationException):
+    """Raised when execution of an operation stops because it was cancelled.
+
+Arguments are as taken by :class:`OperationException`.
+
+Raised by :meth:`OperationExecutor.checkpoint
+<fsmanage.opexec.OperationExecutor.checkpoint>`; executors catching it should
+set :attr:`reverted <OperationException.reverted>` according to what they
+managed to revert before failing with it.
+
+"""
+
+    def summary (self):
+        """:inherit:
+
+Defined for this class as: 'Operation cancelled: <op.name>.'.
+
+"""
+        return 'Operation cancelled: {}.'.format(self.operation.name)
+
+
+class BatchOperationException (OperationException):
+    """Raised when execution of a batch of operations fails for some of the
+operations.
+
+:arg errors: non-empty sequence of :class:`OperationException` instances for
+    the operations that failed.
+:arg succeeded: sequence of :class:`Operation` instances in the batch that
+    succeeded.
+:arg attention: :class:`AttentionItems <fsmanage.item.AttentionItems>` that
+    ``succeeded`` yielded.
+
+:attr:`operation` is the operation of the first error, and :attr:`reverted
+<OperationException.reverted>` is whether all failed operations were reverted
+(operations that succeeded are never reverted).
+
+"""
+
+    def __init__ (self, errors, succeeded, attention):
+        errors = tuple(errors)
+        OperationException.__init__(self, errors[0].operation,
+                                    all(e.reverted for e in errors))
+        #: ``errors`` argument, as a :class:`tuple`.
+        self.errors = errors
+        #: ``succeeded`` argument, as a :class:`tuple`.
+        self.succeeded = tuple(succeeded)
+        #: ``attention`` argument.
+        self.attention = attention
+        #: :obj:`True` if all ``errors`` are :attr:`transient
+        #: <OperationException.transient>`.
+        self.transient = all(e.transient for e in errors)
+
+    def summary (self):
+        """:inherit:
+
+Defined for this class as: 'Operation failed: <op.name> (and <n> others).'.
+
+"""
+        if len(self.errors) == 1:
+            return self.errors[0].summary()
+        return 'Operation failed: {} (and {} others).'.format(
+            self.operation.name, len(self.errors) - 1)
+
+    def detail (self):
+        """:inherit:
+
+Defined for this class as the details of all errors, one per line.
+
+"""
+        details = [e.detail() for e in self.errors]
+        details = [d for d in details if d is not None]
+        return '\n'.join(details) if details else None
+
+
 class Confirmation (metaclass=abc.ABCMeta):
     """Represents a yes/no question for the user about an operation.
 
@@ -134,3 +252,98 @@ This is an abstract property - it must be defined by subclasses.
 
 """
         self._respond(action)
+
+
+class Copy (Operation):
+    """Copy an item to a new location.
+
+:arg item: :class:`OperableItem <fsmanage.item.OperableItem>` to copy; a
+    directory is copied along with everything in it.
+:arg dest: path to create the copy at; nothing may exist at this path.
+
+Execution creates a copy of ``item``, along with its metadata, at ``dest``, and
+yields :attr:`dest_item`, with the directory containing it as the ``parent``.
+
+Undoing removes the copy, and yields no items, with the directory that
+contained the copy as the ``parent``.
+
+"""
+
+    #: :attr:`Operation.name`.
+    name = 'copy'
+
+    def __init__ (self, item, dest):
+        #: ``item`` argument.
+        self.item = item
+        #: ``dest`` argument, as a :class:`tuple`.
+        self.dest = tuple(dest)
+
+    @property
+    def dest_item (self):
+        """Item representing the copy; of the same type as :attr:`item`."""
+        return type(self.item)(self.dest)
+
+    def touched_paths (self):
+        """:inherit:"""
+        return ((self.item.path, self.READ), (self.dest, self.CREATE))
+
+
+class Move (Operation):
+    """Move an item to a new location.
+
+:arg item: :class:`OperableItem <fsmanage.item.OperableItem>` to move; a
+    directory is moved along with everything in it.
+:arg dest: path to move the item to; nothing may exist at this path.
+
+Execution moves ``item`` to ``dest``, and yields :attr:`dest_item`, with the
+directory containing it as the ``parent``.
+
+Undoing moves the item back, and yields ``item``, with the directory containing
+it as the ``parent``.  If execution failed part-way through, undoing moves back
+anything that was moved.
+
+"""
+
+    #: :attr:`Operation.name`.
+    name = 'move'
+
+    def __init__ (self, item, dest):
+        #: ``item`` argument.
+        self.item = item
+        #: ``dest`` argument, as a :class:`tuple`.
+        self.dest = tuple(dest)
+
+    @property
+    def dest_item (self):
+        """Item representing the moved item; of the same type as
+:attr:`item`."""
+        return type(self.item)(self.dest)
+
+    def touched_paths (self):
+        """:inherit:"""
+        return ((self.item.path, self.REMOVE), (self.dest, self.CREATE))
+
+
+class Delete (Operation):
+    """Remove an item from the filesystem.
+
+:arg item: :class:`OperableItem <fsmanage.item.OperableItem>` to remove; a
+    directory is removed along with everything in it.
+
+Execution removes ``item``, and yields no items, with the directory containing
+``item`` as the ``parent``.
+
+Undoing restores ``item`` as it was before removal, and yields ``item``.
+
+"""
+
+    #: :attr:`Operation.name`.
+    name = 'delete'
+
+    def __init__ (self, item):
+        #: ``item`` argument.
+        self.item = item
+
+    def touched_paths (self):
+        """:inherit:"""
+        return ((self.item.path, self.REMOVE),)
@@ -1,6 +1,115 @@
 import abc
+import threading
+import concurrent.futures
 
-from .history import HistoryEvent, History
+from .item import AttentionItems
+from .history import HistoryEventResult, HistoryEvent, History
+from .operation import (OperationException, CancelledException,
+                        BatchOperationException, Confirmation, Move)
+from .schedule import Schedule
+from .progress import ProgressTracker
+from .device import DeviceScheduler
+from . import util
+
+
+class OperationControl:
+    """Handle for cancelling, pausing or throttling a running group of
+operations.
+
+:arg throttle: :class:`Throttle <fsmanage.throttle.Throttle>` limiting the rate
+    the operations run at, or :obj:`None`.
+
+Pass an instance to :meth:`OperationManager.execute`, or use the one it
+creates, available from the future it returns.  It applies to whichever of
+executing and undoing the group is currently running; each time one starts,
+cancellation is reset (see :meth:`reset`).  Pausing lasts until resumed, so it
+may be done before the operations start.
+
+Operations only stop or pause when their executor calls
+:meth:`OperationExecutor.checkpoint`, so this may not happen immediately, or at
+all for executors without support.
+
+"""
+
+    #: Maximum time waited for a :class:`Throttle
+    #: <fsmanage.throttle.Throttle>` at once, in seconds, so that changes to
+    #: its limits take effect promptly.
+    throttle_poll_interval = .1
+
+    def __init__ (self, throttle=None):
+        #: ``throttle`` argument; may be changed at any time.
+        self.throttle = throttle
+        self._cancelled = False
+        self._paused = False
+        self._cond = threading.Condition()
+
+    @property
+    def cancelled (self):
+        """Whether :meth:`cancel` has been called since the last reset."""
+        return self._cancelled
+
+    @property
+    def paused (self):
+        """Whether operations are paused."""
+        return self._paused
+
+    def cancel (self):
+        """Stop running operations, and don't start any more.
+
+This also resumes paused operations, so that they can stop.
+
+"""
+        with self._cond:
+            self._cancelled = True
+            self._paused = False
+            self._cond.notify_all()
+
+    def pause (self):
+        """Pause running operations until :meth:`resume` or :meth:`cancel` is
+called."""
+        with self._cond:
+            if not self._cancelled:
+                self._paused = True
+
+    def resume (self):
+        """Continue running operations after :meth:`pause`."""
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def reset (self):
+        """Clear :attr:`cancelled`."""
+        with self._cond:
+            self._cancelled = False
+
+    def checkpoint (self, op, throttles=()):
+        """Block while paused or throttled, and raise if cancelled.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that is running.
+:arg throttles: sequence of :class:`Throttle <fsmanage.throttle.Throttle>`
+    instances to wait for, as well as :attr:`throttle`.
+
+:raises CancelledException: (:class:`fsmanage.operation.CancelledException`)
+    if :attr:`cancelled` is :obj:`True`, with ``op`` and not reverted.
+
+Cancelling stops the wait for throttles.
+
+"""
+        throttles = list(throttles)
+        if self.throttle is not None:
+            throttles.append(self.throttle)
+        with self._cond:
+            while True:
+                if self._paused:
+                    self._cond.wait()
+                    continue
+                if self._cancelled:
+                    raise CancelledException(op, False)
+                delay = max((throttle.delay() for throttle in throttles),
+                            default=0)
+                if delay <= 0:
+                    break
+                self._cond.wait(min(delay, self.throttle_poll_interval))
 
 
 class OperationHistoryEvent (HistoryEvent):
@@ -13,42 +122,389 @@ class OperationHistoryEvent (HistoryEvent):
 :arg confirm: confirmation function as taken by
     :meth:`OperationManager.execute`.
 :arg allow_parallel: whether the operations may be executed or reverted out of
-    order or at the same time.
+    order or at the same time; if so, operations run as soon as no operation
+    accessing the same paths needs to run first (see :class:`Schedule
+    <fsmanage.schedule.Schedule>`).
 :arg undo_yields_attention: whether :meth:`undo` passes through the
     :class:`AttentionItems <fsmanage.item.AttentionItems>` instance returned by
     ``run`` (if :obj:`False`, it always returns one with no items).
+:arg executor: :class:`OperationExecutor` that ``run`` uses, used to check
+    whether operations can be undone and which can be executed in batches.  If
+    :obj:`None`, all operations are assumed to support undo, and none are
+    batched.
+:arg control: :class:`OperationControl` for cancelling or pausing execution and
+    undo; if :obj:`None`, one is created.  Once cancelled, no more operations
+    are started.
+
+Consecutive operations of the same type, with items in the same directory, are
+executed together through :meth:`OperationExecutor.execute_batch` (and undone
+through :meth:`OperationExecutor.undo_batch`) if ``executor`` has batch support
+for that type of operation, and none of them depends on another (see
+:class:`Schedule <fsmanage.schedule.Schedule>`).  Batches are passed
+``allow_parallel``.
 
 """
 
     # handles CONFIRM_ALL behaviour over all ops
 
+    #: Contribution of each operation to :attr:`cost`: a rough number of bytes
+    #: used to keep it in memory.
+    operation_cost = 1024
+
     def __init__ (self, run, ops, confirm, allow_parallel=True,
-                  undo_yields_attention=False):
+                  undo_yields_attention=False, executor=None, control=None):
         #: ``ops`` argument.
-        self.operations = None
+        self.operations = tuple(ops)
+        #: ``allow_parallel`` argument.
+        self.allow_parallel = allow_parallel
+        #: ``undo_yields_attention`` argument.
+        self.undo_yields_attention = undo_yields_attention
+        #: ``executor`` argument.
+        self.executor = executor
+        #: ``control`` argument.
+        self.control = OperationControl() if control is None else control
+        self._run = run
+        self._user_confirm = confirm
+        # Confirmation subclasses answered with CONFIRM_ALL
+        self._confirmed = set()
+        # sequence of groups of operations to run together
+        self._groups = self._group(self.operations)
+        # groups that made changes in the last execution, in execution order
+        self._done = []
+
+    @property
+    def done (self):
+        """Groups of operations which made changes when last executed, and
+haven't been undone since, as a :class:`list` of :class:`tuple`.
+
+This is what :meth:`undo` reverts.  Setting it is only useful when restoring a
+saved event which has been executed; each group must be taken from
+:attr:`operations`.
+
+"""
+        return list(self._done)
+
+    @done.setter
+    def done (self, groups):
+        self._done = [tuple(group) for group in groups]
+
+    def _group (self, ops):
+        if self.executor is None:
+            return [(op,) for op in ops]
+        batch_types = self.executor.batch_operations
+        # operations in a batch must be independent of each other
+        schedule = Schedule([(op,) for op in ops])
+        groups = []
+        # index in ops of the first operation in the last group
+        start = 0
+        last_key = None
+        for i, op in enumerate(ops):
+            item = getattr(op, 'item', None)
+            key = (type(op), None if item is None else item.path[:-1])
+            edges = schedule.dependencies[i] | schedule.dependents[i]
+            if (type(op) in batch_types and key == last_key and
+                    not any(start <= j < i for j in edges)):
+                groups[-1].append(op)
+            else:
+                groups.append([op])
+                start = i
+            last_key = key
+        return [tuple(group) for group in groups]
+
+    def _confirm (self, confirmation):
+        if self._user_confirm is None:
+            confirmation.respond(Confirmation.CONFIRM_ALL)
+            return
+        if type(confirmation) in self._confirmed:
+            confirmation.respond(Confirmation.CONFIRM)
+            return
+        respond = confirmation._respond
+
+        def wrapped_respond (action):
+            if action == Confirmation.CONFIRM_ALL:
+                self._confirmed.add(type(confirmation))
+            respond(action)
+
+        confirmation._respond = wrapped_respond
+        self._user_confirm(confirmation)
+
+    def _run_group (self, future_type, action, group):
+        # result is (changed_ops, attention, exception or None)
+        if len(group) == 1:
+            args = (action, group[0])
+            if action == 'execute':
+                args += (self._confirm,)
+        else:
+            args = (action + '_batch', group)
+            if action == 'execute':
+                args += (self._confirm,)
+            args += (self.allow_parallel,)
+        result = future_type()
+        if self.control.cancelled:
+            result.set_result(((), AttentionItems(),
+                               CancelledException(group[0])))
+            return result
+
+        def done (future):
+            exc = future.exception()
+            if exc is None:
+                result.set_result((group, future.result(), None))
+            elif isinstance(exc, BatchOperationException):
+                result.set_result((
+                    exc.succeeded + tuple(e.operation for e in exc.errors
+                                          if not e.reverted),
+                    exc.attention, exc))
+            elif isinstance(exc, OperationException) and not exc.reverted:
+                result.set_result((group, AttentionItems(), exc))
+            else:
+                result.set_result(((), AttentionItems(), exc))
+
+        try:
+            self._run(*args).add_done_callback(done)
+        except Exception as e:
+            result.set_result(((), AttentionItems(), e))
+        return result
+
+    def _run_groups (self, future_type, action, groups, finish,
+                     reverse=False):
+        # run groups as allowed by allow_parallel; finish is called with a
+        # list giving the result from _run_group for each group, or None if it
+        # wasn't started.  When running forwards, this stops at the first
+        # error; in reverse, an error only stops the groups that must run
+        # after the failed one
+        schedule = Schedule(groups, not self.allow_parallel)
+        if reverse:
+            schedule = schedule.reversed()
+        return util.chain(future_type, schedule.run(
+            future_type,
+            lambda i: self._run_group(future_type, action, groups[i]),
+            lambda result: result[2] is None, reverse
+        ), lambda futures: finish([None if future is None else future.result()
+                                   for future in futures]))
+
+    def _outcome (self, results, attn):
+        # combine results from _run_groups
+        results = [result for result in results if result is not None]
+        error = None
+        for changed, group_attn, exc in results:
+            attn = attn.extended(group_attn)
+            if error is None:
+                error = exc
+        if error is None:
+            return HistoryEventResult(HistoryEventResult.SUCCESS, attn)
+        elif any(changed for changed, group_attn, exc in results):
+            return HistoryEventResult(HistoryEventResult.FAILED, error)
+        else:
+            return HistoryEventResult(HistoryEventResult.REVERTED, error)
 
     def execute (self, future_type):
         """:meth:`HistoryEvent.execute
 <fsmanage.history.HistoryEvent.execute>`.
 
-Returned future is from :meth:`OperationExecutor.execute`.
+The :class:`HistoryEventResult <fsmanage.history.HistoryEventResult>`'s
+``result`` is the combination of the :class:`AttentionItems
+<fsmanage.item.AttentionItems>` from :meth:`OperationExecutor.execute` on
+success, or the first :class:`OperationException
+<fsmanage.operation.OperationException>` (or other exception) on failure.  If
+execution fails and nothing was changed, the state is
+:attr:`REVERTED <fsmanage.history.HistoryEventResult.REVERTED>`.
 
 """
         # calls run('execute', op, confirm)
-        pass
+        self._done = []
+        self.control.reset()
+
+        def finish (results):
+            self._done = [result[0] for result in results
+                          if result is not None and result[0]]
+            return self._outcome(results, AttentionItems())
+
+        return self._run_groups(future_type, 'execute', self._groups, finish)
+
+    @property
+    def cost (self):
+        """:inherit:
+
+This is :attr:`operation_cost` for each operation, plus the number of bytes
+``executor`` keeps to undo them (see :meth:`OperationExecutor.undo_size`).
+
+"""
+        cost = self.operation_cost * len(self.operations)
+        if self.executor is not None:
+            cost += sum(self.executor.undo_size(op) for op in self.operations)
+        return cost
+
+    def merge (self, event):
+        """:inherit:
+
+Events which each move a single item combine into one move, when the second
+moves the item the first moved, so that a chain of renames becomes a single
+rename, and moving an item back combines into an event without operations,
+which has no :attr:`effect <fsmanage.history.HistoryEvent.has_effect>`.  Both
+events must have finished executing successfully, use the same ``executor``,
+and have no :meth:`undo data <OperationExecutor.undo_data>`.  The combined
+event uses this event's ``run`` and ``control``.
+
+"""
+        if not (isinstance(event, OperationHistoryEvent) and
+                event.executor is self.executor):
+            return None
+        ops = self.operations + event.operations
+        if (len(ops) != 2 or not all(type(op) is Move for op in ops) or
+                ops[1].item.path != ops[0].dest or
+                self._done != [ops[:1]] or event._done != [ops[1:]]):
+            return None
+        if self.executor is not None and any(
+                self.executor.undo_data(op) is not None for op in ops):
+            return None
+        if ops[1].dest == ops[0].item.path:
+            merged_ops = []
+        else:
+            merged_ops = [Move(ops[0].item, ops[1].dest)]
+        merged = OperationHistoryEvent(
+            self._run, merged_ops, self._user_confirm,
+            self.allow_parallel, self.undo_yields_attention, self.executor,
+            self.control)
+        merged.done = [merged.operations] if merged_ops else []
+        return merged
+
+    @property
+    def has_effect (self):
+        """:inherit:
+
+Defined for this class as whether there are any :attr:`operations`.
+
+"""
+        return bool(self.operations)
+
+    def conflicts (self, other):
+        """:inherit:
+
+Events conflict if any operations in one access paths that operations in the
+other access, as for operations in different groups of a :class:`Schedule
+<fsmanage.schedule.Schedule>`.  This event conflicts with events of other
+types.
 
+"""
+        if not isinstance(other, OperationHistoryEvent):
+            return True
+        schedule = Schedule([self.operations, other.operations])
+        return bool(schedule.dependencies[0] or schedule.dependencies[1])
+
+    @property
     def can_undo (self):
-        """:inherit:"""
-        pass
+        """:inherit:
+
+Operations in :attr:`done` must also still be :meth:`available for undoing
+<OperationExecutor.undo_available>`.
+
+"""
+        if self.executor is None:
+            return True
+        done = {id(op) for group in self._done for op in group}
+        return all(
+            self.executor.can_undo(type(op)) and
+            (id(op) not in done or self.executor.undo_available(op))
+            for op in self.operations)
+
+    def discard (self):
+        """:inherit:
+
+This calls :meth:`OperationExecutor.release_undo_data` for each operation.
+
+"""
+        if self.executor is not None:
+            for op in self.operations:
+                self.executor.release_undo_data(op)
 
     def undo (self, future_type):
         """:meth:`HistoryEvent.undo <fsmanage.history.HistoryEvent.undo>`.
 
-Returned future is from :meth:`OperationExecutor.undo`.
+The :class:`HistoryEventResult <fsmanage.history.HistoryEventResult>`'s
+``result`` is as for :meth:`execute`, using :meth:`OperationExecutor.undo`.
+
+If the last execution failed part-way through, only operations which made
+changes are undone; this is how :class:`History <fsmanage.history.History>`
+reverts a failed execution.  Operations are undone in the reverse of the order
+they must be executed in, at the same time where ``allow_parallel`` permits.
+If undoing an operation fails, the operations which must be undone after it are
+skipped, but all others are still undone.  Afterwards, :attr:`done` contains
+exactly the operations which still need undoing, and the state is
+:attr:`SUCCESS <fsmanage.history.HistoryEventResult.SUCCESS>` only if it's
+empty.
 
 """
         # calls run('undo', op)
-        pass
+        if not self.can_undo:
+            raise TypeError('event cannot be undone:', self)
+        self.control.reset()
+        groups = self._done
+
+        def finish (results):
+            # anything not undone still needs undoing
+            self._done = [remaining for remaining in map(
+                _not_undone, groups, results) if remaining]
+            result = self._outcome(results, AttentionItems())
+            if (result.state == HistoryEventResult.SUCCESS and
+                    not self.undo_yields_attention):
+                result.result = AttentionItems()
+            return result
+
+        return self._run_groups(future_type, 'undo', groups, finish, True)
+
+
+def _not_undone (group, result):
+    # get the operations in a group still needing undoing, given the result
+    # from OperationHistoryEvent._run_group, or None if it wasn't started
+    if result is None:
+        return group
+    changed, attn, exc = result
+    if exc is None:
+        return ()
+    elif isinstance(exc, BatchOperationException):
+        undone = {id(op) for op in exc.succeeded}
+        return tuple(op for op in group if id(op) not in undone)
+    else:
+        return group
+
+
+def _undo_each (executor, ops):
+    # undo operations one at a time, in reverse order, gathering results like
+    # a batch handler
+    ops = ops[::-1]
+    future = executor.future_type()
+    state = {'attn': AttentionItems(), 'errors': [], 'succeeded': []}
+
+    def next_op (i):
+        while i < len(ops):
+            try:
+                op_future = executor.undo(ops[i])
+            except Exception as e:
+                state['errors'].append(e if isinstance(e, OperationException)
+                                       else OperationException(ops[i], False))
+                i += 1
+                continue
+            op_future.add_done_callback(lambda f, i=i: done(i, f))
+            return
+        if state['errors']:
+            future.set_exception(BatchOperationException(
+                state['errors'], state['succeeded'], state['attn']))
+        else:
+            future.set_result(state['attn'])
+
+    def done (i, op_future):
+        exc = op_future.exception()
+        if exc is None:
+            state['attn'] = state['attn'].extended(op_future.result())
+            state['succeeded'].append(ops[i])
+        elif isinstance(exc, OperationException):
+            state['errors'].append(exc)
+        else:
+            state['errors'].append(OperationException(ops[i], False))
+        next_op(i + 1)
+
+    next_op(0)
+    return future
 
 
 class OperationHistory (History):
@@ -67,7 +523,14 @@ implementations are in subclasses.
 """
 
     def __init__ (self):
-        pass
+        # operation type -> (execute, undo)
+        self._operations = {}
+        # operation type -> (execute_batch, undo_batch)
+        self._batch_operations = {}
+        self._progress_callbacks = []
+        self._checkpoint_callbacks = []
+        # operation types that may be executed again after failing
+        self._resumable = set()
 
     @property
     @abc.abstractmethod
@@ -86,9 +549,9 @@ Must support at least the ``add_done_callback``, ``set_result``,
     def supported_operations (self):
         """Set of :class:`Operation <fsmanage.operation.Operation>` subclasses
 supported by this executor."""
-        pass
+        return set(self._operations)
 
-    def support_operation (self, op, execute, undo=None):
+    def support_operation (self, op, execute, undo=None, resumable=False):
         """Add support for an operation type.
 
 :arg op: :class:`Operation <fsmanage.operation.Operation>` subclass to support.
@@ -96,12 +559,33 @@ supported by this executor."""
     :meth:`execute`.
 :arg undo: optional undo function for the operation; has the same signature as
     :meth:`undo`.  If :obj:`None`, operations of this type cannot be undone.
+:arg resumable: whether executing an operation of this type again after it
+    fails without reverting its changes safely completes it (see
+    :meth:`can_resume`).
 
 This adds ``operation`` to :attr:`supported_operations`.  If the operation is
-already supported, ``execute`` and ``undo`` override existing values.
+already supported, ``execute``, ``undo`` and ``resumable`` override existing
+values.
 
 """
-        pass
+        self._operations[op] = (execute, undo)
+        if resumable:
+            self._resumable.add(op)
+        else:
+            self._resumable.discard(op)
+
+    def can_resume (self, op):
+        """Return whether operations of a particular type may be executed (or
+undone) again after failing part-way through.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` subclass to check.
+
+Operations which fail with :attr:`reverted
+<fsmanage.operation.OperationException.reverted>` :obj:`True` can always be
+tried again; this is about those which leave changes behind.
+
+"""
+        return op in self._resumable
 
     def can_undo (self, op):
         """Return whether undo is supported for operations of a particular
@@ -114,9 +598,77 @@ Note that if this function returns :obj:`True`, a subsequent call to
 used when you do not intend to undo anything (eg. to indicate whether undo is
 possible in a user interface).
 
+"""
+        fns = self._operations.get(op)
+        return fns is not None and fns[1] is not None
+
+    def undo_available (self, op):
+        """Return whether an executed operation can still be undone.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that has been
+    executed.
+
+This is for executors which keep data needed to undo operations and may
+discard it (see :class:`UndoStore <fsmanage.undostore.UndoStore>`).  It only
+makes sense if :meth:`can_undo` returns :obj:`True` for the operation's type.
+This implementation always returns :obj:`True`.
+
+"""
+        return True
+
+    def release_undo_data (self, op):
+        """Discard any data kept to undo an operation, which won't be undone.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that may have been
+    executed.
+
+This implementation does nothing.
+
 """
         pass
 
+    @property
+    def batch_operations (self):
+        """Set of :class:`Operation <fsmanage.operation.Operation>` subclasses
+for which this executor supports :meth:`execute_batch`."""
+        return set(self._batch_operations)
+
+    def support_batch (self, op, execute, undo=None):
+        """Add support for executing operations of some type in batches.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` subclass to support;
+    must already be in :attr:`supported_operations`.
+:arg execute: batch execution function for the operation; has the same
+    signature as :meth:`execute_batch`, but is always passed ``parallel``.
+:arg undo: optional batch undo function for the operation; has the same
+    signature as :meth:`undo_batch`, but is always passed ``parallel``.  If
+    :obj:`None`, :meth:`undo_batch` undoes operations one at a time.
+
+This adds ``op`` to :attr:`batch_operations`.
+
+"""
+        self._batch_operations[op] = (execute, undo)
+
+    def _handlers (self, op):
+        try:
+            return self._operations[type(op)]
+        except KeyError:
+            raise TypeError('unsupported operation type:', type(op))
+
+    def _batch_handlers (self, ops):
+        op_types = {type(op) for op in ops}
+        if len(op_types) != 1:
+            raise TypeError('batch must contain operations of a single type:',
+                            op_types)
+        op_type = op_types.pop()
+        if op_type not in self._operations:
+            raise TypeError('unsupported operation type:', op_type)
+        try:
+            return self._batch_operations[op_type]
+        except KeyError:
+            raise TypeError('batches not supported for operation type:',
+                            op_type)
+
     def execute (self, op, confirm):
         """Execute an operation.
 
@@ -133,7 +685,7 @@ possible in a user interface).
 :raises TypeError: if ``op`` is not in :attr:`supported_operations`.
 
 """
-        pass
+        return self._handlers(op)[0](op, confirm)
 
     def undo (self, op):
         """Undo an operation, if possible.
@@ -148,9 +700,191 @@ possible in a user interface).
 :raises TypeError: if ``op`` is not in :attr:`supported_operations`, or if undo
     is not supported for operations of ``op``'s type.
 
+"""
+        undo = self._handlers(op)[1]
+        if undo is None:
+            raise TypeError('undo not supported for operation type:', type(op))
+        return undo(op)
+
+    def execute_batch (self, ops, confirm, parallel=True):
+        """Execute a batch of operations of the same type.
+
+:arg ops: non-empty sequence of :class:`Operation
+    <fsmanage.operation.Operation>` instances, all of the same type, which is
+    in :attr:`batch_operations`.
+:arg confirm: as taken by :meth:`execute`.
+:arg parallel: whether the operations may run at the same time; if
+    :obj:`False`, they run one at a time, in order.
+
+:returns: :attr:`future <future_type>` whose result is an
+    :class:`AttentionItems <fsmanage.item.AttentionItems>` instance for the
+    whole batch.  If any operations fail, its exception is a
+    :class:`BatchOperationException
+    <fsmanage.operation.BatchOperationException>`.
+
+:raises TypeError: if ``ops`` are not all of the same type, or batches are not
+    supported for that type.
+
+A batch lets the executor amortise work shared between the operations (such as
+opening the directory containing their items) and run them concurrently.  The
+operations must be independent of each other.
+
+"""
+        return self._batch_handlers(ops)[0](tuple(ops), confirm, parallel)
+
+    def undo_batch (self, ops, parallel=True):
+        """Undo a batch of operations previously passed to
+:meth:`execute_batch`.
+
+:arg ops: as taken by :meth:`execute_batch`.
+:arg parallel: as taken by :meth:`execute_batch`; if :obj:`False`, operations
+    are undone in reverse order.
+
+:returns: as for :meth:`execute_batch`.
+
+:raises TypeError: as for :meth:`execute_batch`, or if undo is not supported
+    for operations of the batch's type.
+
+"""
+        ops = tuple(ops)
+        undo_batch = self._batch_handlers(ops)[1]
+        if undo_batch is not None:
+            return undo_batch(ops, parallel)
+        elif not self.can_undo(type(ops[0])):
+            raise TypeError('undo not supported for operation type:',
+                            type(ops[0]))
+        return _undo_each(self, ops)
+
+    def on_progress (self, *fns):
+        """Register functions for calling when an operation makes progress.
+
+:arg fns: any number of functions to register as callbacks.  Each is called
+    with the arguments passed to :meth:`report_progress`, in the thread the
+    operation runs in.
+
+"""
+        self._progress_callbacks.extend(fns)
+
+    def report_progress (self, op, bytes_done=0, bytes_total=0, items_done=0,
+                         items_total=0):
+        """Report progress made by a running operation.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that made progress.
+:arg bytes_done: number of bytes of data processed since the last report.
+:arg bytes_total: number of bytes newly found to need processing.
+:arg items_done: number of items processed since the last report.
+:arg items_total: number of items newly found to need processing.
+
+Implementations call this while executing or undoing operations, for example
+after each chunk of data or each file; all amounts are increments.  Reporting
+progress is optional.
+
+"""
+        for fn in self._progress_callbacks:
+            fn(op, bytes_done, bytes_total, items_done, items_total)
+
+    def on_checkpoint (self, *fns):
+        """Register functions for calling at each :meth:`checkpoint`.
+
+:arg fns: any number of functions to register as callbacks.  Each is called
+    with the running :class:`Operation <fsmanage.operation.Operation>`, in the
+    thread the operation runs in.  To pause the operation, a callback blocks
+    until it should continue; to cancel it, a callback raises
+    :class:`CancelledException <fsmanage.operation.CancelledException>`.
+
+"""
+        self._checkpoint_callbacks.extend(fns)
+
+    def checkpoint (self, op):
+        """Give a running operation the chance to be paused or cancelled.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that is running.
+
+:raises CancelledException: (:class:`fsmanage.operation.CancelledException`)
+    if the operation should stop.
+
+Implementations call this while executing or undoing operations, at points
+where it's safe to stop, for example between chunks of data or files.  On
+cancellation, they should revert what they can and fail with the exception,
+with :attr:`reverted <fsmanage.operation.OperationException.reverted>` set
+accordingly.  Supporting cancellation is optional.
+
+"""
+        for fn in self._checkpoint_callbacks:
+            fn(op)
+
+    def undo_data (self, op):
+        """Get data this executor needs in order to undo an operation.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that has been
+    executed.
+
+:returns: :class:`bytes`, or :obj:`None` if nothing is needed beyond the
+    operation itself.
+
+Along with :meth:`restore_undo_data`, this allows operations to be undone by
+another instance of the executor, for example after restarting.  This
+implementation returns :obj:`None`.
+
+"""
+        return None
+
+    def restore_undo_data (self, op, data):
+        """Make an operation undoable using data from :meth:`undo_data`.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` to restore data for.
+:arg data: :class:`bytes` returned by :meth:`undo_data` for an equivalent
+    operation.
+
+This implementation does nothing.
+
 """
         pass
 
+    def undo_size (self, op):
+        """Get the amount of data this executor keeps in order to undo an
+operation.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that has been
+    executed.
+
+:returns: size in bytes.
+
+This implementation returns the size of :meth:`undo_data`.
+
+"""
+        data = self.undo_data(op)
+        return 0 if data is None else len(data)
+
+    def operation_devices (self, ops):
+        """Find the devices that operations do their work on.
+
+:arg ops: non-empty sequence of :class:`Operation
+    <fsmanage.operation.Operation>` instances, to be executed or undone
+    together.
+
+:returns: set of hashable objects identifying devices, each as accepted by
+    :meth:`device_limit`.
+
+Operations using the same device may slow each other down when run at the same
+time.  This implementation returns an empty set, meaning nothing is known.
+
+"""
+        return set()
+
+    def device_limit (self, device):
+        """Get the maximum number of executor calls that should use a device at
+once.
+
+:arg device: device as returned by :meth:`operation_devices`.
+
+:returns: the maximum, or :obj:`None` for no limit.
+
+This implementation always returns :obj:`None`.
+
+"""
+        return None
+
     @abc.abstractmethod
     def get_metadata (self, item, *properties):
         """Retrieve metadata about an item in the filesystem.
@@ -163,6 +897,14 @@ possible in a user interface).
           a sequence of :class:`Item <fsmanage.item.Item>` instances
           'contained' in the directory.
 
+    and these, if supported, should have the given meaning:
+
+        - ``mtime``: a number which changes whenever the item is modified; for
+          a :class:`Dir <fsmanage.item.Dir>`, this includes whenever its
+          ``items`` change.
+        - ``size``: size of a :class:`File <fsmanage.item.File>`'s data, in
+          bytes.
+
 :returns: :attr:`future <future_type>` whose result is a :class:`dict` with
     keys from ``properties`` giving the metadata.  If the value of a property
     cannot be determined for any reason, it is omitted from the result.
@@ -177,6 +919,21 @@ class OperationManager (metaclass=abc.ABCMeta):
 :arg executor: :class:`OperationExecutor` to use.
 :arg history: :class:`OperationHistory` to use.
 :arg undo_yields_attention: as taken by :class:`OperationHistoryEvent`.
+:arg progress_interval: minimum time between progress notifications, in seconds
+    (see :class:`ProgressTracker <fsmanage.progress.ProgressTracker>`).
+:arg retry_policy: :class:`RetryPolicy <fsmanage.retry.RetryPolicy>` used to
+    retry failed calls to :attr:`executor` made through :meth:`get_metadata`
+    and :meth:`execute` (and undo and redo through :attr:`history`).  If
+    :obj:`None`, nothing is retried.
+:arg throttle: :class:`Throttle <fsmanage.throttle.Throttle>` limiting the rate
+    of all operations run through :meth:`execute` and :attr:`history`, or
+    :obj:`None`.  Groups of operations may also be limited separately, through
+    :attr:`OperationControl.throttle`.
+
+Calls which execute or undo operations are queued by :attr:`device_scheduler`
+to keep within :meth:`OperationExecutor.device_limit` for the devices they use
+(see :meth:`OperationExecutor.operation_devices`); operations executed together
+through :meth:`execute` share a queue.
 
 This is an abstract class and may not be instantiated - subclasses should
 implement :meth:`run`, eg. for multi-threaded execution.
@@ -186,21 +943,36 @@ To undo and redo, use methods of :attr:`history`.
 """
     # to undo/redo, use .history
 
-    def __init__ (self, executor, history, undo_yields_attention=False):
+    def __init__ (self, executor, history, undo_yields_attention=False,
+                  progress_interval=.1, retry_policy=None, throttle=None):
         #: ``executor`` argument.
-        self.executor = None
+        self.executor = executor
         #: ``history`` argument.
-        self.history = None
+        self.history = history
         #: ``undo_yields_attention`` argument.
-        self.undo_yields_attention = None
+        self.undo_yields_attention = undo_yields_attention
+        #: ``retry_policy`` argument.
+        self.retry_policy = retry_policy
+        #: ``throttle`` argument; may be changed at any time.
+        self.throttle = throttle
+        #: :class:`ProgressTracker <fsmanage.progress.ProgressTracker>` for
+        #: operations run through :meth:`execute` and :attr:`history`.
+        self.progress_tracker = ProgressTracker(progress_interval)
+        executor.on_progress(self._report)
+        # running operation -> OperationControl
+        self._controls = {}
+        executor.on_checkpoint(self._checkpoint)
+        #: :class:`DeviceScheduler <fsmanage.device.DeviceScheduler>` queueing
+        #: operations by device.
+        self.device_scheduler = DeviceScheduler()
 
     @abc.abstractmethod
     def run (self, action, *args):
         """Execute something using :attr:`executor`.
 
 :arg action: action to perform - a string corresponding to an
-    :class:`OperationExecutor` method: ``'execute'``, ``'undo'`` or
-    ``'get_metadata'``.
+    :class:`OperationExecutor` method: ``'execute'``, ``'undo'``,
+    ``'execute_batch'``, ``'undo_batch'`` or ``'get_metadata'``.
 :arg args: arguments taken by the :class:`OperationExecutor` method
     corresponding to ``action``.
 
@@ -215,10 +987,72 @@ Abstract method - must be implemented by subclasses.
 
     def get_metadata (self, item, *properties):
         """Like :meth:`OperationExecutor.get_metadata`."""
-        # calls run('get_metadata', item, properties)
-        pass
+        return self._run_retrying('get_metadata', item, *properties)
 
-    def execute (self, ops, confirm=None, allow_parallel=True):
+    def _run_retrying (self, action, *args):
+        # run, retrying according to retry_policy
+        if self.retry_policy is None:
+            return self.run(action, *args)
+        return self.retry_policy.run(self.run, self.executor, action, *args)
+
+    @property
+    def progress (self):
+        """:class:`Progress <fsmanage.progress.Progress>` of running
+operations."""
+        return self.progress_tracker.progress
+
+    def on_progress (self, *fns):
+        """Register functions for calling when running operations make
+progress.
+
+:arg fns: any number of functions to register as callbacks, as taken by
+    :meth:`ProgressTracker.on_change
+    <fsmanage.progress.ProgressTracker.on_change>`.
+
+"""
+        self.progress_tracker.on_change(*fns)
+
+    def _run_tracked (self, control, action, *args):
+        # run once devices are available, recording running operations in
+        # progress_tracker, and registering control for them
+        ops = tuple(args[0]) if action.endswith('_batch') else (args[0],)
+        executor = self.executor
+        devices = {device: executor.device_limit(device)
+                   for device in executor.operation_devices(ops)}
+        return self.device_scheduler.submit(
+            executor.future_type, devices, control,
+            lambda: self._start_tracked(control, ops, action, *args))
+
+    def _start_tracked (self, control, ops, action, *args):
+        tracker = self.progress_tracker
+        for op in ops:
+            self._controls[op] = control
+        tracker.started(ops)
+
+        def done (future):
+            for op in ops:
+                self._controls.pop(op, None)
+            tracker.finished(ops)
+
+        future = self._run_retrying(action, *args)
+        future.add_done_callback(done)
+        return future
+
+    def _report (self, op, *counts):
+        self.progress_tracker.report(op, *counts)
+        control = self._controls.get(op)
+        if control is not None:
+            # the same throttle may be used for both
+            for throttle in {self.throttle, control.throttle} - {None}:
+                throttle.report(op, *counts)
+
+    def _checkpoint (self, op):
+        control = self._controls.get(op)
+        if control is not None:
+            throttle = self.throttle
+            control.checkpoint(op, () if throttle is None else (throttle,))
+
+    def execute (self, ops, confirm=None, allow_parallel=True, control=None):
         """Execute a group of operations.
 
 :arg ops: sequence of :class:`Operation <fsmanage.operation.Operation>`
@@ -229,11 +1063,124 @@ Abstract method - must be implemented by subclasses.
     :class:`OperationExecutor.execute`.  If :obj:`None`, the response is always
     :attr:`Confirmation.CONFIRM_ALL
     <fsmanage.operation.Confirmation.CONFIRM_ALL>`.
+:arg allow_parallel: as taken by :class:`OperationHistoryEvent`.
+:arg control: :class:`OperationControl` for cancelling, pausing or
+    throttling the operations, now and when they're undone or redone.
 
-:returns: result of :meth:`OperationExecutor.execute`.
+:returns: :attr:`future <OperationExecutor.future_type>` whose result is a
+    :class:`HistoryEventResult <fsmanage.history.HistoryEventResult>` as
+    described by :meth:`OperationHistoryEvent.execute`.  The future has a
+    ``control`` attribute: the :class:`OperationControl` for the operations,
+    which is ``control``, or one created for them if it's :obj:`None`.
 
-:raises TypeError: if the operation is not supported.
+:raises TypeError: if an operation is not supported.
+
+Consecutive operations which can be batched are executed through
+:meth:`OperationExecutor.execute_batch` (see :class:`OperationHistoryEvent`).
 
 """
-        # call history.add with OperationHistoryEvent(self.run, ops, confirm, allow_parallel, undo_yields_attention)
-        pass
+        event = self.create_event(ops, confirm, allow_parallel, control)
+        future = self.history.add(event)
+        future.control = event.control
+        return future
+
+    def create_event (self, ops, confirm=None, allow_parallel=True,
+                      control=None):
+        """Create an event to execute a group of operations using this
+manager.
+
+Arguments are as taken by :meth:`execute`.
+
+:returns: :class:`OperationHistoryEvent` which hasn't been executed.
+
+:raises TypeError: if an operation is not supported.
+
+:meth:`execute` adds such an event to :attr:`history`; this is useful for
+restoring saved events.
+
+"""
+        ops = tuple(ops)
+        supported = self.executor.supported_operations
+        for op in ops:
+            if type(op) not in supported:
+                raise TypeError('unsupported operation type:', type(op))
+        if control is None:
+            control = OperationControl()
+        return OperationHistoryEvent(
+            lambda action, *args: self._run_tracked(control, action, *args),
+            ops, confirm, allow_parallel, self.undo_yields_attention,
+            self.executor, control)
+
+
+class SynchronousOperationManager (OperationManager):
+    """Operation manager which runs everything immediately, in the calling
+thread.
+
+Arguments are as taken by :class:`OperationManager`.
+
+"""
+
+    def run (self, action, *args):
+        """:inherit:"""
+        try:
+            return getattr(self.executor, action)(*args)
+        except Exception as e:
+            return util.failed(self.executor.future_type, e)
+
+
+class ThreadedOperationManager (OperationManager):
+    """Operation manager which runs everything in a pool of threads.
+
+:arg threads: maximum number of executor calls to run at once.
+
+Other arguments are as taken by :class:`OperationManager`.
+
+Combined with :class:`OperationHistoryEvent`'s ``allow_parallel``, this runs
+operations that don't conflict with each other at the same time.
+
+"""
+
+    def __init__ (self, executor, history, undo_yields_attention=False,
+                  progress_interval=.1, retry_policy=None, throttle=None,
+                  threads=4):
+        OperationManager.__init__(self, executor, history,
+                                  undo_yields_attention, progress_interval,
+                                  retry_policy, throttle)
+        #: ``threads`` argument.
+        self.threads = threads
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool (self):
+        """:class:`concurrent.futures.ThreadPoolExecutor` that executor calls
+run in."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    self.threads)
+            return self._pool
+
+    def close (self):
+        """Wait for running calls to finish, and release the threads."""
+        with self._pool_lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown()
+
+    def run (self, action, *args):
+        """:inherit:"""
+        future = self.executor.future_type()
+
+        def call ():
+            try:
+                util.relay(getattr(self.executor, action)(*args), future)
+            except Exception as e:
+                future.set_exception(e)
+
+        try:
+            self.pool.submit(call)
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -0,0 +1,170 @@
+import time
+import threading
+
+
+class Progress:
+    """Snapshot of the progress of running operations.
+
+:arg operations: the :class:`Operation <fsmanage.operation.Operation>`
+    instances running.
+:arg bytes_done: number of bytes of data processed.
+:arg bytes_total: number of bytes of data known to need processing.
+:arg items_done: number of items processed.
+:arg items_total: number of items known to need processing.
+
+Totals only include what executors have found so far, so they may grow while
+operations run (for example, as a directory being copied is read).
+
+"""
+
+    def __init__ (self, operations=(), bytes_done=0, bytes_total=0,
+                  items_done=0, items_total=0):
+        #: ``operations`` argument, as a :class:`tuple`.
+        self.operations = tuple(operations)
+        #: ``bytes_done`` argument.
+        self.bytes_done = bytes_done
+        #: ``bytes_total`` argument.
+        self.bytes_total = bytes_total
+        #: ``items_done`` argument.
+        self.items_done = items_done
+        #: ``items_total`` argument.
+        self.items_total = items_total
+
+    def __repr__ (self):
+        return ('<Progress: {} operations, {}/{} bytes, {}/{} items>'.format(
+            len(self.operations), self.bytes_done, self.bytes_total,
+            self.items_done, self.items_total))
+
+
+class ProgressTracker:
+    """Track progress of operations, and notify listeners at a limited rate.
+
+:arg interval: minimum time between notifications, in seconds (according to
+    ``current_time``).  For example, ``.1`` notifies at most 10 times per
+    second.
+:arg current_time: a function that takes no arguments and returns the current
+    time as a number.
+
+Counts accumulate while anything is running; once everything has finished,
+they are reset the next time an operation starts.  So totals cover all
+operations that ran together, rather than just those running now.
+
+Callbacks are called in whichever thread reports progress, so they should be
+quick.  Reports made within ``interval`` of the last notification are only
+delivered by a later notification, except that a notification is always sent
+as soon as nothing is running.
+
+"""
+
+    def __init__ (self, interval=.1, current_time=time.monotonic):
+        #: ``interval`` argument.
+        self.interval = interval
+        #: ``current_time`` argument.
+        self.current_time = current_time
+        # op -> number of times it is running
+        self._running = {}
+        self._counts = [0, 0, 0, 0]
+        self._callbacks = []
+        self._last_notify = None
+        self._pending = False
+        self._lock = threading.Lock()
+
+    @property
+    def progress (self):
+        """Current :class:`Progress`."""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot (self):
+        return Progress(self._running, *self._counts)
+
+    def on_change (self, *fns):
+        """Register functions for calling when progress changes.
+
+:arg fns: any number of functions to register as callbacks.  Each is called
+    like ``fn(progress)``, where ``progress`` is a :class:`Progress` instance.
+
+"""
+        self._callbacks.extend(fns)
+
+    def _changed (self, force=False):
+        # call with lock held; returns a Progress to notify with, or None
+        if not self._callbacks:
+            return None
+        now = self.current_time()
+        if (force or self._last_notify is None or
+                now - self._last_notify >= self.interval):
+            self._last_notify = now
+            self._pending = False
+            return self._snapshot()
+        self._pending = True
+        return None
+
+    def _notify (self, progress):
+        if progress is not None:
+            for fn in self._callbacks:
+                fn(progress)
+
+    def started (self, ops):
+        """Record that operations have started running.
+
+:arg ops: sequence of :class:`Operation <fsmanage.operation.Operation>`
+    instances.
+
+"""
+        with self._lock:
+            if not self._running:
+                self._counts = [0, 0, 0, 0]
+            for op in ops:
+                self._running[op] = self._running.get(op, 0) + 1
+            progress = self._changed()
+        self._notify(progress)
+
+    def finished (self, ops):
+        """Record that operations have stopped running.
+
+:arg ops: sequence of :class:`Operation <fsmanage.operation.Operation>`
+    instances previously passed to :meth:`started`.
+
+"""
+        with self._lock:
+            for op in ops:
+                n = self._running.get(op, 0) - 1
+                if n > 0:
+                    self._running[op] = n
+                else:
+                    self._running.pop(op, None)
+            progress = self._changed(not self._running)
+        self._notify(progress)
+
+    def report (self, op, bytes_done=0, bytes_total=0, items_done=0,
+                items_total=0):
+        """Record progress made by an operation.
+
+:arg op: :class:`Operation <fsmanage.operation.Operation>` that made progress.
+:arg bytes_done: number of bytes processed since the last report.
+:arg bytes_total: number of bytes newly found to need processing.
+:arg items_done: number of items processed since the last report.
+:arg items_total: number of items newly found to need processing.
+
+Reports for operations that aren't running are ignored.  Has the same signature
+as functions registered with :meth:`OperationExecutor.on_progress
+<fsmanage.opexec.OperationExecutor.on_progress>`.
+
+"""
+        with self._lock:
+            if op not in self._running:
+                return
+            counts = self._counts
+            counts[0] += bytes_done
+            counts[1] += bytes_total
+            counts[2] += items_done
+            counts[3] += items_total
+            progress = self._changed()
+        self._notify(progress)
+
+    def flush (self):
+        """Notify listeners now if any progress hasn't been delivered yet."""
+        with self._lock:
+            progress = self._changed(True) if self._pending else None
+        self._notify(progress)
@@ -0,0 +1,169 @@
+import random
+
+from .operation import (OperationException, BatchOperationException,
+                        TRANSIENT_ERRNOS)
+from . import util
+
+
+class RetryPolicy:
+    """Decide whether and when to try again after executor calls fail.
+
+:arg max_attempts: maximum number of times to make a call, including the first.
+:arg base_delay: time to wait before the first retry, in seconds.
+:arg max_delay: maximum time to wait before any retry, in seconds.
+:arg multiplier: factor the delay grows by after each retry.
+:arg jitter: proportion of each delay which is random, between ``0`` and ``1``;
+    this stops many calls that failed together from retrying together.
+:arg call_later: function taking a delay in seconds and a function, which calls
+    the function after the delay; defaults to :func:`util.call_later
+    <fsmanage.util.call_later>`.
+:arg random: function returning a random number between ``0`` and ``1``.
+
+Only transient failures are retried (see :meth:`is_transient`).  Metadata
+queries are always safe to retry; operations are only retried if they reverted
+their changes when they failed, or their executor declares them resumable (see
+:meth:`OperationExecutor.can_resume
+<fsmanage.opexec.OperationExecutor.can_resume>`).  When only some operations in
+a batch fail, only those are retried.
+
+Pass an instance to :class:`OperationManager
+<fsmanage.opexec.OperationManager>` to use it.
+
+"""
+
+    def __init__ (self, max_attempts=5, base_delay=.1, max_delay=10,
+                  multiplier=2, jitter=.5, call_later=util.call_later,
+                  random=random.random):
+        #: ``max_attempts`` argument.
+        self.max_attempts = max_attempts
+        #: ``base_delay`` argument.
+        self.base_delay = base_delay
+        #: ``max_delay`` argument.
+        self.max_delay = max_delay
+        #: ``multiplier`` argument.
+        self.multiplier = multiplier
+        #: ``jitter`` argument.
+        self.jitter = jitter
+        #: ``call_later`` argument.
+        self.call_later = call_later
+        #: ``random`` argument.
+        self.random = random
+
+    def delay (self, attempt):
+        """Get the time to wait before a retry.
+
+:arg attempt: number of attempts made so far (at least ``1``).
+
+:returns: delay in seconds.
+
+"""
+        delay = min(self.max_delay,
+                    self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * self.random())
+
+    def is_transient (self, exc):
+        """Return whether a failure is likely to be temporary.
+
+:arg exc: exception that a call failed with.
+
+This implementation returns :obj:`True` for exceptions with a true
+``transient`` attribute (like :attr:`OperationException.transient
+<fsmanage.operation.OperationException.transient>`), for
+:class:`TimeoutError`, and for :class:`OSError` with an ``errno`` in
+:data:`TRANSIENT_ERRNOS <fsmanage.operation.TRANSIENT_ERRNOS>`.
+
+"""
+        return (getattr(exc, 'transient', False) or
+                isinstance(exc, TimeoutError) or
+                (isinstance(exc, OSError) and
+                 exc.errno in TRANSIENT_ERRNOS))
+
+    def _retryable (self, executor, exc):
+        # whether an operation's failure allows trying again
+        return (self.is_transient(exc) and
+                (exc.reverted or executor.can_resume(type(exc.operation))))
+
+    def run (self, run, executor, action, *args):
+        """Make an executor call, retrying on failure.
+
+:arg run: function to make the call, with the signature of
+    :meth:`OperationManager.run <fsmanage.opexec.OperationManager.run>`.
+:arg executor: :class:`OperationExecutor
+    <fsmanage.opexec.OperationExecutor>` that ``run`` uses.
+:arg action: as taken by ``run``.
+:arg args: as taken by ``run``.
+
+:returns: :attr:`future <fsmanage.opexec.OperationExecutor.future_type>` with
+    the outcome of the last attempt.  For a batch, successes from all attempts
+    are combined.
+
+"""
+        future_type = executor.future_type
+        result = future_type()
+        batch = action in ('execute_batch', 'undo_batch')
+        # for batches, outcomes of operations not being retried
+        state = {'succeeded': (), 'errors': (), 'attention': None}
+
+        def finish (args, exc=None, value=None):
+            attn = state['attention']
+            if attn is not None:
+                # combine with earlier attempts of a batch
+                if exc is None:
+                    value = attn.extended(value)
+                    if state['errors']:
+                        # the last attempt ran args[0], and all succeeded
+                        exc = BatchOperationException(
+                            state['errors'],
+                            state['succeeded'] + tuple(args[0]), value)
+                elif isinstance(exc, BatchOperationException):
+                    exc = BatchOperationException(
+                        state['errors'] + exc.errors,
+                        state['succeeded'] + exc.succeeded,
+                        attn.extended(exc.attention))
+                elif isinstance(exc, OperationException):
+                    exc = BatchOperationException(
+                        state['errors'] + (exc,), state['succeeded'], attn)
+            if exc is None:
+                result.set_result(value)
+            else:
+                result.set_exception(exc)
+
+        def attempt (n, args):
+            try:
+                future = run(action, *args)
+            except Exception as e:
+                future = util.failed(future_type, e)
+            future.add_done_callback(lambda future: attempted(n, args, future))
+
+        def attempted (n, args, future):
+            exc = future.exception()
+            if exc is None:
+                return finish(args, None, future.result())
+            if n >= self.max_attempts:
+                return finish(args, exc)
+
+            if action == 'get_metadata':
+                retry = self.is_transient(exc)
+            elif batch and isinstance(exc, BatchOperationException):
+                retry_errors = [e for e in exc.errors
+                                if self._retryable(executor, e)]
+                retry = bool(retry_errors)
+                if retry:
+                    state['succeeded'] += exc.succeeded
+                    state['errors'] += tuple(e for e in exc.errors
+                                             if e not in retry_errors)
+                    state['attention'] = (
+                        exc.attention if state['attention'] is None
+                        else state['attention'].extended(exc.attention))
+                    args = ((tuple(e.operation for e in retry_errors),) +
+                            args[1:])
+            else:
+                retry = (isinstance(exc, OperationException) and
+                         self._retryable(executor, exc))
+
+            if not retry:
+                return finish(args, exc)
+            self.call_later(self.delay(n), lambda: attempt(n + 1, args))
+
+        attempt(1, args)
+        return result
@@ -0,0 +1,227 @@
+import threading
+import collections
+
+from .operation import Operation
+from . import util
+
+
+class Schedule:
+    """Dependency graph deciding which groups of operations may run at the same
+time.
+
+:arg groups: sequence of groups of :class:`Operation
+    <fsmanage.operation.Operation>` instances, in the order they were
+    requested.  Each group is treated as a unit, accessing all the paths its
+    operations access (see :meth:`Operation.touched_paths
+    <fsmanage.operation.Operation.touched_paths>`).
+:arg ordered: if :obj:`True`, paths are ignored, and each group runs after the
+    one before it.
+
+Two groups conflict if one accesses a path within (or equal to) a path the
+other accesses, unless both only read.  Conflicting groups run one after the
+other:
+
+- a group creating a directory runs before a group accessing something inside
+  it.
+- a group removing a directory runs after a group accessing something inside
+  it.
+- otherwise, the group requested first runs first.
+
+If these rules contradict each other, all conflicting groups run in the order
+they were requested.
+
+Paths are indexed by prefix, so building the graph takes time proportional to
+the total length of all paths accessed, plus the number of conflicts.
+
+"""
+
+    def __init__ (self, groups, ordered=False):
+        #: ``groups`` argument, as a :class:`tuple` of :class:`tuple`.
+        self.groups = tuple(tuple(group) for group in groups)
+        #: :class:`list` giving, for each group, the :class:`set` of indices in
+        #: :attr:`groups` of groups that must finish before it starts.
+        self.dependencies = [set() for group in self.groups]
+        #: :class:`list` giving, for each group, the :class:`set` of indices in
+        #: :attr:`groups` of groups that depend on it.
+        self.dependents = [set() for group in self.groups]
+        if ordered:
+            for i in range(1, len(self.groups)):
+                self._add_edge(i - 1, i, True)
+            return
+        edges = self._conflicts()
+        for (earlier, later), in_order in edges.items():
+            self._add_edge(earlier, later, in_order)
+        if not self._acyclic():
+            for deps in self.dependencies + self.dependents:
+                deps.clear()
+            for earlier, later in edges:
+                self._add_edge(earlier, later, True)
+
+    def _add_edge (self, earlier, later, in_order):
+        if not in_order:
+            earlier, later = later, earlier
+        self.dependencies[later].add(earlier)
+        self.dependents[earlier].add(later)
+
+    def _conflicts (self):
+        # returns {(earlier, later): in_order}, where in_order is True if
+        # earlier should run first, False if later should, and None if the
+        # rules contradict each other (and earlier should run first)
+        edges = {}
+        # path -> [(group, access)]
+        at = {}
+        # path -> [(group, access)] for accesses strictly within path
+        within = {}
+
+        def conflict (earlier, later, in_order):
+            key = (earlier, later)
+            if key in edges and edges[key] != in_order:
+                in_order = None
+            edges[key] = in_order
+
+        for i, group in enumerate(self.groups):
+            accesses = {}
+            for op in group:
+                for path, access in op.touched_paths():
+                    accesses.setdefault(tuple(path), set()).add(access)
+            for path, path_accesses in accesses.items():
+                for access in path_accesses:
+                    # earlier accesses at or above path
+                    for n in range(len(path) + 1):
+                        prefix = path[:n]
+                        for j, other in at.get(prefix, ()):
+                            if j == i or (access == other == Operation.READ):
+                                continue
+                            if n < len(path):
+                                # other is an ancestor
+                                in_order = other != Operation.REMOVE
+                            else:
+                                in_order = True
+                            conflict(j, i, in_order)
+                    # earlier accesses below path
+                    for j, other in within.get(path, ()):
+                        if j == i or (access == other == Operation.READ):
+                            continue
+                        conflict(j, i, access != Operation.CREATE)
+                for access in path_accesses:
+                    at.setdefault(path, []).append((i, access))
+                    for n in range(len(path)):
+                        within.setdefault(path[:n], []).append((i, access))
+        for key, in_order in edges.items():
+            if in_order is None:
+                edges[key] = True
+        return edges
+
+    def _acyclic (self):
+        # Kahn's algorithm
+        waiting = [len(deps) for deps in self.dependencies]
+        ready = [i for i, n in enumerate(waiting) if n == 0]
+        seen = 0
+        while ready:
+            i = ready.pop()
+            seen += 1
+            for j in self.dependents[i]:
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    ready.append(j)
+        return seen == len(self.groups)
+
+    def reversed (self):
+        """Create a schedule for reverting the groups of this schedule.
+
+:returns: :class:`Schedule` with the same :attr:`groups`, where each group runs
+    only after all the groups that depended on it in this schedule.
+
+"""
+        schedule = Schedule(())
+        schedule.groups = self.groups
+        schedule.dependencies = [set(deps) for deps in self.dependents]
+        schedule.dependents = [set(deps) for deps in self.dependencies]
+        return schedule
+
+    def run (self, future_type, start, succeeded=None, skip_dependents=False):
+        """Run all groups, each as soon as its dependencies have finished.
+
+:arg future_type: type of future to return (see
+    :attr:`OperationExecutor.future_type
+    <fsmanage.opexec.OperationExecutor.future_type>`).
+:arg start: function called with an index in :attr:`groups` to start running
+    that group; returns a future which completes when the group finishes.
+:arg succeeded: function called with the result of a group's future to decide
+    whether the group succeeded; by default, a group succeeds if its future
+    doesn't fail.
+:arg skip_dependents: if :obj:`True`, a failed group only stops the groups
+    which depend on it (directly or indirectly) from starting, and all other
+    groups still run.
+
+:returns: future whose result is a :class:`list` giving, for each group, the
+    completed future returned by ``start``, or :obj:`None` if the group was
+    never started.
+
+By default, after a group fails, no more groups are started, and the returned
+future completes once those already running have finished.
+
+"""
+        n = len(self.groups)
+        futures = [None] * n
+        waiting = [len(deps) for deps in self.dependencies]
+        ready = collections.deque(i for i in range(n) if waiting[i] == 0)
+        # running includes groups in ready
+        state = {'running': len(ready), 'stopped': False, 'starting': False,
+                 'finished': False}
+        lock = threading.Lock()
+        result = future_type()
+
+        def finish ():
+            # call with lock held; returns whether to set the result
+            if (state['running'] == 0 and not state['starting'] and
+                    not state['finished']):
+                state['finished'] = True
+                return True
+            return False
+
+        def start_ready ():
+            # only one thread starts groups at a time; this also stops the
+            # stack from growing when groups complete as soon as they start
+            with lock:
+                if state['starting']:
+                    return
+                state['starting'] = True
+            while True:
+                with lock:
+                    if not ready:
+                        state['starting'] = False
+                        finished = finish()
+                        break
+                    i = ready.popleft()
+                try:
+                    future = start(i)
+                except Exception as e:
+                    future = util.failed(future_type, e)
+                future.add_done_callback(lambda future, i=i: done(i, future))
+            if finished:
+                result.set_result(futures)
+
+        def done (i, future):
+            if future.exception() is not None:
+                ok = False
+            else:
+                ok = succeeded is None or succeeded(future.result())
+            with lock:
+                futures[i] = future
+                state['running'] -= 1
+                if not ok and not skip_dependents and not state['stopped']:
+                    state['stopped'] = True
+                    state['running'] -= len(ready)
+                    ready.clear()
+                # a failed group's dependents never become ready
+                if ok and not state['stopped']:
+                    for j in self.dependents[i]:
+                        waiting[j] -= 1
+                        if waiting[j] == 0:
+                            ready.append(j)
+                            state['running'] += 1
+            start_ready()
+
+        start_ready()
+        return result
@@ -0,0 +1,261 @@
+import threading
+import heapq
+import math
+import collections
+
+from .item import Dir, AttentionItems
+from . import util
+
+
+class NameIndex:
+    """In-memory index of item names for fast fuzzy searching.
+
+:arg op_manager: :class:`OperationManager <fsmanage.opexec.OperationManager>`
+    used to list directories.
+:arg n: length of the substrings ('n-grams') of names which are indexed.
+:arg case_sensitive: whether searches distinguish between upper and lower case.
+
+The index starts empty, and is built up from directory listings, either by
+crawling with :meth:`index`, or from listings you already have, through
+:meth:`add_listing`.  To keep it up to date, pass it changes through
+:meth:`attention` (which can be registered as a callback with
+:meth:`Poller.on_change <fsmanage.snapshot.Poller.on_change>`).
+
+Each name is split into overlapping substrings of length ``n``, and each
+substring maps to the set of items whose names contain it.  A search only
+looks at items sharing the least common of the query's substrings, so its cost
+depends on how many items are similar to the query rather than on the size of
+the index.
+
+"""
+
+    def __init__ (self, op_manager, n=3, case_sensitive=False):
+        #: ``op_manager`` argument.
+        self.operation_manager = op_manager
+        #: ``n`` argument.
+        self.n = n
+        #: ``case_sensitive`` argument.
+        self.case_sensitive = case_sensitive
+        # id -> Item, or None if the id is free
+        self._items = []
+        # id -> number of distinct n-grams in the item's name
+        self._sizes = []
+        self._free = []
+        # path -> id
+        self._ids = {}
+        # n-gram -> set of ids
+        self._postings = {}
+        # path of each listed directory -> set of contained names
+        self._dirs = {}
+        # paths of directories whose subdirectories should be listed too
+        self._recursive = set()
+        self._lock = threading.Lock()
+
+    def __len__ (self):
+        return len(self._ids)
+
+    def _grams (self, name, pad=True):
+        if not self.case_sensitive:
+            name = name.lower()
+        n = self.n
+        if pad or len(name) < n:
+            name = '\0' + name + '\0'
+        if len(name) < n:
+            return {name}
+        return {name[i:i + n] for i in range(len(name) - n + 1)}
+
+    def _add (self, item):
+        if item.path in self._ids or not item.path:
+            return
+        grams = self._grams(item.path[-1])
+        if self._free:
+            i = self._free.pop()
+            self._items[i] = item
+            self._sizes[i] = len(grams)
+        else:
+            i = len(self._items)
+            self._items.append(item)
+            self._sizes.append(len(grams))
+        self._ids[item.path] = i
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(i)
+
+    def _remove (self, path):
+        # also removes anything within the item
+        children = self._dirs.pop(path, ())
+        self._recursive.discard(path)
+        for name in children:
+            self._remove(path + (name,))
+        i = self._ids.pop(path, None)
+        if i is None:
+            return
+        for gram in self._grams(path[-1]):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(i)
+                if not ids:
+                    del self._postings[gram]
+        self._items[i] = None
+        self._free.append(i)
+
+    def add (self, *items):
+        """Add items to the index.
+
+:arg items: :class:`Item <fsmanage.item.Item>` instances to add.  Items already
+    in the index are ignored.
+
+"""
+        with self._lock:
+            for item in items:
+                self._add(item)
+
+    def remove (self, *items):
+        """Remove items from the index.
+
+:arg items: :class:`Item <fsmanage.item.Item>` instances to remove; anything
+    indexed within them is also removed.  Items not in the index are ignored.
+
+"""
+        with self._lock:
+            for item in items:
+                self._remove(item.path)
+
+    def add_listing (self, dir, items):
+        """Update the index with the contents of a directory.
+
+:arg dir: :class:`Dir <fsmanage.item.Dir>` which was listed.
+:arg items: sequence of all :class:`Item <fsmanage.item.Item>` instances in
+    ``dir`` (its ``items`` metadata).
+
+:returns: :class:`list` of items in ``items`` which are directories not already
+    listed in the index.
+
+Items that were previously in ``dir`` but are missing from ``items`` are
+removed from the index.
+
+"""
+        path = dir.path
+        with self._lock:
+            old_names = self._dirs.get(path, set())
+            names = set()
+            for item in items:
+                names.add(item.path[-1])
+                self._add(item)
+            for name in old_names - names:
+                self._remove(path + (name,))
+            self._dirs[path] = names
+            return [item for item in items
+                    if isinstance(item, Dir) and item.path not in self._dirs]
+
+    def index (self, *dirs, recursive=True):
+        """List directories and add their contents to the index.
+
+:arg dirs: :class:`Dir <fsmanage.item.Dir>` instances to list.
+:arg recursive: whether to also list all directories found within ``dirs``,
+    now and when they are later listed again through :meth:`attention`.
+
+:returns: :attr:`future <fsmanage.opexec.OperationExecutor.future_type>` which
+    completes (with result :obj:`None`) once everything has been indexed.
+
+"""
+        future_type = self.operation_manager.executor.future_type
+
+        def listed (dir, meta):
+            new_dirs = self.add_listing(dir, meta.get('items', ()))
+            if recursive:
+                with self._lock:
+                    self._recursive.add(dir.path)
+                return util.chain(future_type, util.gather(
+                    future_type, (list_dir(d) for d in new_dirs)
+                ), lambda results: None)
+
+        def list_dir (dir):
+            return util.chain(future_type, self.operation_manager.get_metadata(
+                dir, 'items'), lambda meta: listed(dir, meta))
+
+        return util.chain(future_type, util.gather(
+            future_type, (list_dir(d) for d in dirs)
+        ), lambda results: None)
+
+    def attention (self, attn_type, items):
+        """Update the index with changes to items.
+
+:arg attn_type: as taken by :meth:`ActionManager.attention
+    <fsmanage.actionexec.ActionManager.attention>`; only
+    :attr:`AttentionItems.CHANGED <fsmanage.item.AttentionItems.CHANGED>` is
+    handled.
+:arg items: :class:`AttentionItems <fsmanage.item.AttentionItems>` giving the
+    changed items.
+
+:returns: :attr:`future <fsmanage.opexec.OperationExecutor.future_type>` which
+    completes once the index is up to date.
+
+Only directories which have been listed by the index and which contain the
+changed items (or are their ``parent``) are listed again.
+
+"""
+        future_type = self.operation_manager.executor.future_type
+        if attn_type != AttentionItems.CHANGED:
+            return util.resolved(future_type, None)
+        paths = {item.path[:-1] for item in items.items if item.path}
+        if isinstance(items.parent, Dir):
+            paths.add(items.parent.path)
+        with self._lock:
+            paths = [p for p in paths if p in self._dirs]
+            recursive = [p in self._recursive for p in paths]
+
+        return util.chain(future_type, util.gather(future_type, (
+            self.index(Dir(p), recursive=r) for p, r in zip(paths, recursive)
+        )), lambda results: None)
+
+    def search (self, query, limit=20, threshold=.5):
+        """Find items with names similar to a string.
+
+:arg query: string to search for.
+:arg limit: maximum number of results to return.
+:arg threshold: number between ``0`` and ``1`` giving the proportion of the
+    n-grams in ``query`` that an item's name must contain to be returned.
+    ``1`` only finds names containing every n-gram in ``query`` - which
+    includes all names containing ``query`` itself.
+
+:returns: :class:`list` of :class:`Item <fsmanage.item.Item>` instances, best
+    matches first.  Names containing ``query`` come first, then matches are
+    ordered by the proportion of n-grams shared between the query and the name,
+    then by path length.
+
+A query made up only of n-grams found in a large proportion of names (such as a
+common file extension) takes time proportional to the number of matching
+names.
+
+"""
+        grams = self._grams(query, False)
+        needle = query if self.case_sensitive else query.lower()
+        with self._lock:
+            postings = sorted((self._postings.get(gram, frozenset())
+                               for gram in grams), key=len)
+            # any item sharing at least min_shared n-grams with the query must
+            # be in one of the (len(grams) - min_shared + 1) rarest posting
+            # sets, so we only need to consider those
+            min_shared = max(1, math.ceil(threshold * len(grams)))
+            split = len(grams) - min_shared + 1
+            counts = collections.Counter()
+            for ids in postings[:split]:
+                counts.update(ids)
+            for ids in postings[split:]:
+                counts.update(ids.intersection(counts))
+
+            items = self._items
+            sizes = self._sizes
+            num_grams = len(grams)
+            lower = not self.case_sensitive
+
+            def rank (i):
+                shared = counts[i]
+                path = items[i].path
+                name = path[-1].lower() if lower else path[-1]
+                return (needle in name,
+                        shared / (num_grams + sizes[i] - shared), -len(path))
+
+            return [items[i] for i in heapq.nlargest(limit, (
+                i for i, shared in counts.items() if shared >= min_shared
+            ), key=rank)]
@@ -0,0 +1,224 @@
+import operator
+import collections.abc
+
+
+class _Node:
+    # node of an AVL tree holding one item, where items are ordered by
+    # position; never changed once created, so may be shared between trees
+    __slots__ = ('left', 'item', 'right', 'size', 'height', 'total')
+
+    def __init__ (self, left, item, right):
+        self.left = left
+        self.item = item
+        self.right = right
+        self.size = _size(left) + 1 + _size(right)
+        self.height = max(_height(left), _height(right)) + 1
+        # sum of the items, computed when first needed
+        self.total = None
+
+
+def _size (node):
+    return 0 if node is None else node.size
+
+
+def _height (node):
+    return 0 if node is None else node.height
+
+
+def _sum (node):
+    if node is None:
+        return 0
+    if node.total is None:
+        node.total = _sum(node.left) + node.item + _sum(node.right)
+    return node.total
+
+
+def _build (items, start, stop):
+    # balanced tree of items[start:stop]
+    if start == stop:
+        return None
+    mid = (start + stop) // 2
+    return _Node(_build(items, start, mid), items[mid],
+                 _build(items, mid + 1, stop))
+
+
+def _rebalance (left, item, right):
+    # node from trees whose heights differ by at most 2
+    if _height(left) > _height(right) + 1:
+        if _height(left.left) >= _height(left.right):
+            return _Node(left.left, left.item,
+                         _Node(left.right, item, right))
+        inner = left.right
+        return _Node(_Node(left.left, left.item, inner.left), inner.item,
+                     _Node(inner.right, item, right))
+    elif _height(right) > _height(left) + 1:
+        if _height(right.right) >= _height(right.left):
+            return _Node(_Node(left, item, right.left), right.item,
+                         right.right)
+        inner = right.left
+        return _Node(_Node(left, item, inner.left), inner.item,
+                     _Node(inner.right, right.item, right.right))
+    else:
+        return _Node(left, item, right)
+
+
+def _join (left, item, right):
+    # tree of left's items, item, then right's items; takes time proportional
+    # to the difference in height
+    if _height(left) > _height(right) + 1:
+        return _rebalance(left.left, left.item,
+                          _join(left.right, item, right))
+    elif _height(right) > _height(left) + 1:
+        return _rebalance(_join(left, item, right.left), right.item,
+                          right.right)
+    else:
+        return _Node(left, item, right)
+
+
+def _split (node, i):
+    # trees of the first i items and the rest
+    if node is None:
+        return (None, None)
+    n = _size(node.left)
+    if i <= n:
+        left, right = _split(node.left, i)
+        return (left, _join(right, node.item, node.right))
+    else:
+        left, right = _split(node.right, i - n - 1)
+        return (_join(node.left, node.item, left), right)
+
+
+def _concat (left, right):
+    if left is None:
+        return right
+    elif right is None:
+        return left
+    first, rest = _split(right, 1)
+    return _join(left, first.item, rest)
+
+
+def _replace (node, i, item):
+    n = _size(node.left)
+    if i < n:
+        return _Node(_replace(node.left, i, item), node.item, node.right)
+    elif i > n:
+        return _Node(node.left, node.item, _replace(node.right, i - n - 1,
+                                                    item))
+    else:
+        return _Node(node.left, item, node.right)
+
+
+class PersistentSequence (collections.abc.Sequence):
+    """Immutable sequence which shares its structure with sequences derived
+from it.
+
+:arg items: iterable of items to contain.
+
+Indexing, slicing without a step, and the methods that return changed copies
+take time logarithmic in the length of the sequences involved, and don't copy
+items.  :meth:`sum` caches partial sums in the shared structure, so it takes
+logarithmic time for sequences derived from one that has already been
+summed.  Sequences compare equal to :class:`tuple` instances and other
+:class:`PersistentSequence` instances with equal items, and hash like
+:class:`tuple`.
+
+"""
+
+    def __init__ (self, items=()):
+        items = list(items)
+        self._root = _build(items, 0, len(items))
+
+    def _new (self, root):
+        seq = type(self).__new__(type(self))
+        seq._root = root
+        return seq
+
+    def __len__ (self):
+        return _size(self._root)
+
+    def __getitem__ (self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return type(self)(list(self)[index])
+            elif stop <= start:
+                return self._new(None)
+            before, rest = _split(self._root, start)
+            return self._new(_split(rest, stop - start)[0])
+
+        index = operator.index(index)
+        i = index + len(self) if index < 0 else index
+        if not 0 <= i < len(self):
+            raise IndexError('sequence index out of range:', index)
+        node = self._root
+        while True:
+            n = _size(node.left)
+            if i < n:
+                node = node.left
+            elif i > n:
+                i -= n + 1
+                node = node.right
+            else:
+                return node.item
+
+    def __iter__ (self):
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node.item
+                node = node.right
+
+    def __eq__ (self, other):
+        if isinstance(other, PersistentSequence):
+            if other._root is self._root:
+                return True
+        elif not isinstance(other, tuple):
+            return NotImplemented
+        return (len(self) == len(other) and
+                all(a is b or a == b for a, b in zip(self, other)))
+
+    def __hash__ (self):
+        return hash(tuple(self))
+
+    def __repr__ (self):
+        return '{}({!r})'.format(type(self).__name__, list(self))
+
+    def __add__ (self, other):
+        if not isinstance(other, (PersistentSequence, tuple)):
+            return NotImplemented
+        return self.extended(other)
+
+    def appended (self, item):
+        """Return a copy of this sequence with an item added to the end."""
+        return self._new(_join(self._root, item, None))
+
+    def extended (self, items):
+        """Return a copy of this sequence with items added to the end.
+
+:arg items: iterable of items to add; this takes logarithmic time if it's a
+    :class:`PersistentSequence`.
+
+"""
+        if not isinstance(items, PersistentSequence):
+            items = PersistentSequence(items)
+        return self._new(_concat(self._root, items._root))
+
+    def replaced (self, index, item):
+        """Return a copy of this sequence with the item at an index replaced.
+
+:raises IndexError: if ``index`` is out of range.
+
+"""
+        i = index + len(self) if index < 0 else index
+        if not 0 <= i < len(self):
+            raise IndexError('sequence index out of range:', index)
+        return self._new(_replace(self._root, i, item))
+
+    def sum (self):
+        """Return the sum of the items, which must be numbers."""
+        return _sum(self._root)
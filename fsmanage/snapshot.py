@@ -0,0 +1,438 @@
+import threading
+
+from .item import Dir, AttentionItems
+from . import util
+
+
+def _merge (old, new, old_keys, new_keys):
+    # compare two snapshots with sorted keys; snapshots must have types and
+    # meta attributes matching up with the keys; returns (added, removed,
+    # changed), where added and changed are lists of indices into new_keys,
+    # and removed is a list of indices into old_keys
+    added = []
+    removed = []
+    changed = []
+    old_types = old.types
+    new_types = new.types
+    old_meta = old.meta
+    new_meta = new.meta
+    i = j = 0
+    while i < len(old_keys) and j < len(new_keys):
+        a = old_keys[i]
+        b = new_keys[j]
+        if a == b:
+            if old_types[i] is not new_types[j] or old_meta[i] != new_meta[j]:
+                changed.append(j)
+            i += 1
+            j += 1
+        elif a < b:
+            removed.append(i)
+            i += 1
+        else:
+            added.append(j)
+            j += 1
+    removed.extend(range(i, len(old_keys)))
+    added.extend(range(j, len(new_keys)))
+    return (added, removed, changed)
+
+
+class DirSnapshot:
+    """Compact record of the contents of a directory at some point in time.
+
+:arg mtime: ``mtime`` metadata of the directory itself, or :obj:`None` if not
+    known.
+:arg entries: iterable of ``(item, meta)`` pairs, where ``item`` is an
+    :class:`Item <fsmanage.item.Item>` contained in the directory, and
+    ``meta`` is a value summarising its metadata which compares equal between
+    snapshots only if the item has not changed (eg. an ``(mtime, size)``
+    tuple).
+
+Entries are stored as parallel tuples sorted by name, so snapshots can be
+compared with a single merge pass (see :meth:`diff`).
+
+"""
+
+    __slots__ = ('mtime', 'names', 'types', 'meta')
+
+    def __init__ (self, mtime, entries):
+        entries = sorted(((item.path[-1], type(item), meta)
+                          for item, meta in entries), key=lambda e: e[0])
+        #: ``mtime`` argument.
+        self.mtime = mtime
+        #: Sorted tuple of the names of contained items.
+        self.names = tuple(e[0] for e in entries)
+        #: Tuple of the types of contained items, matching up with
+        #: :attr:`names`.
+        self.types = tuple(e[1] for e in entries)
+        #: Tuple of the ``meta`` values of contained items, matching up with
+        #: :attr:`names`.
+        self.meta = tuple(e[2] for e in entries)
+
+    def __len__ (self):
+        return len(self.names)
+
+    def items (self, path):
+        """Get the contained items.
+
+:arg path: path of the directory this is a snapshot of.
+
+:returns: :class:`list` of :class:`Item <fsmanage.item.Item>` instances.
+
+"""
+        path = tuple(path)
+        return [item_type(path + (name,))
+                for name, item_type in zip(self.names, self.types)]
+
+    def diff (self, other, path):
+        """Compare with a snapshot of the same directory.
+
+:arg other: :class:`DirSnapshot` to compare with; this is taken to be the more
+    recent of the two.
+:arg path: path of the directory these are snapshots of.
+
+:returns: ``(added, removed, changed)``, each a :class:`list` of :class:`Item
+    <fsmanage.item.Item>` instances.  An item is changed if its type or
+    ``meta`` value differs.  ``added`` and ``changed`` use types from
+    ``other``, and ``removed`` uses types from this snapshot.
+
+Takes time linear in the number of entries in both snapshots.
+
+"""
+        path = tuple(path)
+        added, removed, changed = _merge(self, other, self.names, other.names)
+        return ([other.types[j](path + (other.names[j],)) for j in added],
+                [self.types[i](path + (self.names[i],)) for i in removed],
+                [other.types[j](path + (other.names[j],)) for j in changed])
+
+
+class TreeSnapshot:
+    """Compact record of the contents of a directory tree at some point in
+time.
+
+:arg root: :class:`Dir <fsmanage.item.Dir>` the snapshot is of.
+:arg properties: sequence of metadata properties recorded for each item.
+:arg entries: iterable of ``(item, meta)`` pairs, where ``item`` is an
+    :class:`Item <fsmanage.item.Item>` within ``root`` (at any depth), and
+    ``meta`` is a tuple of the values of ``properties`` for the item
+    (:obj:`None` for missing values).
+
+Usually created with :func:`capture_tree`.  Entries are stored as parallel
+tuples sorted by path relative to ``root``, so snapshots can be compared with a
+single merge pass (see :meth:`diff`).  Snapshots are equal if they record the
+same items with the same types and metadata.
+
+"""
+
+    __slots__ = ('root', 'properties', 'paths', 'types', 'meta')
+
+    def __init__ (self, root, properties, entries):
+        n = len(root.path)
+        entries = sorted(((item.path[n:], type(item), tuple(meta))
+                          for item, meta in entries), key=lambda e: e[0])
+        #: ``root`` argument.
+        self.root = root
+        #: ``properties`` argument, as a :class:`tuple`.
+        self.properties = tuple(properties)
+        #: Sorted tuple of the paths of contained items, relative to
+        #: :attr:`root`.
+        self.paths = tuple(e[0] for e in entries)
+        #: Tuple of the types of contained items, matching up with
+        #: :attr:`paths`.
+        self.types = tuple(e[1] for e in entries)
+        #: Tuple of the ``meta`` values of contained items, matching up with
+        #: :attr:`paths`.
+        self.meta = tuple(e[2] for e in entries)
+
+    def __len__ (self):
+        return len(self.paths)
+
+    def __eq__ (self, other):
+        return (isinstance(other, TreeSnapshot) and
+                self.root.path == other.root.path and
+                self.properties == other.properties and
+                self.paths == other.paths and self.types == other.types and
+                self.meta == other.meta)
+
+    def items (self):
+        """Get the contained items.
+
+:returns: :class:`list` of :class:`Item <fsmanage.item.Item>` instances, in
+    :attr:`paths` order.
+
+"""
+        path = self.root.path
+        return [item_type(path + p)
+                for p, item_type in zip(self.paths, self.types)]
+
+    def diff (self, other):
+        """Compare with a snapshot of the same tree.
+
+:arg other: :class:`TreeSnapshot` to compare with; this is taken to be the more
+    recent of the two.
+
+:returns: ``(added, removed, changed)``, each an :class:`AttentionItems
+    <fsmanage.item.AttentionItems>` instance with :attr:`root` as its
+    ``parent``.  An item is changed if its type or any of its metadata
+    differs.  ``added`` and ``changed`` use types from ``other``, and
+    ``removed`` uses types from this snapshot.
+
+:raises ValueError: if the snapshots have different :attr:`root` or
+    :attr:`properties` values.
+
+Takes time linear in the number of entries in both snapshots.
+
+"""
+        if (other.root.path != self.root.path or
+                other.properties != self.properties):
+            raise ValueError('snapshots are not comparable')
+        root = self.root.path
+        added, removed, changed = _merge(self, other, self.paths, other.paths)
+        return (
+            AttentionItems((other.types[j](root + other.paths[j])
+                            for j in added), self.root),
+            AttentionItems((self.types[i](root + self.paths[i])
+                            for i in removed), self.root),
+            AttentionItems((other.types[j](root + other.paths[j])
+                            for j in changed), self.root),
+        )
+
+
+def capture_tree (op_manager, root, properties=('mtime', 'size')):
+    """Take a snapshot of a directory tree.
+
+:arg op_manager: :class:`OperationManager <fsmanage.opexec.OperationManager>`
+    used to query items.
+:arg root: :class:`Dir <fsmanage.item.Dir>` to take a snapshot of.
+:arg properties: as taken by :class:`TreeSnapshot`.
+
+:returns: :attr:`future <fsmanage.opexec.OperationExecutor.future_type>` whose
+    result is a :class:`TreeSnapshot`.  Directories which cannot be listed are
+    recorded as empty.
+
+"""
+    future_type = op_manager.executor.future_type
+    properties = tuple(properties)
+    entries = []
+    lock = threading.Lock()
+
+    def queried (item, meta):
+        with lock:
+            entries.append(
+                (item, tuple(meta.get(prop) for prop in properties)))
+        if isinstance(item, Dir):
+            return list_dir(item)
+
+    def list_dir (dir):
+        return util.chain(future_type, op_manager.get_metadata(
+            dir, 'items'
+        ), lambda meta: util.gather(future_type, (
+            util.chain(future_type, op_manager.get_metadata(item, *properties),
+                       lambda meta, item=item: queried(item, meta))
+            for item in meta.get('items', ())
+        )))
+
+    return util.chain(future_type, list_dir(root),
+                      lambda results: TreeSnapshot(root, properties, entries))
+
+
+class Poller:
+    """Detect changes to directories by comparing snapshots taken
+periodically.
+
+:arg op_manager: :class:`OperationManager <fsmanage.opexec.OperationManager>`
+    used to query items.
+:arg dirs: sequence of :class:`Dir <fsmanage.item.Dir>` instances to watch.
+:arg recursive: whether to also watch all directories found within watched
+    directories.
+:arg properties: sequence of metadata properties to compare for contained
+    items; an item is changed if any of these differ between polls.
+
+This is for use with :class:`OperationExecutor
+<fsmanage.opexec.OperationExecutor>` implementations which have no way to
+report changes themselves.  Call :meth:`poll` whenever you want to check for
+changes.
+
+Each watched directory is first queried for its ``mtime``, and only listed
+(with one metadata query per contained item) if this differs from the last
+poll.  This means the cost of a poll is one query per watched directory, plus
+work proportional to the size of directories that actually changed.  This
+relies on the executor changing a directory's ``mtime`` whenever its ``items``
+change; if ``mtime`` is not supported, every directory is listed on every poll.
+Changes to items that don't affect their directory's ``mtime`` (such as writing
+to a file in place, on most real filesystems) are only found the next time the
+directory is listed, which can be forced using the ``full`` argument to
+:meth:`poll`.
+
+"""
+
+    def __init__ (self, op_manager, dirs=(), recursive=False,
+                  properties=('mtime', 'size')):
+        #: ``op_manager`` argument.
+        self.operation_manager = op_manager
+        #: ``recursive`` argument.
+        self.recursive = recursive
+        #: ``properties`` argument.
+        self.properties = tuple(properties)
+        # path -> DirSnapshot, or None before the first poll
+        self._snapshots = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.watch(*dirs)
+
+    @property
+    def watched (self):
+        """:class:`frozenset` of paths of watched directories."""
+        with self._lock:
+            return frozenset(self._snapshots)
+
+    def watch (self, *dirs):
+        """Start watching directories.
+
+:arg dirs: :class:`Dir <fsmanage.item.Dir>` instances to watch.
+
+The first poll of a directory records its contents without reporting any
+changes.  Watching a directory that is already watched has no effect.
+
+"""
+        with self._lock:
+            for d in dirs:
+                self._snapshots.setdefault(d.path, None)
+
+    def unwatch (self, *dirs):
+        """Stop watching directories.
+
+:arg dirs: :class:`Dir <fsmanage.item.Dir>` instances to stop watching.  If
+    :attr:`recursive`, directories within these are also no longer watched.
+
+"""
+        with self._lock:
+            self._unwatch(d.path for d in dirs)
+
+    def _unwatch (self, paths):
+        paths = set(paths)
+        if self.recursive:
+            paths.update([p for p in self._snapshots
+                          if any(p[:len(q)] == q for q in paths)])
+        for p in paths:
+            self._snapshots.pop(p, None)
+
+    def on_change (self, *fns):
+        """Register functions for calling when changes are found.
+
+:arg fns: any number of functions to register as callbacks.  Whenever changes
+    are found in a directory, each of these is called like
+    ``fn(attn_type, items)``, where:
+
+        - ``attn_type`` is :attr:`AttentionItems.CHANGED
+          <fsmanage.item.AttentionItems.CHANGED>`.
+        - ``items`` is an :class:`AttentionItems
+          <fsmanage.item.AttentionItems>` containing the items in the
+          directory that were added or changed, with the directory as its
+          ``parent``.  If items were only removed, this contains no items.
+
+This matches the signature of :meth:`ActionManager.attention
+<fsmanage.actionexec.ActionManager.attention>`.  Callbacks may be called from
+whatever thread the :attr:`operation_manager`'s futures complete in.
+
+"""
+        self._callbacks.extend(fns)
+
+    def poll (self, full=False):
+        """Check all watched directories for changes.
+
+:arg full: if :obj:`True`, list every directory, even if its ``mtime`` hasn't
+    changed.
+
+:returns: :attr:`future <fsmanage.opexec.OperationExecutor.future_type>` whose
+    result is an :class:`AttentionItems <fsmanage.item.AttentionItems>`
+    combining all changes found (as passed to callbacks registered through
+    :meth:`on_change`).
+
+"""
+        future_type = self.operation_manager.executor.future_type
+        with self._lock:
+            snapshots = list(self._snapshots.items())
+        return util.chain(future_type, util.gather(future_type, (
+            self._poll_dir(path, snapshot, full)
+            for path, snapshot in snapshots
+        )), self._combine)
+
+    def _combine (self, results):
+        attn = AttentionItems()
+        for result in results:
+            for dir_attn in result:
+                attn = attn.extended(dir_attn)
+        return attn
+
+    def _poll_dir (self, path, old, full):
+        # result is a list of AttentionItems
+        if old is None or old.mtime is None or full:
+            return self._rescan(path, old)
+
+        def check (meta):
+            if meta.get('mtime') == old.mtime:
+                return []
+            else:
+                return self._rescan(path, old)
+
+        return util.chain(
+            self.operation_manager.executor.future_type,
+            self.operation_manager.get_metadata(Dir(path), 'mtime'), check)
+
+    def _rescan (self, path, old):
+        op_manager = self.operation_manager
+        future_type = op_manager.executor.future_type
+
+        def listed (meta):
+            items = tuple(meta.get('items', ()))
+            return util.chain(future_type, util.gather(future_type, (
+                op_manager.get_metadata(item, *self.properties)
+                for item in items
+            )), lambda metas: self._update(path, old, meta.get('mtime'),
+                                           items, metas))
+
+        return util.chain(future_type, op_manager.get_metadata(
+            Dir(path), 'items', 'mtime'
+        ), listed)
+
+    def _update (self, path, old, mtime, items, metas):
+        new = DirSnapshot(mtime, (
+            (item, tuple(meta.get(p) for p in self.properties))
+            for item, meta in zip(items, metas)
+        ))
+        with self._lock:
+            if path not in self._snapshots:
+                # unwatched while we were busy
+                return []
+            self._snapshots[path] = new
+            if old is None:
+                added = new.items(path)
+                removed = changed = []
+            else:
+                added, removed, changed = old.diff(new, path)
+            new_dirs = []
+            if self.recursive:
+                self._unwatch(item.path for item in removed
+                              if isinstance(item, Dir))
+                for item in added:
+                    if (isinstance(item, Dir) and
+                            item.path not in self._snapshots):
+                        self._snapshots[item.path] = None
+                        new_dirs.append(item.path)
+
+        results = []
+        if old is not None and (added or removed or changed):
+            attn = AttentionItems(added + changed, Dir(path))
+            for fn in self._callbacks:
+                fn(AttentionItems.CHANGED, attn)
+            results.append(attn)
+        if not new_dirs:
+            return results
+
+        # record the contents of new directories straight away, so that we
+        # don't miss changes made before the next poll
+        future_type = self.operation_manager.executor.future_type
+        return util.chain(future_type, util.gather(future_type, (
+            self._rescan(p, None) for p in new_dirs
+        )), lambda new_results: results + [
+            attn for r in new_results for attn in r])
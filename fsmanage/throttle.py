@@ -0,0 +1,189 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Rate limiter which allows short bursts.
+
+:arg rate: number of tokens added per second, or :obj:`None` for no limit.
+:arg burst: maximum number of tokens stored up while nothing is consumed; if
+    :obj:`None`, this is ``rate`` (one second's worth).
+:arg current_time: a function that takes no arguments and returns the current
+    time in seconds.
+
+The bucket starts full.  Consuming tokens may take the number stored below
+zero, and callers should then wait for :meth:`delay` before consuming more.
+
+"""
+
+    def __init__ (self, rate=None, burst=None, current_time=time.monotonic):
+        #: ``current_time`` argument.
+        self.current_time = current_time
+        self._rate = rate
+        self._burst = burst
+        self._tokens = self.burst
+        self._last = current_time()
+        self._lock = threading.Lock()
+
+    def _refill (self):
+        # call with lock held
+        now = self.current_time()
+        if self._rate is not None:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    @property
+    def rate (self):
+        """``rate`` argument; may be changed at any time."""
+        return self._rate
+
+    @rate.setter
+    def rate (self, rate):
+        with self._lock:
+            self._refill()
+            unlimited = self._rate is None
+            self._rate = rate
+            if rate is None:
+                self._tokens = 0
+            elif unlimited:
+                # start full, as for a new bucket
+                self._tokens = self.burst
+            else:
+                self._tokens = min(self.burst, self._tokens)
+
+    @property
+    def burst (self):
+        """Maximum number of tokens stored (see ``burst`` argument); may be
+changed at any time."""
+        if self._burst is not None:
+            return self._burst
+        return 0 if self._rate is None else self._rate
+
+    @burst.setter
+    def burst (self, burst):
+        with self._lock:
+            self._refill()
+            self._burst = burst
+            self._tokens = min(self.burst, self._tokens)
+
+    def consume (self, n):
+        """Take tokens from the bucket.
+
+:arg n: number of tokens to take.
+
+Does nothing if there is no limit.
+
+"""
+        with self._lock:
+            if self._rate is not None:
+                self._refill()
+                self._tokens -= n
+
+    def delay (self):
+        """Get the time until the bucket stops being empty.
+
+:returns: time in seconds, or ``0`` if there are tokens to spare.
+
+"""
+        with self._lock:
+            if self._rate is None:
+                return 0
+            self._refill()
+            if self._tokens >= 0:
+                return 0
+            elif self._rate <= 0:
+                return float('inf')
+            else:
+                return -self._tokens / self._rate
+
+
+class Throttle:
+    """Limit the rate at which operations process data and items.
+
+:arg bytes_per_second: maximum data rate, or :obj:`None` for no limit.
+:arg items_per_second: maximum number of items (files, directories, etc.)
+    processed per second, or :obj:`None` for no limit.
+:arg burst_time: amount of unused allowance which may be stored up, as a number
+    of seconds' worth.
+:arg current_time: a function that takes no arguments and returns the current
+    time in seconds.
+
+Operations are charged for what they report as done through
+:meth:`OperationExecutor.report_progress
+<fsmanage.opexec.OperationExecutor.report_progress>`, and held back at
+:meth:`OperationExecutor.checkpoint
+<fsmanage.opexec.OperationExecutor.checkpoint>` until they're within the
+limits.  Pass an instance to :class:`OperationManager
+<fsmanage.opexec.OperationManager>` to limit everything it runs, or to
+:class:`OperationControl <fsmanage.opexec.OperationControl>` to limit a group
+of operations; one instance may be shared between several of these to limit
+them all together.
+
+Limits may be changed at any time, taking effect for operations that are
+already running.
+
+"""
+
+    def __init__ (self, bytes_per_second=None, items_per_second=None,
+                  burst_time=1, current_time=time.monotonic):
+        self._burst_time = burst_time
+        self._bytes = TokenBucket(current_time=current_time)
+        self._items = TokenBucket(current_time=current_time)
+        self.bytes_per_second = bytes_per_second
+        self.items_per_second = items_per_second
+
+    def _set_rate (self, bucket, rate):
+        bucket.burst = None if rate is None else rate * self._burst_time
+        bucket.rate = rate
+
+    @property
+    def bytes_per_second (self):
+        """``bytes_per_second`` argument; may be changed at any time."""
+        return self._bytes.rate
+
+    @bytes_per_second.setter
+    def bytes_per_second (self, rate):
+        self._set_rate(self._bytes, rate)
+
+    @property
+    def items_per_second (self):
+        """``items_per_second`` argument; may be changed at any time."""
+        return self._items.rate
+
+    @items_per_second.setter
+    def items_per_second (self, rate):
+        self._set_rate(self._items, rate)
+
+    @property
+    def burst_time (self):
+        """``burst_time`` argument; may be changed at any time."""
+        return self._burst_time
+
+    @burst_time.setter
+    def burst_time (self, burst_time):
+        self._burst_time = burst_time
+        self.bytes_per_second = self.bytes_per_second
+        self.items_per_second = self.items_per_second
+
+    def report (self, op, bytes_done=0, bytes_total=0, items_done=0,
+                items_total=0):
+        """Charge for progress made by an operation.
+
+Has the same signature as functions registered with
+:meth:`OperationExecutor.on_progress
+<fsmanage.opexec.OperationExecutor.on_progress>`.
+
+"""
+        if bytes_done:
+            self._bytes.consume(bytes_done)
+        if items_done:
+            self._items.consume(items_done)
+
+    def delay (self):
+        """Get the time operations should wait before continuing.
+
+:returns: time in seconds, or ``0`` if they may continue now.
+
+"""
+        return max(self._bytes.delay(), self._items.delay())
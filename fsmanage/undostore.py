@@ -0,0 +1,276 @@
+import os
+import io
+import zlib
+import uuid
+import hashlib
+import threading
+import collections
+
+# chunk file flags: stored as-is, or compressed with zlib
+_RAW = b'\0'
+_ZLIB = b'\1'
+
+
+class UndoStore:
+    """Content-addressed store for data needed to undo operations, such as the
+contents of deleted files.
+
+:arg path: directory to store data in; it's created if it doesn't exist.
+:arg chunk_size: data is split into chunks of this many bytes, and each
+    distinct chunk is only stored once.
+:arg compress: whether to compress chunks (with zlib), where it saves space.
+:arg max_bytes: maximum number of bytes to use on disk, or :obj:`None` for no
+    limit (see :meth:`on_evict`).
+
+Data is stored for an owner: a hashable object, usually the :class:`Operation
+<fsmanage.operation.Operation>` the data is needed to undo.  Storing returns a
+key made of the SHA-256 hashes of the chunks, which is used to read the data
+back, and which may be kept elsewhere (for example, in a
+:class:`HistoryJournal <fsmanage.journal.HistoryJournal>`) and passed to
+:meth:`acquire` by a later instance to use the data again.
+
+When storing data takes the store over ``max_bytes``, the data of the owners
+which stored data least recently is released until it's back within the
+limit.  This includes the data just stored if it doesn't fit at all.
+
+"""
+
+    def __init__ (self, path, chunk_size=1024 * 1024, compress=False,
+                  max_bytes=None):
+        #: ``path`` argument.
+        self.path = path
+        #: ``chunk_size`` argument.
+        self.chunk_size = chunk_size
+        #: ``compress`` argument.
+        self.compress = compress
+        #: ``max_bytes`` argument; takes effect the next time data is stored.
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        # digest -> [number of references, size on disk]
+        self._chunks = {}
+        # owner -> list of digests it references, including repeats; ordered
+        # by when owners last stored data
+        self._owners = collections.OrderedDict()
+        # chunks found on disk which nothing has referenced yet
+        self._unclaimed = {}
+        self._size = 0
+        self._callbacks = []
+        self._lock = threading.RLock()
+        for name in os.listdir(path):
+            if name.endswith('.tmp'):
+                # left by a crash while storing
+                os.unlink(os.path.join(path, name))
+            elif len(name) == 64:
+                size = os.path.getsize(os.path.join(path, name))
+                self._unclaimed[name] = size
+                self._size += size
+
+    @property
+    def size (self):
+        """Number of bytes used on disk by stored chunks."""
+        with self._lock:
+            return self._size
+
+    def on_evict (self, *fns):
+        """Register functions for calling when data is released to stay
+within ``max_bytes``.
+
+:arg fns: any number of functions to register as callbacks.  Each is called
+    with the owner whose data was released, which can no longer be read.
+
+"""
+        self._callbacks.extend(fns)
+
+    def _chunk_path (self, digest):
+        return os.path.join(self.path, digest)
+
+    def _put_chunk (self, chunk):
+        # returns the chunk's digest
+        digest = hashlib.sha256(chunk).hexdigest()
+        with self._lock:
+            if digest in self._chunks or digest in self._unclaimed:
+                self._ref_chunk(digest)
+                return digest
+        # write outside the lock; if another thread stores the same chunk at
+        # the same time, both write the same data
+        data = _RAW + chunk
+        if self.compress:
+            compressed = zlib.compress(chunk)
+            if len(compressed) < len(chunk):
+                data = _ZLIB + compressed
+        path = self._chunk_path(digest)
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if digest in self._chunks or digest in self._unclaimed:
+                self._ref_chunk(digest)
+            else:
+                self._chunks[digest] = [1, len(data)]
+                self._size += len(data)
+        return digest
+
+    def _ref_chunk (self, digest):
+        # call with lock held
+        entry = self._chunks.get(digest)
+        if entry is None:
+            self._chunks[digest] = [1, self._unclaimed.pop(digest)]
+        else:
+            entry[0] += 1
+
+    def _release_chunks (self, digests):
+        # call with lock held
+        for digest in digests:
+            entry = self._chunks[digest]
+            entry[0] -= 1
+            if entry[0] == 0:
+                del self._chunks[digest]
+                self._size -= entry[1]
+                try:
+                    os.unlink(self._chunk_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def write (self, owner, f):
+        """Store data read from a file.
+
+:arg owner: hashable object to store the data for.
+:arg f: binary file object to read until the end.
+
+:returns: key for the data, as a :class:`bytes` object.
+
+:raises OSError: if reading or writing fails; nothing is stored.
+
+"""
+        digests = []
+        try:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                digests.append(self._put_chunk(chunk))
+        except BaseException:
+            with self._lock:
+                self._release_chunks(digests)
+            raise
+        with self._lock:
+            self._owners.setdefault(owner, []).extend(digests)
+            self._owners.move_to_end(owner)
+            evicted = self._evict()
+        for evicted_owner in evicted:
+            for fn in self._callbacks:
+                fn(evicted_owner)
+        return b''.join(bytes.fromhex(digest) for digest in digests)
+
+    def put (self, owner, data):
+        """Store data.
+
+:arg owner: hashable object to store the data for.
+:arg data: :class:`bytes` to store.
+
+:returns: as for :meth:`write`.
+
+"""
+        return self.write(owner, io.BytesIO(data))
+
+    def _evict (self):
+        # call with lock held; returns evicted owners
+        evicted = []
+        while (self.max_bytes is not None and self._size > self.max_bytes and
+               self._owners):
+            owner, digests = self._owners.popitem(False)
+            self._release_chunks(digests)
+            evicted.append(owner)
+        if (self.max_bytes is not None and self._size > self.max_bytes and
+                self._unclaimed):
+            self.collect()
+        return evicted
+
+    def _digests (self, key):
+        if len(key) % 32:
+            raise ValueError('invalid key:', key)
+        return [key[i:i + 32].hex() for i in range(0, len(key), 32)]
+
+    def acquire (self, owner, key):
+        """Reference data stored previously, possibly by another instance.
+
+:arg owner: hashable object to reference the data for.
+:arg key: key returned when the data was stored.
+
+:returns: whether all of the data is available; if not, nothing is referenced.
+
+"""
+        digests = self._digests(key)
+        with self._lock:
+            if not all(digest in self._chunks or digest in self._unclaimed
+                       for digest in digests):
+                return False
+            for digest in digests:
+                self._ref_chunk(digest)
+            self._owners.setdefault(owner, []).extend(digests)
+        return True
+
+    def read (self, key):
+        """Read stored data.
+
+:arg key: key returned when the data was stored.
+
+:returns: iterator over the data, as :class:`bytes` chunks.
+
+:raises KeyError: if the data is no longer stored.
+
+"""
+        for digest in self._digests(key):
+            try:
+                with open(self._chunk_path(digest), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                raise KeyError(key)
+            if data[:1] == _ZLIB:
+                yield zlib.decompress(data[1:])
+            else:
+                yield data[1:]
+
+    def get (self, key):
+        """Read stored data into a single :class:`bytes` object.
+
+:raises KeyError: if the data is no longer stored.
+
+"""
+        return b''.join(self.read(key))
+
+    def has (self, owner):
+        """Return whether data is stored for an owner."""
+        with self._lock:
+            return owner in self._owners
+
+    def size_of (self, owner):
+        """Get the number of bytes used on disk by data stored for an owner,
+counting chunks shared with other data in full."""
+        with self._lock:
+            return sum(self._chunks[digest][1]
+                       for digest in self._owners.get(owner, ()))
+
+    def release (self, owner):
+        """Stop storing data for an owner, once nothing else references it.
+
+Does nothing if no data is stored for ``owner``.
+
+"""
+        with self._lock:
+            digests = self._owners.pop(owner, None)
+            if digests is not None:
+                self._release_chunks(digests)
+
+    def collect (self):
+        """Remove chunks left by previous instances which haven't been
+referenced through :meth:`acquire`."""
+        with self._lock:
+            for digest, size in self._unclaimed.items():
+                try:
+                    os.unlink(self._chunk_path(digest))
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+            self._unclaimed = {}
@@ -0,0 +1,146 @@
+import threading
+
+
+def is_future (obj):
+    """Return whether an object looks like a future.
+
+Anything with an ``add_done_callback`` method is considered a future.
+
+"""
+    return hasattr(obj, 'add_done_callback')
+
+
+def resolved (future_type, result):
+    """Create a future which has already succeeded.
+
+:arg future_type: type of future to create (see
+    :attr:`OperationExecutor.future_type
+    <fsmanage.opexec.OperationExecutor.future_type>`).
+:arg result: result to give the future.
+
+"""
+    future = future_type()
+    future.set_result(result)
+    return future
+
+
+def failed (future_type, exc):
+    """Create a future which has already failed.
+
+:arg future_type: type of future to create.
+:arg exc: exception to give the future.
+
+"""
+    future = future_type()
+    future.set_exception(exc)
+    return future
+
+
+def call_later (delay, fn):
+    """Call a function after a delay, in a background thread.
+
+:arg delay: time to wait, in seconds.
+:arg fn: function to call with no arguments.
+
+This uses a daemon :class:`threading.Timer`.
+
+"""
+    timer = threading.Timer(delay, fn)
+    timer.daemon = True
+    timer.start()
+
+
+def relay (src, dest):
+    """Copy the outcome of one future to another once it completes.
+
+:arg src: future to wait for.
+:arg dest: future to set the result or exception of.
+
+"""
+    def done (src):
+        exc = src.exception()
+        if exc is None:
+            dest.set_result(src.result())
+        else:
+            dest.set_exception(exc)
+
+    src.add_done_callback(done)
+
+
+def chain (future_type, future, fn):
+    """Call a function with the result of a future.
+
+chain(future_type, future, fn) -> new_future
+
+:arg future_type: type of ``new_future``.
+:arg future: future to wait for.
+:arg fn: function to call with the result of ``future``.  It may return a
+    value, or another future to wait for.
+
+:returns: future whose result is the return value of ``fn`` (or the result of
+    the future it returns).  If ``future`` fails or ``fn`` raises an exception,
+    ``new_future`` fails with the same exception.
+
+"""
+    new_future = future_type()
+
+    def done (future):
+        exc = future.exception()
+        if exc is not None:
+            new_future.set_exception(exc)
+            return
+        try:
+            result = fn(future.result())
+        except Exception as e:
+            new_future.set_exception(e)
+            return
+        if is_future(result):
+            relay(result, new_future)
+        else:
+            new_future.set_result(result)
+
+    future.add_done_callback(done)
+    return new_future
+
+
+def gather (future_type, futures):
+    """Wait for a number of futures to complete.
+
+gather(future_type, futures) -> new_future
+
+:arg future_type: type of ``new_future``.
+:arg futures: sequence of futures to wait for.
+
+:returns: future whose result is a :class:`list` of the results of
+    ``futures``, in the same order.  If any of ``futures`` fails,
+    ``new_future`` fails with the first exception encountered (but still only
+    completes once all of ``futures`` have completed).
+
+"""
+    futures = list(futures)
+    new_future = future_type()
+    results = [None] * len(futures)
+    state = {'remaining': len(futures), 'exc': None}
+    lock = threading.Lock()
+    if not futures:
+        new_future.set_result(results)
+        return new_future
+
+    def done (i, future):
+        exc = future.exception()
+        with lock:
+            if exc is None:
+                results[i] = future.result()
+            elif state['exc'] is None:
+                state['exc'] = exc
+            state['remaining'] -= 1
+            finished = state['remaining'] == 0
+        if finished:
+            if state['exc'] is None:
+                new_future.set_result(results)
+            else:
+                new_future.set_exception(state['exc'])
+
+    for i, future in enumerate(futures):
+        future.add_done_callback(lambda future, i=i: done(i, future))
+    return new_future
@@ -1,6 +1,21 @@
 import unittest
 
 from test.item import *
+from test.history import *
+from test.sequence import *
+from test.opexec import *
+from test.schedule import *
+from test.progress import *
+from test.retry import *
+from test.device import *
+from test.throttle import *
+from test.journal import *
+from test.undostore import *
+from test.actionexec import *
+from test.snapshot import *
+from test.search import *
+from test.dupes import *
+from test.filesystem import *
 
 if __name__ == '__main__':
     unittest.main()
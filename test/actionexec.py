@@ -0,0 +1,175 @@
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+from fsmanage import util
+
+from .opexec import RecordExecutor
+
+
+class NavigationHistoryTest (TestCase):
+    def test_navigate (self):
+        history = fs.NavigationHistory((), Future)
+        self.assertIsNone(history.cwd)
+        history.navigate(('a',))
+        history.navigate(('a', 'b'))
+        self.assertEqual(history.cwd, ('a', 'b'))
+        history.undo()
+        self.assertEqual(history.cwd, ('a',))
+        history.undo()
+        self.assertIsNone(history.cwd)
+        history.redo()
+        self.assertEqual(history.cwd, ('a',))
+
+    def test_coalesce (self):
+        history = fs.NavigationHistory((), Future, coalesce_window=1)
+        for path in (('a',), ('a', 'b'), ('c',)):
+            history.navigate(path)
+        self.assertEqual(len(history.events), 1)
+        event = history.events[0]
+        self.assertEqual((event.path_before, event.path_after), (None, ('c',)))
+        history.undo()
+        self.assertIsNone(history.cwd)
+
+    def test_coalesce_back (self):
+        history = fs.NavigationHistory((), Future, coalesce_window=1)
+        history.navigate(('a',))
+        history.navigate(('a', 'b'))
+        history.navigate(None)
+        # no step left to undo
+        self.assertEqual(history.events, ())
+        self.assertEqual(history.position, 0)
+        self.assertIsNone(history.cwd)
+
+
+class FlagTarget (fs.ActionTarget):
+    """Target whose context is a boolean, matching if it's true."""
+
+    def context_matches (self, context, op_manager):
+        return util.resolved(Future, bool(context))
+
+
+class SubFlagTarget (FlagTarget):
+    pass
+
+
+class OtherTarget (FlagTarget):
+    pass
+
+
+def make_action (action_name, *targets, ops=()):
+    """Create an action type which records executions in ``executed``."""
+    class RecordAction (fs.Action):
+        name = action_name
+        operations = ops
+        target = targets
+        executed = []
+
+        def execute (self, op_manager, *target_contexts):
+            self.executed.append(target_contexts)
+
+    return RecordAction
+
+
+class ActionManagerTest (TestCase):
+    def setUp (self):
+        self.manager = fs.ActionManager(fs.SynchronousOperationManager(
+            RecordExecutor(), fs.OperationHistory(Future)))
+        self.context = {FlagTarget: True, SubFlagTarget: True,
+                        OtherTarget: False}
+        self.checked = []
+        for target in (FlagTarget, OtherTarget):
+            self.manager.support_target(target, self.get_context(target))
+        self.calls = []
+
+    def get_context (self, target):
+        def get ():
+            self.checked.append(target)
+            return self.context[target]
+
+        return get
+
+    def update (self, action, matches):
+        self.calls.append((action.name, matches))
+
+    def test_context_changed (self):
+        a = make_action('a', FlagTarget())
+        b = make_action('b', OtherTarget())
+        c = make_action('c', SubFlagTarget(), OtherTarget())
+        self.manager.add_actions(a, b, c)
+        self.manager.on_context_update(self.update, a, b, c)
+        self.manager.context_changed(FlagTarget)
+        # only actions using the target are checked again
+        self.assertCountEqual(self.calls, [('a', True), ('c', False)])
+        self.calls = []
+        self.manager.context_changed(OtherTarget)
+        self.assertCountEqual(self.calls, [('b', False), ('c', False)])
+
+    def test_shared_contexts (self):
+        actions = [make_action(str(i), FlagTarget(), OtherTarget())
+                   for i in range(5)]
+        self.manager.add_actions(*actions)
+        self.manager.on_context_update(self.update, *actions)
+        self.manager.context_changed(FlagTarget)
+        self.assertEqual(len(self.calls), 5)
+        # each context is only retrieved once for all the actions
+        self.assertCountEqual(self.checked, [FlagTarget, OtherTarget])
+
+    def test_no_callbacks (self):
+        self.manager.add_actions(make_action('a', FlagTarget()))
+        self.manager.context_changed(FlagTarget)
+        self.assertEqual(self.checked, [])
+
+    def test_register_twice (self):
+        a = make_action('a', FlagTarget())
+        self.manager.add_actions(a)
+        self.manager.on_context_update(self.update, a)
+        self.manager.on_context_update(self.update, a)
+        self.manager.context_changed(FlagTarget)
+        self.assertEqual(self.calls, [('a', True)])
+
+    def test_support_subclass (self):
+        a = make_action('a', SubFlagTarget())
+        self.manager.add_actions(a)
+        self.manager.on_context_update(self.update, a)
+        self.manager.support_target(SubFlagTarget,
+                                    self.get_context(SubFlagTarget))
+        self.manager.context_changed(FlagTarget)
+        self.assertEqual(self.calls, [])
+        self.manager.context_changed(SubFlagTarget)
+        self.assertEqual(self.calls, [('a', True)])
+        self.assertEqual(self.checked, [SubFlagTarget])
+
+    def test_rm_actions (self):
+        a = make_action('a', FlagTarget())
+        self.manager.add_actions(a)
+        self.manager.on_context_update(self.update, a)
+        self.manager.rm_actions(a)
+        self.manager.context_changed(FlagTarget)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.manager.supported_actions, set())
+        self.assertRaises(TypeError, self.manager.on_context_update,
+                          self.update, a)
+
+    def test_unsupported (self):
+        self.assertRaises(TypeError, self.manager.context_changed,
+                          SubFlagTarget)
+        a = make_action('a', FlagTarget())
+        b = make_action('b', fs.StateActionTarget(('x',)))
+        c = make_action('c', ops=(fs.Copy,))
+        self.assertRaises(TypeError, self.manager.add_actions, a, b)
+        self.assertRaises(TypeError, self.manager.add_actions, c)
+        # nothing is added when any action can't be
+        self.assertEqual(self.manager.supported_actions, set())
+        self.manager.add_actions(make_action('d', ops=(fs.Delete,)))
+
+    def test_execute (self):
+        a = make_action('a', FlagTarget())
+        b = make_action('b', OtherTarget())
+        self.manager.add_actions(a, b)
+        self.manager.execute(a)
+        self.manager.execute(b)
+        self.assertEqual(a.executed, [(True,)])
+        self.assertEqual(b.executed, [])
+        self.assertRaises(ValueError, self.manager.execute,
+                          make_action('c'))
@@ -0,0 +1,117 @@
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+from fsmanage import util
+
+
+class DeviceSchedulerTest (TestCase):
+    def setUp (self):
+        self.scheduler = fs.DeviceScheduler()
+        self.pending = {}
+        self.started = []
+
+    def submit (self, name, devices, owner=None):
+        def start ():
+            self.started.append(name)
+            self.pending[name] = Future()
+            return self.pending[name]
+
+        return self.scheduler.submit(Future, devices, owner, start)
+
+    def test_limit (self):
+        results = [self.submit(name, {'a': 2}) for name in 'xyz']
+        self.assertEqual(self.started, ['x', 'y'])
+        self.assertEqual(self.scheduler.running, {'a': 2})
+        self.assertEqual(self.scheduler.waiting, 1)
+        self.pending['y'].set_result('y')
+        self.assertEqual(self.started, ['x', 'y', 'z'])
+        self.assertEqual(results[1].result(), 'y')
+
+    def test_unlimited (self):
+        for name in 'xyz':
+            self.submit(name, {'a': None})
+        self.assertEqual(self.started, ['x', 'y', 'z'])
+        self.assertEqual(self.scheduler.running, {})
+
+    def test_fair (self):
+        for name in ('x1', 'x2', 'x3'):
+            self.submit(name, {'a': 1}, 'x')
+        self.submit('y1', {'a': 1}, 'y')
+        self.pending['x1'].set_result(None)
+        self.assertEqual(self.started, ['x1', 'y1'])
+        self.pending['y1'].set_result(None)
+        self.assertEqual(self.started, ['x1', 'y1', 'x2'])
+
+    def test_other_devices (self):
+        self.submit('x', {'a': 1})
+        self.submit('y', {'a': 1})
+        self.submit('z', {'b': 1})
+        self.assertEqual(self.started, ['x', 'z'])
+
+    def test_all_devices (self):
+        self.submit('x', {'a': 1})
+        self.submit('y', {'a': 1, 'b': 1})
+        self.submit('z', {'b': 1})
+        self.assertEqual(self.started, ['x', 'z'])
+        self.pending['x'].set_result(None)
+        self.assertEqual(self.started, ['x', 'z'])
+        self.pending['z'].set_result(None)
+        self.assertEqual(self.started, ['x', 'z', 'y'])
+
+    def test_failure (self):
+        def start ():
+            raise ValueError()
+
+        result = self.scheduler.submit(Future, {'a': 1}, None, start)
+        self.assertIsInstance(result.exception(), ValueError)
+        self.assertEqual(self.scheduler.running, {})
+
+    def test_long_queue (self):
+        self.submit('x', {'a': 1})
+        results = [self.scheduler.submit(
+            Future, {'a': 1}, None, lambda i=i: util.resolved(Future, i)
+        ) for i in range(5000)]
+        self.pending['x'].set_result(None)
+        self.assertEqual(results[-1].result(), 4999)
+
+
+class DeviceExecutor (fs.OperationExecutor):
+    """Executor whose deletes complete when told to, where each item's device
+is the first component of its path, limited to one call at a time."""
+
+    future_type = Future
+
+    def __init__ (self):
+        fs.OperationExecutor.__init__(self)
+        self.pending = {}
+        self.support_operation(fs.Delete, self._delete)
+
+    def _delete (self, op, confirm):
+        self.pending[op.item.path] = Future()
+        return self.pending[op.item.path]
+
+    def operation_devices (self, ops):
+        return {op.item.path[0] for op in ops}
+
+    def device_limit (self, device):
+        return 1
+
+    def get_metadata (self, item, *properties):
+        return util.resolved(Future, {})
+
+
+class DeviceManager (TestCase):
+    def test_limit (self):
+        executor = DeviceExecutor()
+        manager = fs.SynchronousOperationManager(
+            executor, fs.OperationHistory(Future))
+        result = manager.execute([fs.Delete(fs.File(path)) for path in (
+            ('a', 'x'), ('b', 'y'), ('a', 'z'))])
+        self.assertCountEqual(executor.pending, [('a', 'x'), ('b', 'y')])
+        executor.pending[('a', 'x')].set_result(fs.AttentionItems())
+        self.assertIn(('a', 'z'), executor.pending)
+        executor.pending[('b', 'y')].set_result(fs.AttentionItems())
+        executor.pending[('a', 'z')].set_result(fs.AttentionItems())
+        self.assertEqual(result.result().state,
+                         fs.HistoryEventResult.SUCCESS)
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import functools
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+
+import fsmanage as fs
+
+from .util import tree_manager
+
+
+class DuplicateFinder (TestCase):
+    def setUp (self):
+        self.root = tempfile.mkdtemp()
+        self.manager = tree_manager()
+        self.pool = ThreadPoolExecutor(2)
+        self.add(('dir',))
+        self.add(('dir', 'sub'))
+        big = bytes(range(256)) * 100
+        self.add(('dir', 'a'), b'small')
+        self.add(('dir', 'sub', 'b'), b'small')
+        self.add(('dir', 'c'), b'other')
+        self.add(('dir', 'd'), big)
+        self.add(('dir', 'sub', 'e'), big)
+        # same ends and size, different middle
+        self.add(('dir', 'f'), big[:1000] + b'x' + big[1001:])
+        self.add(('dir', 'empty'), b'')
+        self.add(('dir', 'empty2'), b'')
+        self.finder = fs.DuplicateFinder(
+            self.manager, functools.partial(fs.open_path, self.root),
+            self.pool, block_size=64, batch_size=2)
+
+    def tearDown (self):
+        self.pool.shutdown()
+        shutil.rmtree(self.root)
+
+    def add (self, path, data=None):
+        real_path = os.path.join(self.root, *path)
+        if data is None:
+            os.mkdir(real_path)
+        else:
+            with open(real_path, 'wb') as f:
+                f.write(data)
+        self.manager.executor.add(path, None if data is None else len(data))
+
+    def test_find (self):
+        groups = self.finder.find((fs.Dir(('dir',)),)).result()
+        self.assertEqual(groups, [
+            (fs.File(('dir', 'd')), fs.File(('dir', 'sub', 'e'))),
+            (fs.File(('dir', 'a')), fs.File(('dir', 'sub', 'b'))),
+        ])
+
+    def test_min_size (self):
+        self.finder.min_size = 0
+        groups = self.finder.find((fs.Dir(('dir',)),)).result()
+        self.assertIn((fs.File(('dir', 'empty')), fs.File(('dir', 'empty2'))),
+                      groups)
+
+    def test_unreadable (self):
+        """Should leave out files that can't be read."""
+        os.remove(os.path.join(self.root, 'dir', 'sub', 'e'))
+        groups = self.finder.find((fs.Dir(('dir',)),)).result()
+        self.assertEqual(groups, [
+            (fs.File(('dir', 'a')), fs.File(('dir', 'sub', 'b'))),
+        ])
+
+    def test_empty (self):
+        self.assertEqual(self.finder.find(()).result(), [])
+
+
+class DeleteDuplicates (TestCase):
+    def test_ops (self):
+        class Manager:
+            def execute (self, ops, confirm=None):
+                self.ops = ops
+
+        manager = Manager()
+        groups = [(fs.File(('a',)), fs.File(('b',)), fs.File(('c',))),
+                  (fs.File(('d',)), fs.File(('e',)))]
+        fs.delete_duplicates(manager, groups, lambda group: group[-1])
+        self.assertEqual([op.item for op in manager.ops],
+                         [fs.File(('a',)), fs.File(('b',)), fs.File(('d',))])
+        for op in manager.ops:
+            self.assertIsInstance(op, fs.Delete)
@@ -0,0 +1,656 @@
+import os
+import errno
+import shutil
+import tempfile
+import threading
+import concurrent.futures
+from unittest import TestCase, mock, skipUnless
+
+import fsmanage as fs
+
+
+def unsupported (*args):
+    raise OSError(errno.ENOSYS, 'not supported')
+
+
+class FilesystemTestCase (TestCase):
+    def setUp (self):
+        self.root = tempfile.mkdtemp()
+        self.executor = fs.FilesystemOperationExecutor(
+            self.root, chunk_size=1000, buffer_size=100)
+        self.data = bytes(range(256)) * 20
+        self.write(('file',), self.data)
+        os.utime(self.path(('file',)), ns=(1000000000, 2000000000))
+        os.chmod(self.path(('file',)), 0o640)
+        os.mkdir(self.path(('dir',)))
+        self.write(('dir', 'inner'), b'inner')
+        os.symlink('inner', self.path(('dir', 'link')))
+
+    def tearDown (self):
+        shutil.rmtree(self.root)
+
+    def path (self, path):
+        return os.path.join(self.root, *path)
+
+    def write (self, path, data):
+        with open(self.path(path), 'wb') as f:
+            f.write(data)
+
+    def read (self, path):
+        with open(self.path(path), 'rb') as f:
+            return f.read()
+
+    def execute (self, op):
+        return self.executor.execute(op, None).result()
+
+
+class FilesystemMetadata (FilesystemTestCase):
+    def test_items (self):
+        items = self.executor.get_metadata(
+            fs.Dir(('dir',)), 'items').result()['items']
+        self.assertCountEqual(items, (fs.File(('dir', 'inner')),
+                                      fs.OperableItem(('dir', 'link'))))
+
+    def test_size (self):
+        meta = self.executor.get_metadata(
+            fs.File(('file',)), 'size', 'mtime').result()
+        self.assertEqual(meta, {'size': len(self.data), 'mtime': 2000000000})
+
+    def test_missing (self):
+        self.assertEqual(self.executor.get_metadata(
+            fs.File(('missing',)), 'size').result(), {})
+
+    def test_transient (self):
+        lstat = os.lstat
+        failures = [OSError(errno.EAGAIN, 'try again')]
+
+        def flaky_lstat (path):
+            if failures:
+                raise failures.pop()
+            return lstat(path)
+
+        manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(concurrent.futures.Future),
+            retry_policy=fs.RetryPolicy(call_later=lambda delay, fn: fn()))
+        with mock.patch.object(os, 'lstat', flaky_lstat):
+            self.assertIsInstance(self.executor.get_metadata(
+                fs.File(('file',)), 'size').exception(), OSError)
+            failures.append(OSError(errno.EAGAIN, 'try again'))
+            meta = manager.get_metadata(fs.File(('file',)), 'size').result()
+        self.assertEqual(meta, {'size': len(self.data)})
+        self.assertEqual(failures, [])
+
+
+class FilesystemCopy (FilesystemTestCase):
+    def check_file (self):
+        self.assertEqual(self.read(('copy',)), self.data)
+        st = os.stat(self.path(('copy',)))
+        self.assertEqual(st.st_mode & 0o777, 0o640)
+        self.assertEqual(st.st_mtime_ns, 2000000000)
+
+    def test_file (self):
+        attn = self.execute(fs.Copy(fs.File(('file',)), ('copy',)))
+        self.assertEqual(attn.items, (fs.File(('copy',)),))
+        self.assertEqual(attn.parent, fs.ROOT)
+        self.check_file()
+
+    def test_sendfile_fallback (self):
+        with mock.patch.object(os, 'copy_file_range', unsupported,
+                               create=True):
+            self.execute(fs.Copy(fs.File(('file',)), ('copy',)))
+        self.check_file()
+
+    def test_buffer_fallback (self):
+        with mock.patch.object(os, 'copy_file_range', unsupported,
+                               create=True):
+            with mock.patch.object(os, 'sendfile', unsupported, create=True):
+                self.execute(fs.Copy(fs.File(('file',)), ('copy',)))
+        self.check_file()
+
+    def test_dir (self):
+        self.execute(fs.Copy(fs.OperableDir(('dir',)), ('copy',)))
+        self.assertEqual(self.read(('copy', 'inner')), b'inner')
+        self.assertEqual(os.readlink(self.path(('copy', 'link'))), 'inner')
+
+    def test_exists (self):
+        future = self.executor.execute(
+            fs.Copy(fs.File(('file',)), ('dir',)), None)
+        exc = future.exception()
+        self.assertIsInstance(exc, fs.OperationException)
+        self.assertTrue(exc.reverted)
+        self.assertTrue(os.path.isdir(self.path(('dir',))))
+
+    def test_undo (self):
+        op = fs.Copy(fs.OperableDir(('dir',)), ('copy',))
+        self.execute(op)
+        self.assertTrue(self.executor.can_undo(fs.Copy))
+        attn = self.executor.undo(op).result()
+        self.assertEqual(attn.items, ())
+        self.assertFalse(os.path.lexists(self.path(('copy',))))
+
+    def test_unsupported (self):
+        class Unsupported (fs.Operation):
+            name = 'unsupported'
+
+            def __init__ (self):
+                pass
+
+        self.assertRaises(TypeError, self.executor.execute, Unsupported(),
+                          None)
+
+
+class FilesystemMove (FilesystemTestCase):
+    def test_file (self):
+        op = fs.Move(fs.File(('file',)), ('dir', 'moved'))
+        attn = self.execute(op)
+        self.assertEqual(attn.items, (fs.File(('dir', 'moved')),))
+        self.assertEqual(attn.parent, fs.Dir(('dir',)))
+        self.assertEqual(self.read(('dir', 'moved')), self.data)
+        self.assertFalse(os.path.lexists(self.path(('file',))))
+        self.executor.undo(op).result()
+        self.assertEqual(self.read(('file',)), self.data)
+
+    def test_rename (self):
+        """Should move directories with a single rename."""
+        with mock.patch.object(os, 'rename', wraps=os.rename) as rename:
+            self.execute(fs.Move(fs.OperableDir(('dir',)), ('moved',)))
+        self.assertEqual(rename.call_count, 1)
+        self.assertEqual(self.read(('moved', 'inner')), b'inner')
+
+    def test_exists (self):
+        exc = self.executor.execute(
+            fs.Move(fs.File(('file',)), ('dir',)), None).exception()
+        self.assertIsInstance(exc, fs.OperationException)
+        self.assertTrue(exc.reverted)
+        self.assertEqual(self.read(('file',)), self.data)
+
+
+@skipUnless(os.path.isdir('/dev/shm') and
+            os.stat('/dev/shm').st_dev !=
+            os.stat(tempfile.gettempdir()).st_dev,
+            'needs a temporary directory on a separate filesystem')
+class FilesystemMoveCrossDevice (FilesystemTestCase):
+    def setUp (self):
+        FilesystemTestCase.setUp(self)
+        self.other = tempfile.mkdtemp(dir='/dev/shm')
+        self.executor = fs.FilesystemOperationExecutor('/', workers=2)
+        self.src = tuple(self.root.strip(os.sep).split(os.sep)) + ('dir',)
+        self.dest = tuple(self.other.strip(os.sep).split(os.sep)) + ('moved',)
+        for i in range(10):
+            self.write(('dir', str(i)), str(i).encode())
+
+    def tearDown (self):
+        FilesystemTestCase.tearDown(self)
+        shutil.rmtree(self.other)
+
+    def test_move (self):
+        op = fs.Move(fs.OperableDir(self.src), self.dest)
+        self.execute(op)
+        self.assertFalse(os.path.lexists(self.path(('dir',))))
+        moved = os.path.join(self.other, 'moved')
+        self.assertEqual(len(os.listdir(moved)), 12)
+        self.assertEqual(os.readlink(os.path.join(moved, 'link')), 'inner')
+        self.executor.undo(op).result()
+        self.assertEqual(self.read(('dir', 'inner')), b'inner')
+        self.assertFalse(os.path.lexists(moved))
+
+    def test_slow (self):
+        threads = set()
+        self.executor.on_progress(
+            lambda *args: threads.add(threading.get_ident()))
+        with mock.patch.object(fs.filesystem, '_slow_device',
+                               lambda dev: True):
+            self.execute(fs.Move(fs.OperableDir(self.src), self.dest))
+        self.assertEqual(len(os.listdir(os.path.join(self.other, 'moved'))),
+                         12)
+        self.assertEqual(threads, {threading.get_ident()})
+
+    def test_nested (self):
+        for path in (('dir', 'sub'), ('dir', 'sub', 'deeper')):
+            os.mkdir(self.path(path))
+            self.write(path + ('file',), b'nested')
+        os.utime(self.path(('dir', 'sub')), ns=(1000000000, 2000000000))
+        op = fs.Move(fs.OperableDir(self.src), self.dest)
+        self.execute(op)
+        self.assertFalse(os.path.lexists(self.path(('dir',))))
+        moved = os.path.join(self.other, 'moved')
+        with open(os.path.join(moved, 'sub', 'deeper', 'file'), 'rb') as f:
+            self.assertEqual(f.read(), b'nested')
+        self.assertEqual(os.stat(os.path.join(moved, 'sub')).st_mtime_ns,
+                         2000000000)
+
+    def test_partial (self):
+        """Should leave an undoable state on failure."""
+        move_file = self.executor._move_file
+
+        def fail (src, dest, op=None):
+            if os.path.basename(src) == '5':
+                raise OSError(errno.EIO, 'failed')
+            move_file(src, dest, op)
+
+        op = fs.Move(fs.OperableDir(self.src), self.dest)
+        with mock.patch.object(self.executor, '_move_file', fail):
+            exc = self.executor.execute(op, None).exception()
+        self.assertIsInstance(exc, fs.OperationException)
+        self.assertFalse(exc.reverted)
+        self.executor.undo(op).result()
+        self.assertEqual(len(os.listdir(self.path(('dir',)))), 12)
+        self.assertEqual(self.read(('dir', '5')), b'5')
+        self.assertFalse(os.path.lexists(os.path.join(self.other, 'moved')))
+
+    def test_cancel (self):
+        """Should undo a cancelled move."""
+        control = fs.OperationControl()
+        checkpoints = []
+
+        def checkpoint (op):
+            checkpoints.append(op)
+            if len(checkpoints) == 8:
+                control.cancel()
+
+        self.executor.on_checkpoint(checkpoint)
+        manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(self.executor.future_type))
+        result = manager.execute(
+            [fs.Move(fs.OperableDir(self.src), self.dest)],
+            control=control).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
+        self.assertIsInstance(result.result, fs.CancelledException)
+        self.assertEqual(len(os.listdir(self.path(('dir',)))), 12)
+        self.assertFalse(os.path.lexists(os.path.join(self.other, 'moved')))
+
+
+class FilesystemDelete (FilesystemTestCase):
+    def setUp (self):
+        FilesystemTestCase.setUp(self)
+        for i in range(5):
+            os.makedirs(self.path(('dir', 'tree', str(i), 'deeper')))
+            for j in range(300):
+                self.write(('dir', 'tree', str(i), str(j)), b'')
+            os.symlink('/', self.path(('dir', 'tree', str(i), 'deeper', 'l')))
+
+    def test_file (self):
+        attn = self.execute(fs.Delete(fs.File(('file',))))
+        self.assertEqual(attn.items, ())
+        self.assertEqual(attn.parent, fs.ROOT)
+        self.assertFalse(os.path.lexists(self.path(('file',))))
+        self.assertFalse(self.executor.can_undo(fs.Delete))
+
+    def test_tree (self):
+        self.execute(fs.Delete(fs.OperableDir(('dir',))))
+        self.assertFalse(os.path.lexists(self.path(('dir',))))
+        self.assertEqual(os.listdir(self.root), ['file'])
+
+    def test_failure (self):
+        exc = self.executor.execute(
+            fs.Delete(fs.File(('missing',))), None).exception()
+        self.assertIsInstance(exc, fs.OperationException)
+
+    def test_callback_failure (self):
+        """Should release other threads if a progress callback fails."""
+        def report (n):
+            raise ValueError('callback failed')
+
+        fds = len(os.listdir('/proc/self/fd'))
+        remover = fs.filesystem._TreeRemover(self.path(('dir',)), 4, report)
+        self.assertRaises(ValueError, remover.run, self.executor.pool)
+        self.assertTrue(remover.done)
+        self.assertEqual(remover.open, set())
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+
+class FilesystemTrash (FilesystemTestCase):
+    def setUp (self):
+        FilesystemTestCase.setUp(self)
+        os.mkdir(self.path(('trash',)))
+        # don't put the trash at the top of the real filesystem
+        self.executor = fs.FilesystemOperationExecutor(
+            self.root, trash=True, trash_dir=self.path(('trash',)))
+
+    def test_undo (self):
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        self.execute(op)
+        self.assertFalse(os.path.lexists(self.path(('dir',))))
+        self.assertEqual(len(os.listdir(self.path(('trash',)))), 1)
+        self.assertTrue(self.executor.can_undo(fs.Delete))
+        attn = self.executor.undo(op).result()
+        self.assertEqual(attn.items, (fs.OperableDir(('dir',)),))
+        self.assertEqual(self.read(('dir', 'inner')), b'inner')
+        self.assertEqual(os.listdir(self.path(('trash',))), [])
+
+    def test_undo_data (self):
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        self.execute(op)
+        executor = fs.FilesystemOperationExecutor(self.root, trash=True)
+        restored = fs.Delete(fs.OperableDir(('dir',)))
+        executor.restore_undo_data(restored, self.executor.undo_data(op))
+        executor.undo(restored).result()
+        self.assertEqual(self.read(('dir', 'inner')), b'inner')
+
+    def test_purge (self):
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        self.execute(op)
+        self.assertTrue(self.executor.undo_available(op))
+        self.executor.purge_trash().result()
+        self.assertFalse(self.executor.undo_available(op))
+        self.assertEqual(os.listdir(self.path(('trash',))), [])
+        self.assertIsInstance(self.executor.undo(op).exception(),
+                              fs.OperationException)
+
+    def test_fallback (self):
+        """Should use the parent directory if the usual trash is unusable."""
+        self.executor = fs.FilesystemOperationExecutor(self.root, trash=True)
+        mkdir = os.mkdir
+
+        def restricted_mkdir (path, *args):
+            if not path.startswith(self.root):
+                raise PermissionError(errno.EACCES, 'denied')
+            mkdir(path, *args)
+
+        with mock.patch.object(os, 'mkdir', restricted_mkdir):
+            self.execute(fs.Delete(fs.File(('dir', 'inner'))))
+        self.assertFalse(os.path.lexists(self.path(('dir', 'inner'))))
+        trash = [name for name in os.listdir(self.path(('dir',)))
+                 if name.startswith(self.executor.trash_name)]
+        self.assertEqual(len(trash), 1)
+
+
+    def test_purge_event (self):
+        manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(concurrent.futures.Future))
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        manager.execute([op])
+        event, = manager.history.events
+        self.assertTrue(event.can_undo)
+        self.executor.purge_trash([op]).result()
+        self.assertFalse(event.can_undo)
+
+
+class FilesystemUndoStore (FilesystemTestCase):
+    def setUp (self):
+        FilesystemTestCase.setUp(self)
+        self.store = fs.UndoStore(os.path.join(self.root, '.store'))
+        self.executor = fs.FilesystemOperationExecutor(
+            self.root, undo_store=self.store)
+        os.utime(self.path(('dir',)), ns=(3000000000, 4000000000))
+
+    def test_undo (self):
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        self.execute(op)
+        self.assertFalse(os.path.lexists(self.path(('dir',))))
+        self.assertTrue(self.executor.can_undo(fs.Delete))
+        self.assertTrue(self.executor.undo_available(op))
+        self.assertGreater(self.executor.undo_size(op), 5)
+        attn = self.executor.undo(op).result()
+        self.assertEqual(attn.items, (fs.OperableDir(('dir',)),))
+        self.assertEqual(self.read(('dir', 'inner')), b'inner')
+        self.assertEqual(os.readlink(self.path(('dir', 'link'))), 'inner')
+        self.assertEqual(os.stat(self.path(('dir',))).st_mtime_ns,
+                         4000000000)
+        self.assertEqual(self.store.size, 0)
+
+    def test_metadata (self):
+        op = fs.Delete(fs.File(('file',)))
+        self.execute(op)
+        self.executor.undo(op).result()
+        self.assertEqual(self.read(('file',)), self.data)
+        st = os.stat(self.path(('file',)))
+        self.assertEqual(st.st_mode & 0o777, 0o640)
+        self.assertEqual(st.st_mtime_ns, 2000000000)
+
+    def test_evict (self):
+        self.store.max_bytes = len(self.data) + 1000
+        first = fs.Delete(fs.File(('file',)))
+        second = fs.Delete(fs.OperableDir(('dir',)))
+        history = fs.OperationHistory(concurrent.futures.Future)
+        manager = fs.SynchronousOperationManager(self.executor, history)
+        manager.execute([first])
+        self.write(('file2',), bytes(len(self.data)))
+        manager.execute([second, fs.Delete(fs.File(('file2',)))])
+        self.assertFalse(self.executor.undo_available(first))
+        self.assertFalse(history.events[0].can_undo)
+        self.assertTrue(history.events[1].can_undo)
+        exc = self.executor.undo(first).exception()
+        self.assertIsInstance(exc, fs.OperationException)
+        self.assertTrue(exc.reverted)
+
+    def test_revert (self):
+        history = fs.OperationHistory(concurrent.futures.Future,
+                                      require_reversible=True)
+        manager = fs.SynchronousOperationManager(self.executor, history)
+        ops = [fs.Delete(fs.File(('file',))),
+               fs.Delete(fs.File(('missing',))),
+               fs.Delete(fs.OperableDir(('dir',)))]
+        result = manager.execute(ops, allow_parallel=False).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
+        self.assertEqual(self.read(('file',)), self.data)
+        self.assertEqual(self.store.size, 0)
+
+    def test_release (self):
+        history = fs.OperationHistory(concurrent.futures.Future, max_events=1)
+        manager = fs.SynchronousOperationManager(self.executor, history)
+        first = fs.Delete(fs.File(('file',)))
+        manager.execute([first])
+        self.assertGreater(self.store.size, 0)
+        manager.execute([fs.Delete(fs.File(('dir', 'link')))])
+        # dropped from history
+        self.assertFalse(self.executor.undo_available(first))
+        self.assertFalse(self.store.has(first))
+        self.assertLess(self.store.size, len(self.data))
+
+    def test_unsupported (self):
+        os.mkfifo(self.path(('dir', 'fifo')))
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        self.execute(op)
+        self.assertFalse(os.path.lexists(self.path(('dir',))))
+        self.assertFalse(self.executor.undo_available(op))
+        self.assertEqual(self.store.size, 0)
+
+    def test_undo_data (self):
+        op = fs.Delete(fs.OperableDir(('dir',)))
+        self.execute(op)
+        store = fs.UndoStore(self.store.path)
+        executor = fs.FilesystemOperationExecutor(self.root, undo_store=store)
+        restored = fs.Delete(fs.OperableDir(('dir',)))
+        executor.restore_undo_data(restored, self.executor.undo_data(op))
+        self.assertTrue(executor.undo_available(restored))
+        executor.undo(restored).result()
+        self.assertEqual(self.read(('dir', 'inner')), b'inner')
+
+
+class FilesystemBatch (FilesystemTestCase):
+    def test_copy (self):
+        for i in range(10):
+            self.write(('dir', str(i)), str(i).encode())
+        ops = [fs.Copy(fs.File(('dir', str(i))), ('copy' + str(i),))
+               for i in range(10)]
+        attn = self.executor.execute_batch(ops, None).result()
+        self.assertCountEqual(attn.items, [op.dest_item for op in ops])
+        for i in range(10):
+            self.assertEqual(self.read(('copy' + str(i),)), str(i).encode())
+        self.executor.undo_batch(ops).result()
+        self.assertFalse(os.path.lexists(self.path(('copy0',))))
+
+    def test_errors (self):
+        ops = [fs.Copy(fs.File(('file',)), ('copy',)),
+               fs.Copy(fs.OperableDir(('dir',)), ('file',))]
+        exc = self.executor.execute_batch(ops, None).exception()
+        self.assertIsInstance(exc, fs.BatchOperationException)
+        self.assertEqual(exc.succeeded, (ops[0],))
+        self.assertEqual([e.operation for e in exc.errors], [ops[1]])
+        self.assertTrue(exc.reverted)
+        self.assertEqual(exc.attention.items, (fs.File(('copy',)),))
+
+    def test_mixed (self):
+        self.assertRaises(TypeError, self.executor.execute_batch, [
+            fs.Copy(fs.File(('file',)), ('copy',)),
+            fs.Delete(fs.File(('file',))),
+        ], None)
+
+    def test_manager (self):
+        manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(self.executor.future_type))
+        ops = [fs.Move(fs.File(('dir', 'inner')), ('inner',)),
+               fs.Move(fs.OperableItem(('dir', 'link')), ('link',))]
+        result = manager.execute(ops).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertEqual(os.listdir(self.path(('dir',))), [])
+        manager.history.undo().result()
+        self.assertEqual(self.read(('dir', 'inner')), b'inner')
+        self.assertFalse(os.path.lexists(self.path(('inner',))))
+
+    def test_dependent (self):
+        manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(self.executor.future_type))
+        # the second copy creates the directory the first copies into
+        ops = [fs.Copy(fs.File(('file',)), ('copy', 'file')),
+               fs.Copy(fs.OperableDir(('dir',)), ('copy',))]
+        result = manager.execute(ops).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertEqual(self.read(('copy', 'file')), self.data)
+        self.assertEqual(self.read(('copy', 'inner')), b'inner')
+        manager.history.undo().result()
+        self.assertFalse(os.path.lexists(self.path(('copy',))))
+
+
+class FilesystemProgress (FilesystemTestCase):
+    def test_copy (self):
+        manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(self.executor.future_type))
+        notified = []
+        manager.on_progress(notified.append)
+        manager.execute([fs.Copy(fs.File(('file',)), ('copy',)),
+                         fs.Copy(fs.OperableDir(('dir',)), ('copy dir',))])
+        progress = notified[-1]
+        self.assertEqual(progress.operations, ())
+        self.assertEqual(progress.bytes_total, len(self.data) + 5)
+        self.assertEqual(progress.bytes_done, len(self.data) + 5)
+        self.assertEqual(progress.items_total, 4)
+        self.assertEqual(progress.items_done, 4)
+
+
+class FilesystemControl (FilesystemTestCase):
+    def setUp (self):
+        FilesystemTestCase.setUp(self)
+        self.control = fs.OperationControl()
+        self.checkpoints = 0
+
+    def cancel_after (self, n):
+        def checkpoint (op):
+            self.checkpoints += 1
+            if self.checkpoints == n:
+                self.control.cancel()
+        self.executor.on_checkpoint(checkpoint)
+
+    def manager (self, manager_type=fs.SynchronousOperationManager):
+        return manager_type(
+            self.executor, fs.OperationHistory(self.executor.future_type))
+
+    def test_cancel_copy (self):
+        self.cancel_after(3)
+        result = self.manager().execute(
+            [fs.Copy(fs.File(('file',)), ('copy',))],
+            control=self.control).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
+        self.assertIsInstance(result.result, fs.CancelledException)
+        self.assertTrue(result.result.reverted)
+        self.assertFalse(os.path.lexists(self.path(('copy',))))
+
+    def test_cancel_remaining (self):
+        copy = self.executor._copy
+        copied = []
+
+        def copy_then_cancel (op, confirm):
+            copied.append(op)
+            result = copy(op, confirm)
+            self.control.cancel()
+            return result
+
+        self.executor.support_operation(fs.Copy, copy_then_cancel,
+                                        self.executor._undo_copy)
+        ops = [fs.Copy(fs.File(('file',)), ('copy',)),
+               fs.Copy(fs.File(('dir', 'inner')), ('inner',))]
+        result = self.manager().execute(
+            ops, allow_parallel=False, control=self.control).result()
+        self.assertEqual(copied, ops[:1])
+        # the first copy is undone
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
+        self.assertIsInstance(result.result, fs.CancelledException)
+        self.assertFalse(os.path.lexists(self.path(('copy',))))
+
+    def test_undo_after_cancel (self):
+        manager = self.manager()
+        op = fs.Copy(fs.OperableDir(('dir',)), ('copy',))
+        manager.execute([op], control=self.control)
+        self.control.cancel()
+        # cancelling only applies to whatever is running
+        result = manager.history.undo().result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertFalse(os.path.lexists(self.path(('copy',))))
+
+    def test_pause (self):
+        manager = self.manager(fs.ThreadedOperationManager)
+        self.control.pause()
+        try:
+            future = manager.execute(
+                [fs.Copy(fs.File(('file',)), ('copy',))],
+                control=self.control)
+            self.assertRaises(TimeoutError, future.result, .1)
+            self.control.resume()
+            result = future.result(5)
+        finally:
+            manager.close()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertEqual(self.read(('copy',)), self.data)
+
+    def test_default_control (self):
+        manager = self.manager(fs.ThreadedOperationManager)
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def checkpoint (op):
+            started.set()
+            proceed.wait(5)
+
+        self.executor.on_checkpoint(checkpoint)
+        try:
+            future = manager.execute([fs.Copy(fs.File(('file',)), ('copy',))])
+            self.assertTrue(started.wait(5))
+            future.control.cancel()
+            proceed.set()
+            result = future.result(5)
+        finally:
+            manager.close()
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
+        self.assertIsInstance(result.result, fs.CancelledException)
+        self.assertFalse(os.path.lexists(self.path(('copy',))))
+
+
+class FilesystemDevices (FilesystemTestCase):
+    def test_devices (self):
+        dev = os.stat(self.root).st_dev
+        devices = self.executor.operation_devices([
+            fs.Copy(fs.File(('file',)), ('missing', 'dir', 'file'))])
+        self.assertEqual(devices, {dev})
+
+    def test_slow_threads (self):
+        """Should use a single thread within calls on slow devices."""
+        for i in range(10):
+            self.write(('dir', str(i)), str(i).encode())
+        threads = set()
+        self.executor.on_progress(
+            lambda *args: threads.add(threading.get_ident()))
+        ops = [fs.Copy(fs.File(('dir', str(i))), ('copy' + str(i),))
+               for i in range(10)]
+        with mock.patch.object(fs.filesystem, '_slow_device',
+                               lambda dev: True):
+            self.executor.execute_batch(ops, None).result()
+            self.execute(fs.Delete(fs.OperableDir(('dir',))))
+        self.assertEqual(threads, {threading.get_ident()})
+
+    def test_limit (self):
+        self.executor.slow_device_limit = 2
+        with mock.patch.object(fs.filesystem, '_slow_device',
+                               lambda dev: dev == 1):
+            self.assertEqual(self.executor.device_limit(1), 2)
+            self.assertIsNone(self.executor.device_limit(2))
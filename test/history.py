@@ -0,0 +1,660 @@
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+from fsmanage import util
+
+
+class RecordEvent (fs.HistoryEvent):
+    """Event which records calls in a shared log, and fails on request."""
+
+    def __init__ (self, log, name, fail=None, fail_undo=None, cost=1):
+        self.log = log
+        self.name = name
+        self.cost = cost
+        #: State to fail execution with, if any.
+        self.fail = fail
+        #: State to fail undo with, if any.
+        self.fail_undo = fail_undo
+        #: Whether :meth:`discard` has been called.
+        self.discarded = False
+
+    def _result (self, action, fail):
+        self.log.append((action, self.name))
+        state = fs.HistoryEventResult.SUCCESS if fail is None else fail
+        return util.resolved(Future, fs.HistoryEventResult(state, self.name))
+
+    def execute (self, future_type):
+        return self._result('execute', self.fail)
+
+    def undo (self, future_type):
+        return self._result('undo', self.fail_undo)
+
+    def discard (self):
+        self.discarded = True
+
+
+class Clock:
+    def __init__ (self):
+        self.time = 0
+
+    def __call__ (self):
+        return self.time
+
+
+class HistoryTestCase (TestCase):
+    def setUp (self):
+        self.log = []
+        self.clock = Clock()
+        self.changes = []
+
+    def history (self, **kwargs):
+        history = fs.History(Future, current_time=self.clock, **kwargs)
+        history.on_change(lambda event, result: self.changes.append(
+            (event.name, result.state)))
+        return history
+
+    def event (self, name, **kwargs):
+        return RecordEvent(self.log, name, **kwargs)
+
+    def names (self, events):
+        return [event.name for event in events]
+
+
+class HistoryBasics (HistoryTestCase):
+    def test_add (self):
+        history = self.history()
+        result = history.add(self.event('a')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        history.add(self.event('b'))
+        self.assertEqual(self.names(history.past), ['a', 'b'])
+        self.assertEqual(history.position, 2)
+        self.assertEqual(self.changes, [
+            ('a', fs.HistoryEventResult.SUCCESS),
+            ('b', fs.HistoryEventResult.SUCCESS),
+        ])
+
+    def test_discard (self):
+        history = self.history(max_events=2)
+        a, b, c, d = [self.event(name) for name in 'abcd']
+        d.fail = fs.HistoryEventResult.FAILED
+        for event in (a, b, c):
+            history.add(event)
+        self.assertEqual([a.discarded, b.discarded], [True, False])
+        history.undo()
+        history.add(d)
+        self.assertEqual([b.discarded, c.discarded, d.discarded],
+                         [False, False, True])
+        history.add(self.event('e'))
+        self.assertEqual([b.discarded, c.discarded], [False, True])
+
+    def test_wrong_type (self):
+        history = fs.OperationHistory(Future)
+        self.assertRaises(TypeError, history.add, self.event('a'))
+
+    def test_require_reversible (self):
+        history = self.history(require_reversible=True)
+        event = self.event('a')
+        event.can_undo = False
+        self.assertRaises(TypeError, history.add, event)
+
+    def test_undo_redo (self):
+        history = self.history()
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        history.undo().result()
+        self.assertEqual(self.names(history.past), ['a'])
+        self.assertEqual(self.names(history.future), ['b'])
+        history.redo().result()
+        self.assertEqual(self.names(history.past), ['a', 'b'])
+        self.assertFalse(history.can_redo())
+        self.assertRaises(TypeError, history.redo)
+        self.assertEqual(self.log, [('execute', 'a'), ('execute', 'b'),
+                                    ('undo', 'b'), ('execute', 'b')])
+
+    def test_add_clears_future (self):
+        history = self.history()
+        history.add(self.event('a'))
+        history.undo()
+        history.add(self.event('b'))
+        self.assertEqual(self.names(history.events), ['b'])
+
+    def test_nothing_to_undo (self):
+        history = self.history()
+        self.assertFalse(history.can_undo())
+        self.assertRaises(TypeError, history.undo)
+
+    def test_permanent (self):
+        history = self.history(permanent=True)
+        history.add(self.event('a')).result()
+        self.assertEqual(history.events, ())
+        self.assertFalse(history.can_undo())
+
+
+class HistoryFailure (HistoryTestCase):
+    def test_revert (self):
+        history = self.history()
+        result = history.add(
+            self.event('a', fail=fs.HistoryEventResult.FAILED)).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
+        self.assertEqual(self.log, [('execute', 'a'), ('undo', 'a')])
+        self.assertEqual(history.events, ())
+
+    def test_revert_fails (self):
+        history = self.history()
+        result = history.add(self.event(
+            'a', fail=fs.HistoryEventResult.FAILED,
+            fail_undo=fs.HistoryEventResult.FAILED)).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+
+    def test_no_revert (self):
+        history = self.history(revert_on_failure=False)
+        history.add(self.event('a', fail=fs.HistoryEventResult.FAILED))
+        self.assertEqual(self.log, [('execute', 'a')])
+
+    def test_undo_fails (self):
+        history = self.history()
+        history.add(self.event('a'))
+        history.add(self.event('b', fail_undo=fs.HistoryEventResult.FAILED))
+        history.add(self.event('c'))
+        history.undo()
+        result = history.undo().result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        # b is dropped, along with everything after it
+        self.assertEqual(self.names(history.events), ['a'])
+        self.assertEqual(history.position, 1)
+
+
+class HistoryExpiry (HistoryTestCase):
+    def test_max_events (self):
+        history = self.history(max_events=2)
+        for name in 'abc':
+            history.add(self.event(name))
+        self.assertEqual(self.names(history.events), ['b', 'c'])
+        self.assertEqual(history.position, 2)
+
+    def test_expire_future_first (self):
+        history = self.history(max_events=3, expire_future_first=True)
+        for name in 'abc':
+            history.add(self.event(name))
+        history.undo()
+        history.undo()
+        history.max_events = 2
+        history.expire_events()
+        self.assertEqual(self.names(history.events), ['a', 'b'])
+        self.assertEqual(history.position, 1)
+
+    def test_max_cost (self):
+        history = self.history(max_cost=10)
+        history.add(self.event('a', cost=3))
+        history.add(self.event('b', cost=4))
+        history.add(self.event('c', cost=2))
+        self.assertEqual(history.cost, 9)
+        history.add(self.event('d', cost=5))
+        self.assertEqual(self.names(history.events), ['c', 'd'])
+        self.assertEqual(history.position, 2)
+        self.assertEqual(history.cost, 7)
+        # too expensive to keep at all
+        history.add(self.event('e', cost=20))
+        self.assertEqual(history.events, ())
+        self.assertEqual(history.cost, 0)
+
+    def test_cost_future_first (self):
+        history = self.history(expire_future_first=True)
+        for name in 'abc':
+            history.add(self.event(name, cost=2))
+        history.undo()
+        history.undo()
+        history.max_cost = 3
+        history.expire_events()
+        self.assertEqual(self.names(history.events), ['a'])
+        self.assertEqual(history.position, 1)
+
+    def test_cost_changes (self):
+        history = self.history(max_cost=10)
+        event = self.event('a', cost=1)
+        history.add(event)
+        history.add(self.event('b', cost=5))
+        event.cost = 8
+        self.assertEqual(history.cost, 6)
+        # read again when reverted
+        history.undo()
+        history.undo()
+        self.assertEqual(self.names(history.events), ['a'])
+        self.assertEqual(history.cost, 8)
+
+    def test_max_event_age (self):
+        history = self.history(max_event_age=10)
+        history.add(self.event('a'))
+        self.clock.time = 5
+        history.add(self.event('b'))
+        history.add(self.event('c'))
+        history.undo()
+        self.clock.time = 12
+        history.expire_events()
+        self.assertEqual(self.names(history.events), ['b', 'c'])
+        self.clock.time = 20
+        history.expire_events()
+        self.assertEqual(history.events, ())
+        self.assertEqual(history.position, 0)
+
+    def test_next_expiry (self):
+        history = self.history()
+        history.add(self.event('a'))
+        self.assertIsNone(history.next_expiry)
+        history.max_event_age = 10
+        self.assertEqual(history.next_expiry, 10)
+        self.clock.time = 3
+        history.add(self.event('b'))
+        self.clock.time = 5
+        history.undo()
+        history.undo()
+        # both in the future; b was reverted first
+        self.assertEqual(history.next_expiry, 15)
+
+    def test_call_later (self):
+        calls = []
+        history = self.history(
+            max_event_age=10,
+            call_later=lambda delay, fn: calls.append((delay, fn)))
+        history.add(self.event('a'))
+        self.clock.time = 4
+        history.add(self.event('b'))
+        # already waiting for a to expire
+        self.assertEqual([delay for delay, fn in calls], [10])
+        self.clock.time = 10
+        calls.pop()[1]()
+        self.assertEqual(self.names(history.events), ['b'])
+        self.assertEqual([delay for delay, fn in calls], [4])
+        self.clock.time = 14
+        calls.pop()[1]()
+        self.assertEqual(history.events, ())
+        self.assertEqual(calls, [])
+
+    def test_call_later_initial (self):
+        calls = []
+        self.history(max_event_age=10, events=[self.event('a')],
+                     call_later=lambda delay, fn: calls.append(delay))
+        self.assertEqual(calls, [10])
+
+
+class HistoryBranching (HistoryTestCase):
+    def history (self, **kwargs):
+        return HistoryTestCase.history(self, branching=True, **kwargs)
+
+    def branches (self, history):
+        return [self.names(branch) for branch in history.branches]
+
+    def test_branch (self):
+        history = self.history()
+        for name in 'abc':
+            history.add(self.event(name))
+        history.undo()
+        history.undo()
+        history.add(self.event('d'))
+        self.assertEqual(self.names(history.events), ['a', 'd'])
+        history.undo()
+        self.assertEqual(self.branches(history), [['d'], ['b', 'c']])
+        # the most recent branch by default
+        history.redo()
+        self.assertEqual(self.names(history.events), ['a', 'd'])
+        history.undo()
+        history.redo(1)
+        self.assertEqual(self.names(history.events), ['a', 'b', 'c'])
+        self.assertEqual(history.position, 2)
+        self.assertEqual(self.log[-1], ('execute', 'b'))
+        history.undo()
+        self.assertEqual(self.branches(history), [['b', 'c'], ['d']])
+
+    def test_nested (self):
+        history = self.history()
+        for name in 'abc':
+            history.add(self.event(name))
+        history.undo()
+        history.add(self.event('d'))
+        history.undo()
+        history.undo()
+        history.add(self.event('e'))
+        history.undo()
+        # b's branch keeps its own branches
+        history.redo(1)
+        self.assertEqual(self.names(history.future), ['d'])
+        self.assertEqual(self.branches(history), [['d'], ['c']])
+        history.redo(1)
+        self.assertEqual(self.names(history.events), ['a', 'b', 'c'])
+        history.undo()
+        history.undo()
+        self.assertEqual(self.branches(history), [['b', 'c'], ['e']])
+
+    def test_empty_future (self):
+        history = self.history()
+        history.add(self.event('a'))
+        history.undo()
+        history.add(self.event('b'))
+        history.undo()
+        history.redo(1)
+        history.undo()
+        # a was redone, failing, and dropped
+        history.events[0].fail = fs.HistoryEventResult.FAILED
+        history.redo()
+        self.assertEqual(history.events, ())
+        self.assertEqual(self.branches(history), [['b']])
+        history.redo()
+        self.assertEqual(self.names(history.events), ['b'])
+
+    def test_no_branch (self):
+        history = self.history()
+        history.add(self.event('a'))
+        self.assertEqual(history.branches, ())
+        self.assertRaises(TypeError, history.redo)
+        history.undo()
+        self.assertRaises(IndexError, history.redo, 1)
+
+    def test_not_branching (self):
+        history = HistoryTestCase.history(self)
+        history.add(self.event('a'))
+        history.undo()
+        history.add(self.event('b'))
+        history.undo()
+        self.assertEqual(self.branches(history), [['b']])
+
+    def test_max_events (self):
+        history = self.history(max_events=4)
+        for name in 'abc':
+            history.add(self.event(name))
+        history.undo()
+        history.add(self.event('d'))
+        history.undo()
+        history.add(self.event('e'))
+        # the oldest branch goes first
+        self.assertEqual(self.names(history.events), ['a', 'b', 'e'])
+        history.undo()
+        self.assertEqual(self.branches(history), [['e'], ['d']])
+        history.add(self.event('f'))
+        history.add(self.event('g'))
+        self.assertEqual(self.names(history.events), ['a', 'b', 'f', 'g'])
+        history.undo()
+        history.undo()
+        self.assertEqual(self.branches(history), [['f', 'g']])
+
+    def test_cost (self):
+        history = self.history()
+        history.add(self.event('a', cost=2))
+        history.undo()
+        history.add(self.event('b', cost=3))
+        self.assertEqual(history.cost, 5)
+
+    def test_expiry (self):
+        history = self.history(max_event_age=10)
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        history.undo()
+        self.clock.time = 5
+        history.add(self.event('c'))
+        self.assertEqual(history.next_expiry, 10)
+        self.clock.time = 11
+        history.add(self.event('d'))
+        self.assertEqual(self.names(history.events), ['c', 'd'])
+        # the branch was left later
+        self.assertEqual(self.branches(history), [])
+        self.assertEqual(history.cost, 3)
+        self.assertEqual(history.next_expiry, 15)
+        self.clock.time = 15
+        history.expire_events()
+        self.assertEqual(self.names(history.events), ['d'])
+        self.assertEqual(history.cost, 1)
+
+    def test_fork_expires (self):
+        history = self.history(max_events=3)
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        history.undo()
+        history.add(self.event('c'))
+        history.add(self.event('d'))
+        # the branch goes before a, which leads to it
+        self.assertEqual(self.names(history.events), ['a', 'c', 'd'])
+        history.add(self.event('e'))
+        self.assertEqual(self.names(history.events), ['c', 'd', 'e'])
+        history.undo()
+        history.undo()
+        history.undo()
+        self.assertEqual(self.branches(history), [['c', 'd', 'e']])
+
+    def test_discard (self):
+        history = self.history()
+        a, b = self.event('a'), self.event('b')
+        history.add(a)
+        history.undo()
+        history.add(b)
+        # kept in a branch
+        self.assertFalse(a.discarded)
+        history.max_events = 1
+        history.expire_events()
+        self.assertTrue(a.discarded)
+        self.assertFalse(b.discarded)
+
+    def test_views (self):
+        history = self.history()
+        history.add(self.event('a'))
+        self.assertIs(history.events, history.events)
+        self.assertEqual(history.past, history.events)
+        events = history.events
+        history.add(self.event('b'))
+        past = history.past
+        history.undo()
+        self.assertEqual(self.names(events), ['a'])
+        self.assertEqual(self.names(past), ['a', 'b'])
+        self.assertEqual(self.names(history.events), ['a', 'b'])
+        self.assertEqual(self.names(history.future), ['b'])
+
+
+class PendingEvent (fs.HistoryEvent):
+    """Event whose execution and undo finish when :meth:`finish` is called."""
+
+    def __init__ (self, log, name, conflicting=()):
+        self.log = log
+        self.name = name
+        #: Names of events this conflicts with.
+        self.conflicting = set(conflicting)
+        self.future = None
+
+    def _start (self, action):
+        self.log.append((action, self.name))
+        self.future = Future()
+        return self.future
+
+    def execute (self, future_type):
+        return self._start('execute')
+
+    def undo (self, future_type):
+        return self._start('undo')
+
+    def finish (self):
+        self.future.set_result(fs.HistoryEventResult(
+            fs.HistoryEventResult.SUCCESS, self.name))
+
+    def conflicts (self, other):
+        return (other.name in self.conflicting or
+                self.name in other.conflicting)
+
+
+class HistoryRunning (HistoryTestCase):
+    def event (self, name, *conflicting):
+        return PendingEvent(self.log, name, conflicting)
+
+    def test_one (self):
+        history = self.history()
+        a, b = self.event('a'), self.event('b')
+        history.add(a)
+        history.add(b)
+        self.assertEqual(self.log, [('execute', 'a')])
+        a.finish()
+        self.assertEqual(self.log, [('execute', 'a'), ('execute', 'b')])
+
+    def test_parallel (self):
+        history = self.history(max_running=2)
+        a, b, c = self.event('a'), self.event('b'), self.event('c')
+        for event in (a, b, c):
+            history.add(event)
+        self.assertEqual(self.log, [('execute', 'a'), ('execute', 'b')])
+        b.finish()
+        self.assertEqual(self.log[-1], ('execute', 'c'))
+        c.finish()
+        a.finish()
+        # in the order they finished
+        self.assertEqual(self.names(history.events), ['b', 'c', 'a'])
+
+    def test_conflict (self):
+        history = self.history(max_running=None)
+        a = self.event('a')
+        b = self.event('b', 'a')
+        c = self.event('c', 'b')
+        d = self.event('d')
+        for event in (a, b, c, d):
+            history.add(event)
+        # c doesn't conflict with a, but can't overtake b
+        self.assertEqual(self.log, [('execute', 'a'), ('execute', 'd')])
+        a.finish()
+        self.assertEqual(self.log[-1], ('execute', 'b'))
+        b.finish()
+        self.assertEqual(self.log[-1], ('execute', 'c'))
+
+    def test_undo_waits (self):
+        history = self.history(max_running=None)
+        a, b, c = self.event('a'), self.event('b'), self.event('c')
+        history.add(a)
+        a.finish()
+        history.add(b)
+        history.undo()
+        history.add(c)
+        self.assertEqual(self.log, [('execute', 'a'), ('execute', 'b')])
+        b.finish()
+        self.assertEqual(self.log[-1], ('undo', 'b'))
+        b.finish()
+        self.assertEqual(self.log[-1], ('execute', 'c'))
+        c.finish()
+        self.assertEqual(self.names(history.events), ['a', 'c'])
+
+    def test_permanent (self):
+        history = self.history(permanent=True)
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        self.assertEqual(self.log, [('execute', 'a'), ('execute', 'b')])
+
+
+class MergeEvent (RecordEvent):
+    """Event which merges with events whose names continue its own."""
+
+    def merge (self, event):
+        if event.name.startswith(self.name[-1]):
+            return MergeEvent(self.log, self.name + event.name[1:])
+        return None
+
+
+class HistoryCoalesce (HistoryTestCase):
+    def event (self, name, **kwargs):
+        return MergeEvent(self.log, name, **kwargs)
+
+    def test_merge (self):
+        history = self.history(coalesce_window=5)
+        for name in ('ab', 'bc', 'cd', 'xy'):
+            history.add(self.event(name))
+        self.assertEqual(self.names(history.events), ['abcd', 'xy'])
+        history.undo()
+        history.undo()
+        self.assertEqual(self.log[-1], ('undo', 'abcd'))
+
+    def test_window (self):
+        history = self.history(coalesce_window=5)
+        history.add(self.event('ab'))
+        self.clock.time = 4
+        history.add(self.event('bc'))
+        # measured from the last merge
+        self.clock.time = 9
+        history.add(self.event('cd'))
+        self.clock.time = 15
+        history.add(self.event('de'))
+        self.assertEqual(self.names(history.events), ['abcd', 'de'])
+
+    def test_not_after_undo (self):
+        history = self.history(coalesce_window=5)
+        history.add(self.event('ab'))
+        history.add(self.event('bc'))
+        history.add(self.event('xy'))
+        history.undo()
+        history.add(self.event('cd'))
+        self.assertEqual(self.names(history.events), ['abc', 'cd'])
+
+    def test_disabled (self):
+        history = self.history()
+        history.add(self.event('ab'))
+        history.add(self.event('bc'))
+        self.assertEqual(self.names(history.events), ['ab', 'bc'])
+
+    def test_coalesce (self):
+        history = self.history(
+            coalesce_window=5,
+            coalesce=lambda a, b: self.event(a.name + '+' + b.name))
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        self.assertEqual(self.names(history.events), ['a+b'])
+
+    def test_cancel_out (self):
+        def coalesce (a, b):
+            event = self.event(a.name + b.name)
+            event.has_effect = event.name[0] != event.name[-1]
+            return event
+
+        history = self.history(coalesce_window=5, coalesce=coalesce)
+        history.add(self.event('x'))
+        self.clock.time = 10
+        history.add(self.event('ab'))
+        history.add(self.event('ba'))
+        self.assertEqual(self.names(history.events), ['x'])
+        self.assertEqual(history.position, 1)
+        self.assertEqual(history.cost, 1)
+
+
+class HistoryBatchedChanges (HistoryTestCase):
+    def setUp (self):
+        HistoryTestCase.setUp(self)
+        self.batches = []
+        self.dispatched = []
+
+    def record (self, batch):
+        self.batches.append([(event.name, result.state)
+                             for event, result in batch])
+
+    def test_batch (self):
+        history = self.history()
+        history.on_changes(self.record, dispatch=self.dispatched.append)
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        history.undo()
+        self.assertEqual(len(self.dispatched), 1)
+        self.assertEqual(self.batches, [])
+        self.dispatched.pop()()
+        success = fs.HistoryEventResult.SUCCESS
+        self.assertEqual(self.batches, [
+            [('a', success), ('b', success), ('b', success)]])
+        history.add(self.event('c'))
+        self.dispatched.pop()()
+        self.assertEqual(self.batches[-1], [('c', success)])
+
+    def test_no_dispatch (self):
+        history = self.history()
+        history.on_changes(self.record)
+        history.add(self.event('a'))
+        history.add(self.event('b'))
+        self.assertEqual(len(self.batches), 2)
+
+    def test_flush (self):
+        batcher = fs.ChangeBatcher(self.record, self.dispatched.append)
+        history = self.history()
+        history.on_change(batcher)
+        history.add(self.event('a'))
+        batcher.flush()
+        self.assertEqual(len(self.batches), 1)
+        # the pending call finds nothing to do
+        self.dispatched.pop()()
+        self.assertEqual(len(self.batches), 1)
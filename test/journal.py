@@ -0,0 +1,253 @@
+import os
+import errno
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import TestCase, mock
+
+import fsmanage as fs
+
+from .opexec import RecordExecutor, deletes
+
+
+class UndoDataExecutor (RecordExecutor):
+    """Executor recording undo data for each operation it executes."""
+
+    def __init__ (self):
+        RecordExecutor.__init__(self)
+        self.undo_store = {}
+
+    def _execute (self, op, confirm):
+        self.undo_store[op] = op.item.name.encode()
+        return RecordExecutor._execute(self, op, confirm)
+
+    def undo_data (self, op):
+        return self.undo_store.get(op)
+
+    def restore_undo_data (self, op, data):
+        self.undo_store[op] = data
+
+
+class JournalTestCase (TestCase):
+    def setUp (self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal')
+        self.journals = []
+
+    def tearDown (self):
+        for journal in self.journals:
+            journal.close()
+        shutil.rmtree(self.dir)
+
+    def open (self, **kwargs):
+        """Create a manager with history restored from the journal."""
+        executor = UndoDataExecutor()
+        manager = fs.SynchronousOperationManager(
+            executor, fs.OperationHistory(Future))
+        journal = fs.HistoryJournal(
+            self.path, fs.OperationJournalCodec(manager), **kwargs)
+        self.journals.append(journal)
+        events, position = journal.load()
+        manager.history = fs.OperationHistory(
+            Future, events=events, position=position,
+            **kwargs.pop('history_args', {}))
+        journal.attach(manager.history)
+        return manager, journal
+
+    def names (self, history):
+        return [[op.item.path for op in event.operations]
+                for event in history.events]
+
+
+class HistoryJournalTest (JournalTestCase):
+    def test_empty (self):
+        manager, journal = self.open()
+        self.assertEqual(manager.history.events, ())
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_restore (self):
+        manager, journal = self.open()
+        manager.execute(deletes('a/x', 'a/y'))
+        manager.execute(deletes('b'))
+        manager.execute(deletes('c'))
+        manager.history.undo()
+        journal.close()
+
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history), [
+            [('a', 'x'), ('a', 'y')], [('b',)], [('c',)]])
+        self.assertEqual(manager.history.position, 2)
+        manager.history.undo().result()
+        self.assertEqual(manager.executor.calls,
+                         [('undo', 'b')])
+        self.assertEqual(manager.history.position, 1)
+
+    def test_undo_data (self):
+        manager, journal = self.open()
+        manager.execute(deletes('a/x', 'b/y'))
+        journal.close()
+        manager, journal = self.open()
+        self.assertCountEqual(manager.executor.undo_store.values(),
+                              [b'x', b'y'])
+        event = manager.history.events[0]
+        self.assertEqual(event.done, [(op,) for op in event.operations])
+
+    def test_add_after_undo (self):
+        manager, journal = self.open()
+        for path in 'abc':
+            manager.execute(deletes(path))
+        manager.history.undo()
+        manager.history.undo()
+        manager.execute(deletes('d'))
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history), [[('a',)], [('d',)]])
+        self.assertEqual(manager.history.position, 2)
+
+    def test_expiry (self):
+        manager, journal = self.open()
+        manager.history.max_events = 2
+        for path in 'abc':
+            manager.execute(deletes(path))
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history), [[('b',)], [('c',)]])
+
+    def test_torn_write (self):
+        manager, journal = self.open()
+        manager.execute(deletes('a'))
+        manager.execute(deletes('b'))
+        journal.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 3)
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history), [[('a',)]])
+        manager.execute(deletes('c'))
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history), [[('a',)], [('c',)]])
+
+    def test_compact (self):
+        manager, journal = self.open(compact_ratio=2, compact_min_records=8)
+        manager.history.max_events = 3
+        sizes = []
+        for i in range(60):
+            manager.execute(deletes(str(i)))
+            manager.history.undo()
+            manager.history.redo()
+            sizes.append(os.path.getsize(self.path))
+        # doesn't keep growing
+        self.assertLessEqual(max(sizes[30:]), max(sizes[10:30]))
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history),
+                         [[('57',)], [('58',)], [('59',)]])
+
+    def test_incremental (self):
+        manager, journal = self.open()
+        for i in range(20):
+            manager.execute(deletes(str(i)))
+        encoded = []
+        encode = journal.codec.encode
+        journal.codec.encode = lambda event: (encoded.append(event),
+                                              encode(event))[1]
+        size = os.path.getsize(self.path)
+        manager.execute(deletes('x'))
+        # only the new event is encoded and written
+        self.assertEqual(encoded, [manager.history.events[-1]])
+        self.assertLess(os.path.getsize(self.path) - size, 100)
+
+    def test_branches (self):
+        manager, journal = self.open()
+        manager.history.branching = True
+        for path in 'abc':
+            manager.execute(deletes(path))
+        manager.history.undo()
+        manager.history.undo()
+        manager.execute(deletes('d'))
+        manager.history.undo()
+        manager.history.redo(1)
+        manager.execute(deletes('e'))
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history),
+                         [[('a',)], [('b',)], [('e',)]])
+        self.assertEqual(manager.history.position, 3)
+
+    def test_encode_failure (self):
+        manager, journal = self.open()
+        manager.history.max_events = 2
+        manager.execute(deletes('a'))
+        manager.execute(deletes('b'))
+        encode = journal.codec.encode
+        failures = [TypeError('unknown type')]
+
+        def flaky_encode (event):
+            if failures:
+                raise failures.pop()
+            return encode(event)
+
+        journal.codec.encode = flaky_encode
+        manager.execute(deletes('c'))
+        self.assertIsInstance(journal.error, TypeError)
+        manager.execute(deletes('d'))
+        self.assertIsNone(journal.error)
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history), [[('c',)], [('d',)]])
+
+    def test_write_failure (self):
+        manager, journal = self.open()
+        manager.execute(deletes('a'))
+        write_all = fs.journal._write_all
+
+        def partial_write (fd, data):
+            write_all(fd, data[:len(data) // 2])
+            raise OSError(errno.ENOSPC, 'no space')
+
+        with mock.patch.object(fs.journal, '_write_all', partial_write):
+            manager.execute(deletes('b'))
+        self.assertIsInstance(journal.error, OSError)
+        manager.execute(deletes('c'))
+        self.assertIsNone(journal.error)
+        journal.close()
+        manager, journal = self.open()
+        self.assertEqual(self.names(manager.history),
+                         [[('a',)], [('b',)], [('c',)]])
+
+    def test_not_journal (self):
+        with open(self.path, 'wb') as f:
+            f.write(b'something else')
+        self.assertRaises(ValueError, self.open)
+
+
+class OperationJournalCodecTest (TestCase):
+    def setUp (self):
+        self.manager = fs.SynchronousOperationManager(
+            fs.FilesystemOperationExecutor(), fs.OperationHistory(Future))
+        self.codec = fs.OperationJournalCodec(self.manager)
+
+    def test_round_trip (self):
+        ops = [fs.Copy(fs.File(('a', 'b\udcff')), ('c',)),
+               fs.Move(fs.OperableDir(('d',)), ('e', 'f')),
+               fs.Delete(fs.OperableItem(('g',)))]
+        event = self.manager.create_event(ops, allow_parallel=False)
+        decoded = self.codec.decode(self.codec.encode(event))
+        self.assertFalse(decoded.allow_parallel)
+        self.assertEqual([type(op) for op in decoded.operations],
+                         [fs.Copy, fs.Move, fs.Delete])
+        self.assertEqual([op.item for op in decoded.operations],
+                         [op.item for op in ops])
+        self.assertEqual(decoded.operations[1].dest, ('e', 'f'))
+
+    def test_unknown_type (self):
+        class Other (fs.File):
+            pass
+
+        event = self.manager.create_event([fs.Delete(Other(('a',)))])
+        self.assertRaises(TypeError, self.codec.encode, event)
+        codec = fs.OperationJournalCodec(self.manager, types=(Other,))
+        self.assertIsInstance(
+            codec.decode(codec.encode(event)).operations[0].item, Other)
+        self.assertRaises(ValueError, self.codec.decode, codec.encode(event))
@@ -0,0 +1,235 @@
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+from fsmanage import util
+
+
+class RecordExecutor (fs.OperationExecutor):
+    """Executor supporting :class:`fs.Delete`, which records calls instead of
+doing anything.
+
+Operations on items named in :attr:`fail` fail without being reverted, and so
+do undos of operations on items named in :attr:`fail` or :attr:`fail_undo`.
+
+"""
+
+    future_type = Future
+
+    def __init__ (self, batch=True):
+        fs.OperationExecutor.__init__(self)
+        self.calls = []
+        self.fail = set()
+        self.fail_undo = set()
+        #: ``parallel`` argument for each batch executed.
+        self.parallel = []
+        self.support_operation(fs.Delete, self._execute, self._undo)
+        if batch:
+            self.support_batch(fs.Delete, self._execute_batch)
+
+    def _result (self, op, fail=frozenset()):
+        if op.item.name in self.fail or op.item.name in fail:
+            return util.failed(Future, fs.OperationException(op, False))
+        return util.resolved(Future, fs.AttentionItems(
+            (op.item,), fs.Dir(op.item.path[:-1])))
+
+    def _execute (self, op, confirm):
+        self.calls.append(('execute', op.item.name))
+        return self._result(op)
+
+    def _undo (self, op):
+        self.calls.append(('undo', op.item.name))
+        return self._result(op, self.fail_undo)
+
+    def _execute_batch (self, ops, confirm, parallel):
+        self.calls.append(('execute_batch', [op.item.name for op in ops]))
+        self.parallel.append(parallel)
+        results = [self._result(op) for op in ops]
+        errors = [r.exception() for r in results if r.exception()]
+        succeeded = [op for op, r in zip(ops, results) if not r.exception()]
+        attn = fs.AttentionItems()
+        for r in results:
+            if not r.exception():
+                attn = attn.extended(r.result())
+        if errors:
+            return util.failed(Future, fs.BatchOperationException(
+                errors, succeeded, attn))
+        return util.resolved(Future, attn)
+
+    def get_metadata (self, item, *properties):
+        return util.resolved(Future, {})
+
+
+def deletes (*paths):
+    return [fs.Delete(fs.File(tuple(path.split('/')))) for path in paths]
+
+
+class OperationManagerExecute (TestCase):
+    def setUp (self):
+        self.executor = RecordExecutor()
+        self.manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(Future))
+
+    def test_batches (self):
+        result = self.manager.execute(
+            deletes('a/x', 'a/y', 'b/z', 'a/w'), allow_parallel=False
+        ).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertEqual([item.path for item in result.result.items], [
+            ('a', 'x'), ('a', 'y'), ('b', 'z'), ('a', 'w')])
+        self.assertEqual(self.executor.calls, [
+            ('execute_batch', ['x', 'y']),
+            ('execute', 'z'),
+            ('execute', 'w'),
+        ])
+
+    def test_batch_parallel (self):
+        self.manager.execute(deletes('a/x', 'a/y'))
+        self.manager.execute(deletes('a/z', 'a/w'), allow_parallel=False)
+        self.assertEqual(self.executor.parallel, [True, False])
+
+    def test_batch_dependent (self):
+        # a/x/y is in a, so must be removed before it
+        ops = [fs.Delete(fs.File(('a', 'x', 'y'))),
+               fs.Delete(fs.File(('a', 'x', 'z'))),
+               fs.Delete(fs.OperableDir(('a', 'x'))),
+               fs.Delete(fs.File(('a', 'w')))]
+        event = self.manager.create_event(ops)
+        self.assertEqual([[op.item.name for op in group]
+                          for group in event._groups],
+                         [['y', 'z'], ['x', 'w']])
+        self.manager.execute([fs.Delete(fs.File(('a', 'x'))),
+                              fs.Delete(fs.File(('a', 'x')))])
+        self.assertEqual(self.executor.calls[-2:],
+                         [('execute', 'x'), ('execute', 'x')])
+
+    def test_no_batch_support (self):
+        self.executor = RecordExecutor(False)
+        self.manager.executor = self.executor
+        self.manager.execute(deletes('a/x', 'a/y'))
+        self.assertEqual(self.executor.calls,
+                         [('execute', 'x'), ('execute', 'y')])
+
+    def test_undo (self):
+        self.manager.execute(deletes('a/x', 'a/y', 'b/z'),
+                             allow_parallel=False)
+        self.executor.calls = []
+        result = self.manager.history.undo().result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        # no batch undo, so operations are undone one at a time, in reverse
+        self.assertEqual(self.executor.calls,
+                         [('undo', 'z'), ('undo', 'y'), ('undo', 'x')])
+        self.assertEqual(result.result.items, ())
+
+    def test_unsupported (self):
+        self.assertRaises(TypeError, self.manager.execute,
+                          [fs.Copy(fs.File(('a',)), ('b',))])
+
+    def test_partial_failure (self):
+        self.executor.fail.add('y')
+        self.manager.history.revert_on_failure = False
+        result = self.manager.execute(
+            deletes('a/x', 'a/y', 'b/z'), allow_parallel=False).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        self.assertIsInstance(result.result, fs.BatchOperationException)
+        self.assertEqual([op.item.name for op in result.result.succeeded],
+                         ['x'])
+        # stops at the first failed group when not parallel
+        self.assertEqual(self.executor.calls,
+                         [('execute_batch', ['x', 'y'])])
+
+    def test_revert (self):
+        self.executor.fail.add('z')
+        result = self.manager.execute(deletes('a/x', 'a/y', 'b/z')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        # the failed operation wasn't reverted, so it's undone too
+        self.assertCountEqual(self.executor.calls[-3:],
+                              [('undo', 'z'), ('undo', 'y'), ('undo', 'x')])
+        self.assertEqual(self.manager.history.events, ())
+
+    def test_revert_independent (self):
+        self.executor = RecordExecutor(False)
+        self.manager.executor = self.executor
+        self.executor.fail.add('z')
+        self.executor.fail_undo.add('x')
+        event = self.manager.create_event(deletes('a/x', 'b/y', 'c/z'))
+        result = self.manager.history.add(event).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        # failing to undo one operation doesn't stop the others
+        self.assertCountEqual(self.executor.calls[3:],
+                              [('undo', 'x'), ('undo', 'y'), ('undo', 'z')])
+        self.assertEqual([[op.item.name for op in group]
+                          for group in event.done], [['x'], ['z']])
+
+    def test_revert_dependent (self):
+        self.executor.fail.add('y')
+        self.executor.fail_undo.add('x')
+        event = self.manager.create_event(
+            deletes('a/x/f', 'a/x', 'b/y/g', 'b/y'))
+        result = self.manager.history.add(event).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        # directories must be restored before their contents
+        self.assertCountEqual(self.executor.calls[4:],
+                              [('undo', 'x'), ('undo', 'y')])
+        self.assertEqual([[op.item.name for op in group]
+                          for group in event.done],
+                         [['f'], ['x'], ['g'], ['y']])
+
+    def test_revert_batch (self):
+        self.executor.fail.add('z')
+        self.executor.fail_undo.add('x')
+        event = self.manager.create_event(deletes('a/x', 'a/y', 'a/z'))
+        result = self.manager.history.add(event).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        # only the batch's operations that weren't undone remain
+        self.assertEqual([[op.item.name for op in group]
+                          for group in event.done], [['x', 'z']])
+        self.executor.fail.clear()
+        self.executor.fail_undo.clear()
+        self.assertEqual(event.undo(Future).result().state,
+                         fs.HistoryEventResult.SUCCESS)
+        self.assertEqual(self.executor.calls[-2:],
+                         [('undo', 'z'), ('undo', 'x')])
+        self.assertEqual(event.done, [])
+
+    def test_cost (self):
+        event = self.manager.create_event(deletes('x', 'y'))
+        self.assertEqual(event.cost, 2 * event.operation_cost)
+        self.executor.undo_data = lambda op: b'data'
+        self.assertEqual(event.cost, 2 * event.operation_cost + 8)
+
+    def test_merge_moves (self):
+        self.executor.support_operation(
+            fs.Move, self.executor._execute, self.executor._undo)
+        self.manager.history.coalesce_window = 10
+        self.manager.execute([fs.Move(fs.File(('a',)), ('b',))])
+        self.manager.execute([fs.Move(fs.File(('b',)), ('c',))])
+        event, = self.manager.history.events
+        op, = event.operations
+        self.assertEqual((op.item.path, op.dest), (('a',), ('c',)))
+        self.manager.history.undo()
+        self.assertEqual(self.executor.calls[-1], ('undo', 'a'))
+        self.manager.history.redo()
+        self.manager.execute([fs.Move(fs.File(('c',)), ('d',))])
+        # moving back cancels out
+        self.manager.execute([fs.Move(fs.File(('d',)), ('c',))])
+        self.assertEqual(len(self.manager.history.events), 1)
+        self.assertEqual(self.manager.history.position, 1)
+
+    def test_conflicts (self):
+        event = self.manager.create_event(deletes('a/x', 'b'))
+        self.assertTrue(event.conflicts(
+            self.manager.create_event(deletes('a'))))
+        self.assertTrue(event.conflicts(
+            self.manager.create_event(deletes('b/y'))))
+        self.assertFalse(event.conflicts(
+            self.manager.create_event(deletes('a/y', 'c'))))
+        self.assertTrue(event.conflicts(fs.HistoryEvent()))
+
+    def test_nothing_done (self):
+        self.executor.fail.add('x')
+        self.executor.support_operation(
+            fs.Delete, lambda op, confirm: util.failed(
+                Future, fs.OperationException(op)))
+        result = self.manager.execute(deletes('x')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.REVERTED)
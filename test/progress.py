@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+import fsmanage as fs
+
+
+class Clock:
+    def __init__ (self):
+        self.time = 0
+
+    def __call__ (self):
+        return self.time
+
+
+class ProgressTrackerTest (TestCase):
+    def setUp (self):
+        self.clock = Clock()
+        self.tracker = fs.ProgressTracker(1, self.clock)
+        self.notified = []
+        self.tracker.on_change(self.notified.append)
+        self.op = fs.Delete(fs.File(('a',)))
+
+    def test_counts (self):
+        self.tracker.started([self.op])
+        self.tracker.report(self.op, 10, 100, 1, 2)
+        self.tracker.report(self.op, 5, 0, 1)
+        progress = self.tracker.progress
+        self.assertEqual(progress.operations, (self.op,))
+        self.assertEqual((progress.bytes_done, progress.bytes_total,
+                          progress.items_done, progress.items_total),
+                         (15, 100, 2, 2))
+
+    def test_throttle (self):
+        self.tracker.started([self.op])
+        for i in range(100):
+            self.tracker.report(self.op, 1)
+        self.assertEqual(len(self.notified), 1)
+        self.clock.time = 1
+        self.tracker.report(self.op, 1)
+        self.assertEqual(len(self.notified), 2)
+        self.assertEqual(self.notified[-1].bytes_done, 101)
+
+    def test_flush (self):
+        self.tracker.started([self.op])
+        self.tracker.report(self.op, 1)
+        self.tracker.flush()
+        self.assertEqual(self.notified[-1].bytes_done, 1)
+        n = len(self.notified)
+        self.tracker.flush()
+        self.assertEqual(len(self.notified), n)
+
+    def test_finish (self):
+        self.tracker.started([self.op])
+        self.tracker.report(self.op, 1)
+        self.tracker.finished([self.op])
+        # always notified once nothing is running
+        self.assertEqual(self.notified[-1].operations, ())
+        self.assertEqual(self.notified[-1].bytes_done, 1)
+        # counts reset for the next operation
+        self.tracker.started([self.op])
+        self.assertEqual(self.tracker.progress.bytes_done, 0)
+
+    def test_not_running (self):
+        self.tracker.report(self.op, 1)
+        self.assertEqual(self.tracker.progress.bytes_done, 0)
@@ -0,0 +1,136 @@
+import errno
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+from fsmanage import util
+
+from .opexec import RecordExecutor, deletes
+
+
+class FlakyExecutor (RecordExecutor):
+    """Executor whose operations fail transiently a given number of times.
+
+Operations on items named in :attr:`flaky` fail that many times without being
+reverted.
+
+"""
+
+    def __init__ (self, resumable=True):
+        RecordExecutor.__init__(self)
+        self.flaky = {}
+        self.metadata_failures = 0
+        self.support_operation(fs.Delete, self._execute, self._undo, resumable)
+
+    def _result (self, op):
+        if self.flaky.get(op.item.name):
+            self.flaky[op.item.name] -= 1
+            exc = fs.OperationException(op, False)
+            exc.transient = True
+            return util.failed(Future, exc)
+        return RecordExecutor._result(self, op)
+
+    def get_metadata (self, item, *properties):
+        self.calls.append(('get_metadata', item.name))
+        if self.metadata_failures:
+            self.metadata_failures -= 1
+            return util.failed(Future, TimeoutError())
+        return util.resolved(Future, {})
+
+
+class RetryTestCase (TestCase):
+    def setUp (self):
+        self.delays = []
+
+        def call_later (delay, fn):
+            self.delays.append(delay)
+            fn()
+
+        self.policy = fs.RetryPolicy(max_attempts=3, call_later=call_later,
+                                     random=lambda: 1)
+        self.executor = FlakyExecutor()
+        self.manager = fs.SynchronousOperationManager(
+            self.executor, fs.OperationHistory(Future),
+            retry_policy=self.policy)
+
+
+class RetryPolicyDelay (TestCase):
+    def test_backoff (self):
+        policy = fs.RetryPolicy(base_delay=1, max_delay=5, jitter=0)
+        self.assertEqual([policy.delay(n) for n in range(1, 6)],
+                         [1, 2, 4, 5, 5])
+
+    def test_jitter (self):
+        policy = fs.RetryPolicy(base_delay=2, jitter=.5, random=lambda: 1)
+        self.assertEqual(policy.delay(1), 1)
+        policy.random = lambda: 0
+        self.assertEqual(policy.delay(1), 2)
+
+    def test_is_transient (self):
+        policy = fs.RetryPolicy()
+        self.assertTrue(policy.is_transient(TimeoutError()))
+        self.assertTrue(policy.is_transient(OSError(errno.EBUSY, 'busy')))
+        self.assertFalse(policy.is_transient(OSError(errno.ENOENT, 'gone')))
+        self.assertFalse(policy.is_transient(ValueError()))
+        self.assertFalse(policy.is_transient(
+            fs.OperationException(deletes('x')[0])))
+
+
+class RetryManager (RetryTestCase):
+    def test_metadata (self):
+        self.executor.metadata_failures = 2
+        item = fs.File(('x',))
+        self.assertEqual(self.manager.get_metadata(item).result(), {})
+        self.assertEqual(len(self.executor.calls), 3)
+        self.assertEqual(self.delays, [.05, .1])
+
+    def test_max_attempts (self):
+        self.executor.metadata_failures = 3
+        future = self.manager.get_metadata(fs.File(('x',)))
+        self.assertIsInstance(future.exception(), TimeoutError)
+        self.assertEqual(len(self.executor.calls), 3)
+
+    def test_not_transient (self):
+        self.executor.fail.add('x')
+        result = self.manager.execute(deletes('x')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        self.assertEqual(self.executor.calls[0], ('execute', 'x'))
+        self.assertEqual(self.delays, [])
+
+    def test_resumable (self):
+        self.executor.flaky['x'] = 2
+        result = self.manager.execute(deletes('x')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertEqual(self.executor.calls, [('execute', 'x')] * 3)
+
+    def test_not_resumable (self):
+        self.executor = FlakyExecutor(False)
+        self.manager.executor = self.executor
+        self.executor.flaky['x'] = 1
+        self.manager.history.revert_on_failure = False
+        result = self.manager.execute(deletes('x')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        self.assertEqual(self.executor.calls, [('execute', 'x')])
+
+    def test_batch_subset (self):
+        self.executor.flaky['y'] = 1
+        result = self.manager.execute(deletes('a/x', 'a/y', 'a/z')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+        self.assertEqual(self.executor.calls, [
+            ('execute_batch', ['x', 'y', 'z']),
+            ('execute_batch', ['y']),
+        ])
+        self.assertCountEqual([item.name for item in result.result.items],
+                              ['x', 'y', 'z'])
+
+    def test_batch_partial_failure (self):
+        self.executor.flaky['y'] = 1
+        self.executor.fail.add('z')
+        self.manager.history.revert_on_failure = False
+        result = self.manager.execute(deletes('a/x', 'a/y', 'a/z')).result()
+        self.assertEqual(result.state, fs.HistoryEventResult.FAILED)
+        exc = result.result
+        self.assertIsInstance(exc, fs.BatchOperationException)
+        self.assertEqual([e.operation.item.name for e in exc.errors], ['z'])
+        self.assertCountEqual([op.item.name for op in exc.succeeded],
+                              ['x', 'y'])
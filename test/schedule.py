@@ -0,0 +1,155 @@
+import threading
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+from fsmanage import util
+
+
+def copy (src, dest):
+    return fs.Copy(fs.File(tuple(src.split('/'))), dest.split('/'))
+
+
+def move (src, dest):
+    return fs.Move(fs.File(tuple(src.split('/'))), dest.split('/'))
+
+
+def delete (path):
+    return fs.Delete(fs.File(tuple(path.split('/'))))
+
+
+class ScheduleGraph (TestCase):
+    def schedule (self, *ops):
+        return fs.Schedule([(op,) for op in ops])
+
+    def test_independent (self):
+        schedule = self.schedule(copy('a', 'x'), copy('a', 'y'),
+                                 delete('b/c'), move('d', 'e'))
+        self.assertEqual(schedule.dependencies, [set()] * 4)
+
+    def test_create_parent_first (self):
+        schedule = self.schedule(copy('a', 'x/y/z'), copy('b', 'x'))
+        self.assertEqual(schedule.dependencies, [{1}, set()])
+
+    def test_delete_child_first (self):
+        schedule = self.schedule(delete('x'), delete('x/y'))
+        self.assertEqual(schedule.dependencies, [{1}, set()])
+
+    def test_same_target (self):
+        schedule = self.schedule(copy('a', 'x'), delete('x'), copy('b', 'x'))
+        self.assertEqual(schedule.dependencies, [set(), {0}, {0, 1}])
+
+    def test_read_then_remove (self):
+        schedule = self.schedule(copy('a', 'x'), move('a/b', 'y'))
+        self.assertEqual(schedule.dependencies, [set(), {0}])
+
+    def test_unknown (self):
+        class Unknown (fs.Operation):
+            name = 'unknown'
+
+            def __init__ (self):
+                pass
+
+        schedule = self.schedule(delete('a'), Unknown(), delete('b'))
+        self.assertEqual(schedule.dependencies, [set(), {0}, {1}])
+
+    def test_cycle (self):
+        # the rules give 1 -> 0 -> 2 -> 1, so everything runs in order
+        schedule = self.schedule(delete('a'), copy('x', 'a/b'), copy('y', 'a'))
+        self.assertEqual(schedule.dependencies, [set(), {0}, {0, 1}])
+
+    def test_ordered (self):
+        schedule = fs.Schedule([(delete('a'),), (delete('b'),)], True)
+        self.assertEqual(schedule.dependencies, [set(), {0}])
+
+    def test_reversed (self):
+        schedule = self.schedule(copy('a', 'x'), copy('b', 'x/y')).reversed()
+        self.assertEqual(schedule.dependencies, [{1}, set()])
+        self.assertEqual(schedule.dependents, [set(), {0}])
+
+
+class ScheduleRun (TestCase):
+    def setUp (self):
+        self.schedule = fs.Schedule([
+            (copy('a', 'x'),), (copy('b', 'x/y'),), (copy('c', 'z'),)])
+        self.pending = {}
+        self.started = []
+
+    def start (self, i):
+        self.started.append(i)
+        self.pending[i] = Future()
+        return self.pending[i]
+
+    def test_order (self):
+        result = self.schedule.run(Future, self.start)
+        self.assertEqual(self.started, [0, 2])
+        self.pending[0].set_result('a')
+        self.assertEqual(self.started, [0, 2, 1])
+        self.pending[1].set_result('b')
+        self.assertFalse(result.done())
+        self.pending[2].set_result('c')
+        self.assertEqual([f.result() for f in result.result()],
+                         ['a', 'b', 'c'])
+
+    def test_failure (self):
+        result = self.schedule.run(Future, self.start,
+                                   lambda result: result != 'bad')
+        self.pending[0].set_result('bad')
+        self.assertEqual(self.started, [0, 2])
+        self.pending[2].set_result('c')
+        futures = result.result()
+        self.assertEqual(futures[0].result(), 'bad')
+        self.assertIsNone(futures[1])
+
+    def test_skip_dependents (self):
+        schedule = fs.Schedule([
+            (copy('a', 'x'),), (copy('b', 'x/y'),), (copy('c', 'z'),),
+            (copy('d', 'z/w'),)])
+        result = schedule.run(Future, self.start,
+                              lambda result: result != 'bad', True)
+        self.pending[0].set_result('bad')
+        self.pending[2].set_result('c')
+        self.assertEqual(self.started, [0, 2, 3])
+        self.assertFalse(result.done())
+        self.pending[3].set_result('d')
+        futures = result.result()
+        self.assertIsNone(futures[1])
+        self.assertEqual(futures[3].result(), 'd')
+
+    def test_long_chain (self):
+        schedule = fs.Schedule([(delete('a'),)] * 5000, True)
+        result = schedule.run(Future, lambda i: util.resolved(Future, i))
+        self.assertEqual(result.result()[-1].result(), 4999)
+
+
+class ThreadedManager (TestCase):
+    def test_parallel (self):
+        barrier = threading.Barrier(3, timeout=5)
+        executor = RecordingExecutor(barrier)
+        manager = fs.ThreadedOperationManager(
+            executor, fs.OperationHistory(Future), threads=3)
+        try:
+            result = manager.execute(
+                [delete('a'), delete('b'), delete('c')]).result(5)
+        finally:
+            manager.close()
+        self.assertEqual(result.state, fs.HistoryEventResult.SUCCESS)
+
+
+class RecordingExecutor (fs.OperationExecutor):
+    """Executor whose deletes all wait at a barrier, so only succeed if run
+at the same time."""
+
+    future_type = Future
+
+    def __init__ (self, barrier):
+        fs.OperationExecutor.__init__(self)
+        self.barrier = barrier
+        self.support_operation(fs.Delete, self._delete)
+
+    def _delete (self, op, confirm):
+        self.barrier.wait()
+        return util.resolved(Future, fs.AttentionItems())
+
+    def get_metadata (self, item, *properties):
+        return util.resolved(Future, {})
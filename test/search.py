@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+import fsmanage as fs
+
+from .util import tree_manager
+
+
+class NameIndex (TestCase):
+    def setUp (self):
+        self.manager = tree_manager()
+        self.executor = self.manager.executor
+        for path in (('docs',), ('docs', 'report.txt'),
+                     ('docs', 'Reports'), ('docs', 'Reports', 'q1.txt'),
+                     ('src',), ('src', 'repo.py')):
+            self.executor.add(
+                path, None if path[-1] in ('docs', 'Reports', 'src') else 1)
+        self.index = fs.NameIndex(self.manager)
+        self.index.index(fs.ROOT).result()
+
+    def paths (self, query, **kwargs):
+        return [item.path for item in self.index.search(query, **kwargs)]
+
+    def test_indexed (self):
+        self.assertEqual(len(self.index), 6)
+
+    def test_search (self):
+        self.assertEqual(self.paths('report')[:2],
+                         [('docs', 'Reports'), ('docs', 'report.txt')])
+
+    def test_fuzzy (self):
+        """Should find names sharing enough n-grams."""
+        self.assertIn(('src', 'repo.py'), self.paths('reprt', threshold=.3))
+        self.assertNotIn(('src', 'repo.py'), self.paths('reprt', threshold=1))
+
+    def test_result_type (self):
+        self.assertIsInstance(self.index.search('reports')[0], fs.Dir)
+
+    def test_case_sensitive (self):
+        self.index = fs.NameIndex(self.manager, case_sensitive=True)
+        self.index.index(fs.ROOT).result()
+        self.assertEqual(self.paths('Rep', threshold=1), [('docs', 'Reports')])
+
+    def test_attention (self):
+        """Should list changed directories again."""
+        self.executor.remove(('docs', 'Reports'))
+        self.executor.add(('src', 'q2.txt'), 1)
+        self.index.attention(fs.AttentionItems.CHANGED, fs.AttentionItems(
+            (fs.File(('src', 'q2.txt')),), fs.Dir(('docs',)))).result()
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.paths('q1.txt', threshold=1), [])
+        self.assertEqual(self.paths('q2.txt', threshold=1),
+                         [('src', 'q2.txt')])
+
+    def test_attention_marked (self):
+        self.executor.add(('src', 'q2.txt'), 1)
+        self.index.attention(fs.AttentionItems.MARKED, fs.AttentionItems(
+            (fs.File(('src', 'q2.txt')),))).result()
+        self.assertEqual(len(self.index), 6)
+
+    def test_remove (self):
+        self.index.remove(fs.Dir(('docs',)))
+        self.assertEqual(len(self.index), 2)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+import fsmanage as fs
+
+
+class PersistentSequenceTest (TestCase):
+    def test_empty (self):
+        seq = fs.PersistentSequence()
+        self.assertEqual(len(seq), 0)
+        self.assertEqual(seq, ())
+        self.assertRaises(IndexError, seq.__getitem__, 0)
+
+    def test_index (self):
+        seq = fs.PersistentSequence(range(100))
+        self.assertEqual([seq[i] for i in range(100)], list(range(100)))
+        self.assertEqual(seq[-1], 99)
+        self.assertRaises(IndexError, seq.__getitem__, 100)
+        self.assertRaises(IndexError, seq.__getitem__, -101)
+        self.assertEqual(seq.index(42), 42)
+
+    def test_slice (self):
+        items = tuple(range(50))
+        seq = fs.PersistentSequence(items)
+        for start in range(-3, 53, 4):
+            for stop in range(-3, 53, 5):
+                self.assertEqual(seq[start:stop], items[start:stop])
+        self.assertEqual(seq[::3], items[::3])
+        self.assertEqual(seq[::-1], items[::-1])
+
+    def test_changes (self):
+        seq = fs.PersistentSequence()
+        items = ()
+        for i in range(200):
+            seq = seq.appended(i)
+            items += (i,)
+        self.assertEqual(seq, items)
+        for n in (1, 7, 60):
+            seq = seq[n:]
+            items = items[n:]
+            seq = seq[:-n]
+            items = items[:-n]
+            self.assertEqual(seq, items)
+        seq = seq.replaced(5, 'x')
+        items = items[:5] + ('x',) + items[6:]
+        self.assertEqual(seq, items)
+        self.assertRaises(IndexError, seq.replaced, len(seq), 'x')
+
+    def test_unchanged (self):
+        seq = fs.PersistentSequence('abc')
+        seq.appended('d')
+        seq.replaced(0, 'x')
+        seq.extended(seq)
+        self.assertEqual(seq, tuple('abc'))
+
+    def test_extended (self):
+        left = fs.PersistentSequence(range(3))
+        right = fs.PersistentSequence(range(3, 100))
+        self.assertEqual(left.extended(right), tuple(range(100)))
+        self.assertEqual(right.extended(left),
+                         tuple(range(3, 100)) + (0, 1, 2))
+        self.assertEqual(left + (3, 4), (0, 1, 2, 3, 4))
+        self.assertEqual(left.extended([]), left)
+
+    def test_balanced (self):
+        seq = fs.PersistentSequence()
+        for i in range(1000):
+            seq = seq.appended(i)
+        for i in range(1000):
+            seq = fs.PersistentSequence([i]).extended(seq)
+        seq = seq[300:1700]
+        # at most 1.44 log2(n) for an AVL tree
+        self.assertLess(seq._root.height, 16)
+
+    def test_compare (self):
+        seq = fs.PersistentSequence('ab')
+        self.assertEqual(seq, fs.PersistentSequence('ab'))
+        self.assertEqual(hash(seq), hash(('a', 'b')))
+        self.assertNotEqual(seq, ('a',))
+        self.assertNotEqual(seq, ['a', 'b'])
+
+    def test_sum (self):
+        seq = fs.PersistentSequence(range(100))
+        self.assertEqual(seq.sum(), sum(range(100)))
+        self.assertEqual(seq[10:20].sum(), sum(range(10, 20)))
+        seq = seq.replaced(0, 1000).appended(5)
+        self.assertEqual(seq.sum(), sum(range(1, 100)) + 1005)
+        self.assertEqual(fs.PersistentSequence().sum(), 0)
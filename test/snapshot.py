@@ -0,0 +1,136 @@
+from unittest import TestCase
+
+import fsmanage as fs
+
+from .util import tree_manager
+
+
+def entries (*spec):
+    return [(fs.File(('d', name)), meta) for name, meta in spec]
+
+
+class DirSnapshotDiff (TestCase):
+    def test_diff (self):
+        old = fs.DirSnapshot(1, entries(('a', 1), ('b', 1), ('c', 1)))
+        new = fs.DirSnapshot(2, entries(('d', 1), ('c', 2), ('a', 1)))
+        added, removed, changed = old.diff(new, ('d',))
+        self.assertEqual(added, [fs.File(('d', 'd'))])
+        self.assertEqual(removed, [fs.File(('d', 'b'))])
+        self.assertEqual(changed, [fs.File(('d', 'c'))])
+
+    def test_type_change (self):
+        old = fs.DirSnapshot(1, entries(('a', 1)))
+        new = fs.DirSnapshot(2, [(fs.Dir(('d', 'a')), 1)])
+        added, removed, changed = old.diff(new, ('d',))
+        self.assertEqual(changed, [fs.Dir(('d', 'a'))])
+        self.assertIsInstance(changed[0], fs.Dir)
+
+    def test_empty (self):
+        self.assertEqual(fs.DirSnapshot(None, ()).diff(
+            fs.DirSnapshot(None, ()), ()), ([], [], []))
+
+
+class Poller (TestCase):
+    def setUp (self):
+        self.manager = tree_manager()
+        self.executor = self.manager.executor
+        self.executor.add(('dir',))
+        self.executor.add(('dir', 'sub'))
+        self.executor.add(('dir', 'file'), 5)
+        self.executor.add(('dir', 'sub', 'deep'), 1)
+        self.poller = fs.Poller(self.manager, (fs.Dir(('dir',)),), True)
+        self.changes = []
+        self.poller.on_change(
+            lambda attn_type, attn: self.changes.append((attn_type, attn)))
+        self.poller.poll().result()
+
+    def test_baseline (self):
+        self.assertEqual(self.changes, [])
+        self.assertEqual(self.poller.watched,
+                         frozenset((('dir',), ('dir', 'sub'))))
+
+    def test_no_change (self):
+        """Unchanged directories should only be queried for their mtime."""
+        self.executor.queries = 0
+        attn = self.poller.poll().result()
+        self.assertEqual(attn.items, ())
+        self.assertEqual(self.executor.queries, 2)
+        self.assertEqual(self.changes, [])
+
+    def test_changed (self):
+        self.executor.add(('dir', 'sub', 'new'), 3)
+        self.executor.queries = 0
+        attn = self.poller.poll().result()
+        self.assertEqual(attn.items, (fs.File(('dir', 'sub', 'new')),))
+        # 2 mtime checks, 1 listing and 2 entries in the changed directory
+        self.assertEqual(self.executor.queries, 5)
+        self.assertEqual(len(self.changes), 1)
+        attn_type, attn = self.changes[0]
+        self.assertEqual(attn_type, fs.AttentionItems.CHANGED)
+        self.assertEqual(attn.parent, fs.Dir(('dir', 'sub')))
+
+    def test_full (self):
+        """Should find in-place modifications when forced to list."""
+        self.executor.tree[('dir', 'file')]['size'] = 10
+        self.assertEqual(self.poller.poll().result().items, ())
+        self.assertEqual(self.poller.poll(True).result().items,
+                         (fs.File(('dir', 'file')),))
+
+    def test_removed (self):
+        self.executor.remove(('dir', 'sub'))
+        attn = self.poller.poll().result()
+        self.assertEqual(attn.items, ())
+        self.assertEqual(attn.parent, fs.Dir(('dir',)))
+        self.assertEqual(self.poller.watched, frozenset((('dir',),)))
+
+    def test_new_dir (self):
+        """Should watch new directories immediately."""
+        self.executor.add(('dir', 'new'))
+        self.poller.poll().result()
+        self.assertIn(('dir', 'new'), self.poller.watched)
+        self.executor.add(('dir', 'new', 'file'), 1)
+        self.assertEqual(self.poller.poll().result().items,
+                         (fs.File(('dir', 'new', 'file')),))
+
+
+class TreeSnapshot (TestCase):
+    def setUp (self):
+        self.manager = tree_manager()
+        self.executor = self.manager.executor
+        self.executor.add(('dir',))
+        self.executor.add(('dir', 'sub'))
+        self.executor.add(('dir', 'file'), 5)
+        self.executor.add(('dir', 'sub', 'deep'), 1)
+        self.snapshot = self.capture()
+
+    def capture (self):
+        return fs.capture_tree(self.manager, fs.Dir(('dir',))).result()
+
+    def test_capture (self):
+        self.assertEqual(self.snapshot.paths,
+                         (('file',), ('sub',), ('sub', 'deep')))
+        self.assertEqual(self.snapshot.items(), [
+            fs.File(('dir', 'file')), fs.Dir(('dir', 'sub')),
+            fs.File(('dir', 'sub', 'deep'))])
+
+    def test_equal (self):
+        self.assertEqual(self.snapshot, self.capture())
+
+    def test_diff (self):
+        self.executor.add(('dir', 'sub', 'new'), 2)
+        self.executor.remove(('dir', 'file'))
+        self.executor.modify(('dir', 'sub', 'deep'), 3)
+        new = self.capture()
+        self.assertNotEqual(self.snapshot, new)
+        added, removed, changed = self.snapshot.diff(new)
+        self.assertEqual(added.items, (fs.File(('dir', 'sub', 'new')),))
+        self.assertEqual(removed.items, (fs.File(('dir', 'file')),))
+        # the directory's mtime changed too
+        self.assertEqual(changed.items, (fs.Dir(('dir', 'sub')),
+                                         fs.File(('dir', 'sub', 'deep'))))
+        self.assertEqual(added.parent, fs.Dir(('dir',)))
+
+    def test_diff_incompatible (self):
+        other = fs.capture_tree(self.manager, fs.Dir(('dir',)),
+                                ('size',)).result()
+        self.assertRaises(ValueError, self.snapshot.diff, other)
@@ -0,0 +1,149 @@
+import time
+import threading
+from concurrent.futures import Future
+from unittest import TestCase
+
+import fsmanage as fs
+
+from .history import Clock
+from .opexec import RecordExecutor, deletes
+
+
+class TokenBucketTest (TestCase):
+    def setUp (self):
+        self.clock = Clock()
+
+    def test_rate (self):
+        bucket = fs.TokenBucket(10, current_time=self.clock)
+        bucket.consume(10)
+        self.assertEqual(bucket.delay(), 0)
+        bucket.consume(5)
+        self.assertEqual(bucket.delay(), .5)
+        self.clock.time = .5
+        self.assertEqual(bucket.delay(), 0)
+
+    def test_burst (self):
+        bucket = fs.TokenBucket(10, 20, current_time=self.clock)
+        self.clock.time = 100
+        bucket.consume(30)
+        self.assertEqual(bucket.delay(), 1)
+
+    def test_unlimited (self):
+        bucket = fs.TokenBucket(current_time=self.clock)
+        bucket.consume(1000)
+        self.assertEqual(bucket.delay(), 0)
+
+    def test_change_rate (self):
+        bucket = fs.TokenBucket(10, current_time=self.clock)
+        bucket.consume(20)
+        bucket.rate = 100
+        self.assertEqual(bucket.delay(), .1)
+        bucket.rate = None
+        self.assertEqual(bucket.delay(), 0)
+        # starts full again
+        bucket.rate = 10
+        bucket.consume(10)
+        self.assertEqual(bucket.delay(), 0)
+
+
+class ThrottleTest (TestCase):
+    def setUp (self):
+        self.clock = Clock()
+
+    def test_limits (self):
+        throttle = fs.Throttle(100, 2, current_time=self.clock)
+        throttle.report(None, bytes_done=150, items_done=1)
+        self.assertEqual(throttle.delay(), .5)
+        throttle.report(None, items_done=3)
+        self.assertEqual(throttle.delay(), 1)
+
+    def test_change (self):
+        throttle = fs.Throttle(100, current_time=self.clock)
+        throttle.report(None, bytes_done=300)
+        throttle.bytes_per_second = 200
+        self.assertEqual(throttle.delay(), 1)
+        self.clock.time = 2
+        throttle.burst_time = 0
+        throttle.report(None, bytes_done=100)
+        self.assertEqual(throttle.delay(), .5)
+
+    def test_no_burst (self):
+        throttle = fs.Throttle(100, burst_time=0, current_time=self.clock)
+        throttle.report(None, bytes_done=10)
+        self.assertEqual(throttle.delay(), .1)
+
+
+class ThrottleControl (TestCase):
+    def test_wait (self):
+        control = fs.OperationControl(fs.Throttle(1000, burst_time=0))
+        control.throttle.report(None, bytes_done=50)
+        start = time.monotonic()
+        control.checkpoint(None)
+        self.assertGreaterEqual(time.monotonic() - start, .04)
+
+    def test_cancel (self):
+        control = fs.OperationControl(fs.Throttle(1, burst_time=0))
+        control.throttle.report(None, bytes_done=100)
+        threading.Timer(.05, control.cancel).start()
+        start = time.monotonic()
+        self.assertRaises(fs.CancelledException, control.checkpoint, None)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_raise_limit (self):
+        throttle = fs.Throttle(1, burst_time=0)
+        control = fs.OperationControl()
+        throttle.report(None, bytes_done=100)
+
+        def unlimit ():
+            throttle.bytes_per_second = None
+
+        threading.Timer(.05, unlimit).start()
+        start = time.monotonic()
+        control.checkpoint(None, (throttle,))
+        self.assertLess(time.monotonic() - start, 5)
+
+
+class RecordThrottle (fs.Throttle):
+    def __init__ (self):
+        fs.Throttle.__init__(self)
+        self.reports = []
+
+    def report (self, op, *counts):
+        self.reports.append(op.item.name)
+        fs.Throttle.report(self, op, *counts)
+
+
+class ProgressExecutor (RecordExecutor):
+    """Executor whose deletes report an item done and reach a checkpoint."""
+
+    def __init__ (self):
+        RecordExecutor.__init__(self, False)
+
+    def _execute (self, op, confirm):
+        self.report_progress(op, items_done=1)
+        self.checkpoint(op)
+        return RecordExecutor._execute(self, op, confirm)
+
+
+class ThrottleManager (TestCase):
+    def setUp (self):
+        self.throttle = RecordThrottle()
+        self.manager = fs.SynchronousOperationManager(
+            ProgressExecutor(), fs.OperationHistory(Future),
+            throttle=self.throttle)
+
+    def test_manager (self):
+        self.manager.execute(deletes('x', 'y'))
+        self.assertEqual(self.throttle.reports, ['x', 'y'])
+
+    def test_group (self):
+        control = fs.OperationControl(RecordThrottle())
+        self.manager.execute(deletes('x'))
+        self.manager.execute(deletes('y'), control=control)
+        self.assertEqual(self.throttle.reports, ['x', 'y'])
+        self.assertEqual(control.throttle.reports, ['y'])
+
+    def test_shared (self):
+        control = fs.OperationControl(self.throttle)
+        self.manager.execute(deletes('x'), control=control)
+        self.assertEqual(self.throttle.reports, ['x'])
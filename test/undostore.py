@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import fsmanage as fs
+
+
+class UndoStoreTest (TestCase):
+    def setUp (self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'store')
+
+    def tearDown (self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip (self):
+        store = fs.UndoStore(self.path, chunk_size=4)
+        key = store.put('a', b'0123456789')
+        self.assertEqual(store.get(key), b'0123456789')
+        self.assertEqual(list(store.read(key)), [b'0123', b'4567', b'89'])
+        self.assertTrue(store.has('a'))
+        self.assertEqual(store.get(store.put('b', b'')), b'')
+
+    def test_dedup (self):
+        store = fs.UndoStore(self.path, chunk_size=4)
+        store.put('a', b'abcdabcd')
+        self.assertEqual(store.size, 5)
+        store.put('b', b'abcdefgh')
+        self.assertEqual(store.size, 10)
+        self.assertEqual(len(os.listdir(self.path)), 2)
+        self.assertEqual(store.size_of('a'), 10)
+        self.assertEqual(store.size_of('b'), 10)
+        self.assertEqual(store.size_of('c'), 0)
+
+    def test_release (self):
+        store = fs.UndoStore(self.path, chunk_size=4)
+        key = store.put('a', b'abcdefgh')
+        store.put('b', b'abcd')
+        store.release('a')
+        self.assertFalse(store.has('a'))
+        self.assertEqual(store.size, 5)
+        self.assertRaises(KeyError, store.get, key)
+        store.release('b')
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_compress (self):
+        store = fs.UndoStore(self.path, compress=True)
+        key = store.put('a', bytes(10000))
+        self.assertLess(store.size, 1000)
+        self.assertEqual(store.get(key), bytes(10000))
+        # stored as-is when compression doesn't help
+        key = store.put('b', bytes(range(256)))
+        self.assertEqual(store.get(key), bytes(range(256)))
+
+    def test_evict (self):
+        store = fs.UndoStore(self.path, chunk_size=10, max_bytes=25)
+        evicted = []
+        store.on_evict(evicted.append)
+        store.put('a', b'a' * 10)
+        store.put('b', b'b' * 10)
+        self.assertEqual(evicted, [])
+        # storing again makes 'a' the most recent
+        store.put('a', b'c' * 10)
+        self.assertEqual(evicted, ['b'])
+        store.put('d', b'd' * 10)
+        self.assertEqual(evicted, ['b', 'a'])
+        self.assertEqual(store.size, 11)
+        # doesn't fit at all
+        store.put('e', b'e' * 10 + b'f' * 10 + b'g' * 10)
+        self.assertEqual(evicted, ['b', 'a', 'd', 'e'])
+        self.assertEqual(store.size, 0)
+
+    def test_acquire (self):
+        store = fs.UndoStore(self.path)
+        key = store.put('a', b'data')
+        store = fs.UndoStore(self.path)
+        self.assertEqual(store.size, 5)
+        self.assertFalse(store.acquire('b', key + bytes(32)))
+        self.assertTrue(store.acquire('b', key))
+        store.collect()
+        self.assertEqual(store.get(key), b'data')
+        store.release('b')
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_collect (self):
+        store = fs.UndoStore(self.path)
+        key = store.put('a', b'data')
+        store = fs.UndoStore(self.path)
+        store.collect()
+        self.assertEqual(store.size, 0)
+        self.assertFalse(store.acquire('a', key))
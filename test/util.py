@@ -0,0 +1,73 @@
+from concurrent.futures import Future
+
+import fsmanage as fs
+
+
+class TreeExecutor (fs.OperationExecutor):
+    """In-memory executor for tests, supporting only metadata queries.
+
+``tree`` maps paths to dicts of metadata; directories have an ``items`` key
+holding a list of names.  :attr:`queries` counts calls to :meth:`get_metadata`.
+
+"""
+
+    future_type = Future
+
+    def __init__ (self):
+        fs.OperationExecutor.__init__(self)
+        self.tree = {(): {'items': [], 'mtime': 0}}
+        self.queries = 0
+        self.time = 0
+
+    def _touch (self, path):
+        self.time += 1
+        self.tree[path]['mtime'] = self.time
+
+    def add (self, path, size=None):
+        path = tuple(path)
+        meta = {'mtime': 0}
+        if size is None:
+            meta['items'] = []
+        else:
+            meta['size'] = size
+        self.tree[path] = meta
+        self.tree[path[:-1]]['items'].append(path[-1])
+        self._touch(path)
+        self._touch(path[:-1])
+
+    def remove (self, path):
+        path = tuple(path)
+        for p in list(self.tree):
+            if p[:len(path)] == path:
+                del self.tree[p]
+        self.tree[path[:-1]]['items'].remove(path[-1])
+        self._touch(path[:-1])
+
+    def modify (self, path, size):
+        path = tuple(path)
+        self.tree[path]['size'] = size
+        self._touch(path)
+
+    def item (self, path):
+        path = tuple(path)
+        return (fs.Dir if 'items' in self.tree[path] else fs.File)(path)
+
+    def get_metadata (self, item, *properties):
+        self.queries += 1
+        meta = self.tree.get(item.path)
+        result = {}
+        if meta is not None:
+            for prop in properties:
+                if prop == 'items' and 'items' in meta:
+                    result['items'] = [self.item(item.path + (name,))
+                                       for name in meta['items']]
+                elif prop in meta and prop != 'items':
+                    result[prop] = meta[prop]
+        future = Future()
+        future.set_result(result)
+        return future
+
+
+def tree_manager ():
+    """Create an operation manager using a new :class:`TreeExecutor`."""
+    return fs.SynchronousOperationManager(TreeExecutor(), None)